@@ -0,0 +1,189 @@
+"""
+Times each pipeline stage on synthetic data from synthetic_data at several sizes, and compares the times
+with the baselines stored in BENCHMARK_BASELINES_FILE.  The run fails if any stage is more than
+REGRESSION_TOLERANCE times slower than its baseline.  Baselines are only meaningful on the machine that
+recorded them, so they are kept out of version control: a stage without a baseline has this run's time
+recorded as its baseline, and --update-baselines records new ones for every stage run.
+
+    python benchmark.py [--sizes small medium] [--update-baselines]
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import time
+
+from common import setup_logging, BENCHMARK_BASELINES_FILE
+import form
+import performance_rating
+import process_upgrades
+import tidy_race_stats
+import upgrade_correlation
+from lap_analytics import lap_pace_summary, LAP_COLUMNS_NEEDED
+from position_stream import scan_positions
+from schema import apply_schema
+from synthetic_data import generate_dataset, generate_position_entries
+
+# seasons x races x drivers x laps
+SIZES = {
+    "small": dict(seasons=1, races=24, drivers=20, laps=60),
+    "medium": dict(seasons=5, races=24, drivers=20, laps=60),
+    "large": dict(seasons=20, races=24, drivers=22, laps=70),
+}
+REPEATS = 7
+# A stage regresses if it is this many times slower than its baseline, and slower by at least MIN_REGRESSION_SECONDS.
+# Stages with baselines under SHORT_STAGE_SECONDS vary more from run to run, and get SHORT_STAGE_TOLERANCE.
+REGRESSION_TOLERANCE = 2.0
+SHORT_STAGE_SECONDS = 0.01
+SHORT_STAGE_TOLERANCE = 3.0
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def prepare_inputs(size: str) -> dict:
+    """Returns the synthetic inputs of every stage for one size, computed outside of the timings."""
+    data = generate_dataset(**SIZES[size])
+    # With the dtypes the stages get from the stats store
+    data["stats"] = apply_schema(data["stats"])
+    df_tidy = tidy_race_stats.add_team_name_mapped_column(tidy_race_stats.add_driver_surname_column(data["stats"]))
+    df_scored = performance_rating.add_normalized_score_columns(df_tidy)
+    df_upgrades = data["upgrades"].copy()
+    df_upgrades["team_name_mapped"] = df_upgrades["Team Name"].map(process_upgrades.TEAM_NAME_MAPPING).fillna(df_upgrades["Team Name"])
+    df_fia_docs = data["fia_docs"].copy()
+    df_fia_docs["Filename"] = df_fia_docs["pdf_url"].str.rsplit("/", n=1).str[-1]
+    df_perf = performance_rating.add_weighted_score_column(df_scored)
+    df_upgrades_merged = process_upgrades.merge_upgrades_with_fia_docs(df_upgrades, df_fia_docs)
+    df_perf_merged = process_upgrades.merge_perf_with_upgrades(df_perf, df_upgrades_merged)
+    last_session = df_perf_merged["session_key"].max()
+    return {
+        **data,
+        "tidy": df_tidy,
+        "scored": df_scored,
+        "perf": df_perf,
+        "upgrades": df_upgrades,
+        "fia_docs": df_fia_docs,
+        "upgrades_merged": df_upgrades_merged,
+        "perf_merged": df_perf_merged,
+        # Form of every race but the last one
+        "form_engine": form.update_form(form.FormEngine(), df_perf_merged[df_perf_merged["session_key"] != last_session]),
+        "positions": generate_position_entries(data["stats"]),
+    }
+
+
+# name: (function of the inputs, sizes to run at; None for all).  The row-by-row normalization is
+# quadratic in the number of drivers per season, so only runs at the smallest size, and the upgrade
+# analysis takes several seconds per repeat at the largest.
+STAGES = {
+    "add_normalized_score_column": (
+        lambda d: performance_rating.add_normalized_score_column(d["tidy"], "avg_lap_time", False), ["small"]),
+    "add_normalized_score_columns": (lambda d: performance_rating.add_normalized_score_columns(d["tidy"]), None),
+    "add_weighted_score_column": (lambda d: performance_rating.add_weighted_score_column(d["scored"]), None),
+    "add_driver_surname_column": (lambda d: tidy_race_stats.add_driver_surname_column(d["stats"]), None),
+    "add_team_name_mapped_column": (lambda d: tidy_race_stats.add_team_name_mapped_column(d["stats"]), None),
+    "merge_upgrades_with_fia_docs": (
+        lambda d: process_upgrades.merge_upgrades_with_fia_docs(d["upgrades"], d["fia_docs"]), None),
+    "merge_perf_with_upgrades": (
+        lambda d: process_upgrades.merge_perf_with_upgrades(d["perf"], d["upgrades_merged"]), None),
+    "update_form_all_races": (lambda d: form.update_form(form.FormEngine(), d["perf_merged"]), None),
+    "update_form_one_race": (
+        lambda d: form.update_form(copy.deepcopy(d["form_engine"]), d["perf_merged"], changed_sessions=[]), None),
+    "analyze_upgrades": (lambda d: upgrade_correlation.analyze_upgrades(d["perf_merged"]), ["small", "medium"]),
+    "lap_pace_summary": (
+        lambda d: lap_pace_summary(d["laps"]["session_key"], *(d["laps"][col] for col in LAP_COLUMNS_NEEDED)), None),
+    "scan_positions": (lambda d: scan_positions(d["positions"]), None),
+}
+
+
+def time_stage(func, inputs: dict, repeats: int = REPEATS) -> float:
+    """Returns the fastest of repeats wall-clock timings of func(inputs), in seconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(inputs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes: list = None, stages: list = None) -> dict:
+    """Returns {'stage@size': seconds} for every stage at every size it runs at."""
+    results = {}
+    for size in sizes or list(SIZES):
+        inputs = prepare_inputs(size)
+        logging.info(f"Benchmarking size '{size}': {len(inputs['stats'])} driver rows, {len(inputs['laps']['lap_number'])} laps")
+        # The stages log their progress, which would otherwise be included in the timings
+        logging.disable(logging.INFO)
+        try:
+            for stage in stages or list(STAGES):
+                func, stage_sizes = STAGES[stage]
+                if stage_sizes is None or size in stage_sizes:
+                    results[f"{stage}@{size}"] = time_stage(func, inputs)
+        finally:
+            logging.disable(logging.NOTSET)
+    return results
+
+
+def load_baselines(path: str = BENCHMARK_BASELINES_FILE) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results: dict, path: str = BENCHMARK_BASELINES_FILE):
+    baselines = {**load_baselines(path), **{key: round(seconds, 6) for key, seconds in results.items()}}
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+    logging.info(f"Saved {len(results)} baselines to {path}")
+
+
+def tolerance(baseline: float) -> float:
+    return SHORT_STAGE_TOLERANCE if baseline < SHORT_STAGE_SECONDS else REGRESSION_TOLERANCE
+
+
+def find_regressions(results: dict, baselines: dict) -> list:
+    """Returns the 'stage@size' keys of results that regressed against their baselines."""
+    return [
+        key for key, seconds in results.items()
+        if key in baselines
+        and seconds > baselines[key] * tolerance(baselines[key])
+        and seconds - baselines[key] > MIN_REGRESSION_SECONDS
+    ]
+
+
+def main(sizes: list = None, stages: list = None, update_baselines: bool = False, path: str = BENCHMARK_BASELINES_FILE) -> int:
+    """Runs the benchmarks and returns the process exit code: 1 if any stage regressed against the baselines at path, else 0."""
+    results = run(sizes, stages)
+    baselines = load_baselines(path)
+    regressions = find_regressions(results, baselines)
+    for key, seconds in results.items():
+        baseline = baselines.get(key)
+        if baseline is None:
+            comparison = "no baseline"
+        else:
+            comparison = f"{seconds / baseline:.2f}x baseline {baseline * 1000:.1f} ms"
+        status = "REGRESSED" if key in regressions else "ok"
+        logging.info(f"{key:<45} {seconds * 1000:>10.1f} ms  {comparison:<32} {status}")
+
+    if update_baselines:
+        save_baselines(results, path)
+        return 0
+    missing = {key: seconds for key, seconds in results.items() if key not in baselines}
+    if missing:
+        logging.info(f"No baselines for {len(missing)} stages on this machine yet; recording these timings as theirs")
+        save_baselines(missing, path)
+    if regressions:
+        logging.error(f"{len(regressions)} stages regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), help="sizes to run (default: all)")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), help="stages to run (default: all)")
+    parser.add_argument("--update-baselines", action="store_true", help="store these timings as the new baselines")
+    args = parser.parse_args()
+    sys.exit(main(args.sizes, args.stages, args.update_baselines))
@@ -7,12 +7,60 @@ this, so that it generated consistently labelled constants for me.
 import logging
 
 CACHE_FILE_DRIVER_STATS = "data/f1_driver_stats.csv"
+# One SQLite shard per season; the single-file store used before is imported into it on first use
+CACHE_FOLDER_DRIVER_STATS = "data/f1_driver_stats"
+CACHE_DB_DRIVER_STATS = "data/f1_driver_stats.sqlite"
+DRIVER_STATS_TABLE = "driver_stats"
 CACHE_FILE_DRIVER_PERF = "data/f1_driver_perf.csv"
+# Normalization parameters the scores in CACHE_FILE_DRIVER_PERF were computed with
+CACHE_FILE_DRIVER_PERF_PARAMS = "data/f1_driver_perf_params.json"
 CACHE_FILE_FIA_DOCS = "data/fia_docs.csv"
 DATA_FILE_UPGRADES = "data/2025_fia_car_presentations.xlsx"
+DATA_FILE_UPGRADES_EXTRACTED = "data/fia_car_presentations_extracted.xlsx"
 OUTPUT_FILE_PERF_AND_UPGRADES = "data/f1_driver_perf_upgrades.xlsx"
+OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET = "data/f1_driver_perf_upgrades.parquet"
 CACHE_FOLDER_FIA_DOCS = "fia_docs"
+CACHE_FOLDER_FIA_EXTRACTS = "fia_docs_extracted"
+PIPELINE_STATE_FILE = "data/pipeline_state.json"
+FORM_STATE_FILE = "data/form_state.json"
+OUTPUT_FILE_FORM = "data/f1_form.parquet"
+OUTPUT_FILE_UPGRADE_CORRELATION = "data/f1_upgrade_correlation.csv"
+OUTPUT_FILE_LIVE_STANDINGS = "data/f1_live_standings.json"
+# Results kept by perf_query.py, and the local port it serves them on
+QUERY_CACHE_SIZE = 256
+QUERY_PORT = 8765
+BENCHMARK_BASELINES_FILE = "data/benchmark_baselines.json"
+METRICS_REPORT_FILE = "data/metrics_report.json"
+METRICS_TEXTFILE = "data/f1_pipeline.prom"
+# Concurrent PDF downloads from the FIA site
+FIA_DOWNLOAD_WORKERS = 4
+
+OPENF1_BASE_URL = "https://api.openf1.org/v1"
+# OpenF1 free tier quota as (requests per second, burst size) token buckets: 3 per second and 30 per minute
+OPENF1_RATE_LIMITS = [(3.0, 3), (30 / 60, 30)]
+# Live polling of /laps and /position every second needs an OpenF1 account, with a quota above the free tier
+OPENF1_LIVE_RATE_LIMITS = [(6.0, 6)]
+OPENF1_MAX_WORKERS = 4
+OPENF1_MAX_RETRIES = 5
+# Seasons ingested concurrently, each into its own store shard
+INGEST_SEASON_WORKERS = 4
+
+CACHE_FOLDER_OPENF1 = "openf1_cache"
+CACHE_FOLDER_LAPS = "lap_store"
+CACHE_FOLDER_XLSX = "xlsx_cache"
+# Recorded sessions streamed by replay_server.py
+CACHE_FOLDER_REPLAYS = "replays"
+OPENF1_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Seconds before a cached response expires; endpoints not listed, and any past season, never expire
+OPENF1_CACHE_TTLS = {"sessions": 60 * 60}
+# Responses that may still change expire after OPENF1_CACHE_PROVISIONAL_TTL seconds: empty ones, and those
+# for a session that ended less than OPENF1_SESSION_SETTLE_SECONDS ago or has not ended yet
+OPENF1_CACHE_PROVISIONAL_TTL = 5 * 60
+OPENF1_SESSION_SETTLE_SECONDS = 2 * 60 * 60
 
 
 def setup_logging():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # Imported here because instrumentation imports its file paths from this module
+    import instrumentation
+    instrumentation.enable_from_env()
@@ -5,14 +5,22 @@ next function.  Smarter prompting could undoubtedly have got it to write more fu
 """
 
 import os
+import json
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
 import pandas as pd
 import requests
-from common import setup_logging, CACHE_FILE_FIA_DOCS, CACHE_FOLDER_FIA_DOCS
+from requests.adapters import HTTPAdapter
+import instrumentation
+from common import setup_logging, CACHE_FILE_FIA_DOCS, CACHE_FOLDER_FIA_DOCS, FIA_DOWNLOAD_WORKERS
+
+FIA_DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 def load_and_update_fia_docs():
-    setup_logging()
     # Try to load the cache file
     if os.path.exists(CACHE_FILE_FIA_DOCS):
         df = pd.read_csv(CACHE_FILE_FIA_DOCS)
@@ -71,12 +79,163 @@ def load_and_update_fia_docs():
         last_race_number = race_number
 
 
-def download_missing_fia_pdfs():
+def _meta_path(local_path: str) -> str:
+    return f"{local_path}.meta.json"
+
+
+def _load_meta(local_path: str) -> dict:
+    try:
+        with open(_meta_path(local_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_meta(local_path: str, meta: dict):
+    tmp_path = f"{_meta_path(local_path)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, _meta_path(local_path))
+
+
+def _sha256_of(path: str):
+    # The running hash object, so that a resumed download can go on adding to it
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def _file_sha256(path: str) -> str:
+    return _sha256_of(path).hexdigest()
+
+
+def _content_range_total(value) -> int:
+    """Returns the total size in a Content-Range header such as 'bytes */1234', or None if it is missing or unknown."""
+    try:
+        return int(value.rsplit("/", 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _is_pdf(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(5) == b"%PDF-"
+
+
+def make_download_session(max_workers: int = FIA_DOWNLOAD_WORKERS) -> requests.Session:
+    """Returns a requests.Session with a connection pool sized for max_workers concurrent downloads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download_pdf(session: requests.Session, pdf_url: str, local_path: str, revalidate: bool = True) -> str:
     """
-    Loads the FIA docs cache and downloads any missing PDFs to the local folder.
+    Downloads pdf_url to local_path, streaming into local_path + '.part' and renaming it into place only
+    once the body is complete and verified.  Returns one of 'downloaded', 'resumed', 'unchanged' or 'skipped'.
+
+    - A local file whose SHA-256 no longer matches its sidecar metadata is downloaded again.
+    - An existing file is revalidated with If-None-Match / If-Modified-Since when revalidate is True.
+    - A '.part' file left by an interrupted download is resumed with an HTTP Range request, guarded by
+      If-Range so that a changed document is downloaded from scratch instead.  If the server answers
+      416 because the '.part' file already holds the whole document, it is verified and used as is;
+      if it holds more than the document, it is discarded and the download starts again.
+    - The download must match any Content-Length sent, and start with the PDF file signature.
     """
+    meta = _load_meta(local_path)
+    part_path = f"{local_path}.part"
+    headers = {}
 
-    setup_logging()
+    if os.path.exists(local_path):
+        sha256 = _file_sha256(local_path)
+        if meta.get("sha256") not in (None, sha256):
+            logging.warning(f"Checksum mismatch for {local_path}; downloading again")
+            meta = {}
+        else:
+            if not meta:
+                # Downloaded before metadata was recorded
+                meta = {"url": pdf_url, "sha256": sha256, "size": os.path.getsize(local_path),
+                        "last_modified": formatdate(os.path.getmtime(local_path), usegmt=True)}
+                _save_meta(local_path, meta)
+            if not revalidate:
+                return "skipped"
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+    offset = 0
+    partial = meta.get("partial", {})
+    if not headers and os.path.exists(part_path) and (partial.get("etag") or partial.get("last_modified")):
+        offset = os.path.getsize(part_path)
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = partial.get("etag") or partial.get("last_modified")
+
+    with session.get(pdf_url, headers=headers, stream=True, timeout=FIA_DOWNLOAD_TIMEOUT) as resp:
+        if resp.status_code == 304:
+            return "unchanged"
+        if resp.status_code == 416 and offset:
+            if _content_range_total(resp.headers.get("Content-Range")) != offset:
+                logging.warning(f"Partial download of {local_path} does not fit the document; downloading again")
+                os.remove(part_path)
+                meta.pop("partial", None)
+                _save_meta(local_path, meta)
+                return download_pdf(session, pdf_url, local_path, revalidate)
+            # The interrupted download had already received the whole document
+            resumed = True
+            validators = partial
+            digest = _sha256_of(part_path)
+        elif resp.status_code not in (200, 206):
+            raise Exception(f"HTTP {resp.status_code}")
+        else:
+            resumed = resp.status_code == 206
+            if resumed:
+                digest = _sha256_of(part_path)
+            else:
+                digest = hashlib.sha256()
+                offset = 0
+            validators = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+            meta["partial"] = validators
+            _save_meta(local_path, meta)
+
+            with open(part_path, "ab" if resumed else "wb") as f:
+                for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+
+            expected_size = resp.headers.get("Content-Length")
+            received = os.path.getsize(part_path) - offset
+            if expected_size is not None and int(expected_size) != received:
+                raise Exception(f"Incomplete download: expected {expected_size} bytes, received {received}")
+
+    if not _is_pdf(part_path):
+        os.remove(part_path)
+        del meta["partial"]
+        if meta:
+            _save_meta(local_path, meta)
+        else:
+            os.remove(_meta_path(local_path))
+        raise Exception("Downloaded file is not a PDF")
+
+    os.replace(part_path, local_path)
+    _save_meta(local_path, {
+        "url": pdf_url,
+        "sha256": digest.hexdigest(),
+        "size": os.path.getsize(local_path),
+        **validators,
+    })
+    return "resumed" if resumed else "downloaded"
+
+
+def download_missing_fia_pdfs(max_workers: int = FIA_DOWNLOAD_WORKERS, revalidate: bool = True):
+    """
+    Loads the FIA docs cache and downloads any missing or changed PDFs to the local folder, up to
+    max_workers at a time over a shared connection pool.  See download_pdf.
+    """
     if not os.path.exists(CACHE_FILE_FIA_DOCS):
         logging.info("FIA docs cache file does not exist.")
         return
@@ -88,27 +247,26 @@ def download_missing_fia_pdfs():
     df = pd.read_csv(CACHE_FILE_FIA_DOCS)
     logging.info(f"Loaded FIA docs cache: {df.shape}")
 
-    for idx, row in df.iterrows():
-        pdf_url = row["pdf_url"]
+    def download(pdf_url):
         filename = os.path.basename(pdf_url)
         local_path = os.path.join(CACHE_FOLDER_FIA_DOCS, filename)
-        if os.path.exists(local_path):
-            logging.info(f"Already downloaded: {filename}")
-            continue
         try:
-            logging.info(f"Downloading {pdf_url} ...")
-            resp = requests.get(pdf_url, timeout=30)
-            if resp.status_code == 200:
-                with open(local_path, "wb") as f:
-                    f.write(resp.content)
-                logging.info(f"Downloaded and saved: {filename}")
-            else:
-                logging.info(f"Failed to download {pdf_url}: HTTP {resp.status_code}")
+            result = download_pdf(session, pdf_url, local_path, revalidate=revalidate)
+            logging.info(f"{result.capitalize()}: {filename}")
+            return result
         except Exception as e:
             logging.info(f"Error downloading {pdf_url}: {e}")
+            return "failed"
+
+    pdf_urls = df["pdf_url"].dropna().unique()
+    session = make_download_session(max_workers)
+    with instrumentation.stage("download_fia_pdfs", rows=len(pdf_urls)), session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(download, pdf_urls))
+    logging.info(f"FIA PDF downloads: { {result: results.count(result) for result in sorted(set(results))} }")
 
 
 
 if __name__ == "__main__":
+    setup_logging()
     load_and_update_fia_docs()
     download_missing_fia_pdfs()
@@ -0,0 +1,239 @@
+"""
+Extracts the upgrade tables from the FIA Car Presentation Submission PDFs in CACHE_FOLDER_FIA_DOCS into
+the same columns as DATA_FILE_UPGRADES, so they no longer have to be transcribed by hand.  Documents are
+parsed in a process pool, one document per worker, and the tables and team headings found on each page
+are cached under the SHA-256 of the PDF, so unchanged documents are never parsed again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pdfplumber
+
+import instrumentation
+from common import (
+    setup_logging,
+    CACHE_FOLDER_FIA_DOCS,
+    CACHE_FOLDER_FIA_EXTRACTS,
+    DATA_FILE_UPGRADES_EXTRACTED,
+)
+from process_upgrades import TEAM_NAME_MAPPING
+
+# Bump to invalidate cached page extracts when extract_page changes
+EXTRACTOR_VERSION = 1
+
+UPGRADE_COLUMNS = [
+    "Updated component",
+    "Primary reason for update",
+    "Geometric differences compared to previous version",
+    "Brief description on how the update works",
+]
+UPGRADE_FILE_COLUMNS = ["Filename", "Team Name"] + UPGRADE_COLUMNS
+# A word that identifies each column in the header row of an upgrade table
+HEADER_KEYWORDS = {"component": 0, "reason": 1, "geometric": 2, "description": 3}
+# Team names as printed in the documents, longest first so that no name is matched by a shorter one
+TEAM_NAMES = sorted(list(TEAM_NAME_MAPPING) + ["Red Bull Racing"], key=len, reverse=True)
+# Component cell values used by teams to say they brought no upgrades
+NO_UPDATE_VALUES = {"", "-", "n/a", "na", "none", "no updates", "no update", "nil"}
+
+
+def _clean(cell):
+    return " ".join(cell.split()) if cell is not None else None
+
+
+def _team_in(text: str) -> str:
+    """Returns the first of TEAM_NAMES in text, or None."""
+    text = text.casefold()
+    return next((name for name in TEAM_NAMES if name.casefold() in text), None)
+
+
+def _team_row(row: list) -> str:
+    """Returns the team named by a table row that is one cell merged across the table, else None."""
+    if len(row) < 2 or not row[0] or any(cell is not None for cell in row[1:]):
+        return None
+    return _team_in(row[0])
+
+
+def _inside(line: dict, bbox) -> bool:
+    x0, top, x1, bottom = bbox
+    return line["x0"] >= x0 and line["x1"] <= x1 and line["top"] >= top and line["bottom"] <= bottom
+
+
+def extract_page(page) -> dict:
+    """
+    Returns the team headings and tables on a pdfplumber page, each with its distance from the top of the
+    page: {'teams': [[top, team_name], ...], 'tables': [[top, rows], ...]}.  Table cells covered by a
+    merged cell are None.
+    """
+    tables = page.find_tables()
+    teams = []
+    for line in page.extract_text_lines():
+        if any(_inside(line, table.bbox) for table in tables):
+            continue
+        name = _team_in(_clean(line["text"]))
+        if name is not None:
+            teams.append([line["top"], name])
+    return {
+        "teams": teams,
+        "tables": [[table.bbox[1], [[_clean(cell) for cell in row] for row in table.extract()]] for table in tables],
+    }
+
+
+def extract_document(path: str) -> list:
+    """Returns extract_page for every page of a PDF."""
+    with pdfplumber.open(path) as pdf:
+        return [extract_page(page) for page in pdf.pages]
+
+
+def _header_columns(row: list) -> dict:
+    """Returns {cell index: UPGRADE_COLUMNS index} if row is the header row of an upgrade table, else None."""
+    columns = {}
+    for i, cell in enumerate(row):
+        for keyword, col in HEADER_KEYWORDS.items():
+            if cell and keyword in cell.casefold() and col not in columns.values():
+                columns[i] = col
+                break
+    return columns if 0 in columns.values() and len(columns) >= 3 else None
+
+
+def assemble_upgrades(filename: str, pages: list) -> list:
+    """
+    Returns one dict per upgraded component, with the keys in UPGRADE_FILE_COLUMNS, from the pages
+    returned by extract_document.  Each table is assigned to the nearest team heading above it, and a
+    table at the top of a page with no header row continues the previous page's upgrade table, and a
+    row that is a team name merged across the table starts that team's upgrades.
+    Merged cells take the value of the cell above them (one description shared by several components),
+    or to their left in the first row, and a row with an empty component continues the row above it.
+    """
+    rows = []
+    team = None
+    columns = None
+    for page in pages:
+        elements = sorted([(top, 0, name) for top, name in page["teams"]] + [(top, 1, table) for top, table in page["tables"]],
+                          key=lambda element: element[:2])
+        for position, (_, kind, value) in enumerate(elements):
+            if kind == 0:
+                team, columns = value, None
+                continue
+            table = value
+            while table and _team_row(table[0]):
+                team, columns = _team_row(table[0]), None
+                table = table[1:]
+            header = _header_columns(table[0]) if table else None
+            if header is not None:
+                columns, table = header, table[1:]
+                previous = None
+            elif columns is None or position > 0 or not rows:
+                continue
+            else:
+                previous = rows[-1]
+
+            for row in table:
+                if _team_row(row):
+                    team, previous = _team_row(row), None
+                    continue
+                values = [None] * len(UPGRADE_COLUMNS)
+                for i, col in columns.items():
+                    if i < len(row):
+                        values[col] = row[i]
+                for col, cell in enumerate(values):
+                    if cell is None:
+                        if previous is not None:
+                            values[col] = previous[UPGRADE_COLUMNS[col]]
+                        elif col > 0:
+                            values[col] = values[col - 1]
+                if not any(values):
+                    continue
+                if not values[0]:
+                    if previous is not None:
+                        for col, cell in enumerate(values[1:], start=1):
+                            if cell and cell != previous[UPGRADE_COLUMNS[col]]:
+                                previous[UPGRADE_COLUMNS[col]] = f"{previous[UPGRADE_COLUMNS[col]] or ''} {cell}".strip()
+                    continue
+                if values[0].casefold() in NO_UPDATE_VALUES:
+                    continue
+                previous = {"Filename": filename, "Team Name": team, **dict(zip(UPGRADE_COLUMNS, values))}
+                rows.append(previous)
+    return rows
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_path(sha256: str, cache_folder: str) -> str:
+    return os.path.join(cache_folder, f"{sha256}.json")
+
+
+def load_cached_pages(sha256: str, cache_folder: str = CACHE_FOLDER_FIA_EXTRACTS) -> list:
+    """Returns the cached page extracts of a PDF by its SHA-256, or None if they are missing or stale."""
+    try:
+        with open(_cache_path(sha256, cache_folder)) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return entry["pages"] if entry.get("version") == EXTRACTOR_VERSION else None
+
+
+def save_cached_pages(sha256: str, filename: str, pages: list, cache_folder: str = CACHE_FOLDER_FIA_EXTRACTS):
+    os.makedirs(cache_folder, exist_ok=True)
+    path = _cache_path(sha256, cache_folder)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": EXTRACTOR_VERSION, "filename": filename, "pages": pages}, f)
+    os.replace(tmp_path, path)
+
+
+def extract_upgrades(folder: str = CACHE_FOLDER_FIA_DOCS, cache_folder: str = CACHE_FOLDER_FIA_EXTRACTS,
+                     max_workers: int = None) -> pd.DataFrame:
+    """
+    Returns the upgrades in every PDF in folder as a DataFrame with UPGRADE_FILE_COLUMNS, in filename
+    order.  Only documents without cached page extracts are parsed, across up to max_workers processes
+    (default: one per CPU).  A document that fails to parse is logged and left out.
+    """
+    filenames = sorted(name for name in os.listdir(folder) if name.lower().endswith(".pdf"))
+    hashes = {name: file_sha256(os.path.join(folder, name)) for name in filenames}
+    pages = {}
+    for name in filenames:
+        cached = load_cached_pages(hashes[name], cache_folder)
+        instrumentation.record_cache("fia_page_extracts", hit=cached is not None)
+        if cached is not None:
+            pages[name] = cached
+    to_parse = [name for name in filenames if name not in pages]
+    logging.info(f"Extracting upgrades from {len(filenames)} FIA documents ({len(to_parse)} not cached)")
+
+    if to_parse:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(extract_document, os.path.join(folder, name)): name for name in to_parse}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    pages[name] = future.result()
+                except Exception as e:
+                    logging.error(f"Error extracting {name}: {e}")
+                    continue
+                save_cached_pages(hashes[name], name, pages[name], cache_folder)
+
+    rows = [row for name in filenames if name in pages for row in assemble_upgrades(name, pages[name])]
+    instrumentation.set_rows(len(rows))
+    return pd.DataFrame(rows, columns=UPGRADE_FILE_COLUMNS)
+
+
+@instrumentation.timed("extract_fia_upgrades")
+def main():
+    df = extract_upgrades()
+    df.to_excel(DATA_FILE_UPGRADES_EXTRACTED, index=False)
+    logging.info(f"Extracted {len(df)} upgrades from {df['Filename'].nunique()} documents to {DATA_FILE_UPGRADES_EXTRACTED}")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
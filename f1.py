@@ -0,0 +1,443 @@
+"""
+Single command line entry point for every stage of the project:
+
+    python f1.py <command> [options]
+
+Each stage's module is only imported when its command runs, so pandas, requests and openpyxl are never
+loaded by commands that do not need them.  The status and inspect commands only use the standard
+library, reading the stores, output files and last-run records directly, so they start about as fast as
+the interpreter does and can be run cheaply from cron jobs and health checks.  Do not import any module
+that imports pandas at the top of this file.
+"""
+
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from common import (
+    setup_logging,
+    CACHE_DB_DRIVER_STATS,
+    CACHE_FILE_DRIVER_PERF,
+    CACHE_FILE_DRIVER_STATS,
+    CACHE_FILE_FIA_DOCS,
+    CACHE_FOLDER_DRIVER_STATS,
+    CACHE_FOLDER_FIA_DOCS,
+    CACHE_FOLDER_LAPS,
+    CACHE_FOLDER_OPENF1,
+    DRIVER_STATS_TABLE,
+    FORM_STATE_FILE,
+    METRICS_REPORT_FILE,
+    OUTPUT_FILE_FORM,
+    OUTPUT_FILE_LIVE_STANDINGS,
+    OUTPUT_FILE_PERF_AND_UPGRADES,
+    OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET,
+    OUTPUT_FILE_UPGRADE_CORRELATION,
+    PIPELINE_STATE_FILE,
+    QUERY_PORT,
+)
+
+OUTPUT_FILES = [
+    CACHE_FILE_DRIVER_STATS,
+    CACHE_FILE_DRIVER_PERF,
+    OUTPUT_FILE_PERF_AND_UPGRADES,
+    OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET,
+    OUTPUT_FILE_FORM,
+    OUTPUT_FILE_UPGRADE_CORRELATION,
+    OUTPUT_FILE_LIVE_STANDINGS,
+]
+SHARD_PATTERN = re.compile(r"season_year=(\d+)\.sqlite$")
+PARTITION_PATTERN = re.compile(r"(?:season_year|session_key)=(\d+)$")
+
+
+def _seasons(values) -> list:
+    return [int(value) for value in values] if values else None
+
+
+def _given(args, *names) -> dict:
+    # Options left unset fall back to the defaults of the stage's own main()
+    return {name: getattr(args, name) for name in names if getattr(args, name) is not None}
+
+
+# Stage commands; each imports its module when it runs
+
+def cmd_ingest(args):
+    import query_race_stats
+    query_race_stats.main(bulk=not args.per_driver, offline=args.offline, season_years=_seasons(args.seasons))
+
+
+def cmd_tidy(args):
+    import tidy_race_stats
+    tidy_race_stats.main(season_years=_seasons(args.seasons))
+
+
+def cmd_rating(args):
+    import performance_rating
+    performance_rating.main(incremental=not args.full, season_years=_seasons(args.seasons))
+
+
+def cmd_upgrades(args):
+    import process_upgrades
+    process_upgrades.main()
+
+
+def cmd_form(args):
+    import form
+    form.main()
+
+
+def cmd_correlation(args):
+    import upgrade_correlation
+    upgrade_correlation.main(**_given(args, "resamples", "max_workers"))
+
+
+def cmd_laps(args):
+    import lap_store
+    lap_store.main(offline=not args.online)
+
+
+def cmd_pace(args):
+    import lap_analytics
+    lap_analytics.main()
+
+
+def cmd_docs(args):
+    import download_fia_docs
+    if args.add:
+        download_fia_docs.load_and_update_fia_docs()
+    download_fia_docs.download_missing_fia_pdfs(revalidate=not args.no_revalidate)
+
+
+def cmd_extract(args):
+    import extract_fia_upgrades
+    extract_fia_upgrades.main()
+
+
+def cmd_pipeline(args):
+    import pipeline
+    results = pipeline.run(fetch=args.fetch, force=args.force, season_years=_seasons(args.seasons))
+    logging.info(f"Pipeline finished: {results}")
+
+
+def cmd_live(args):
+    import live_race
+    live_race.main(args.session_key, **_given(args, "base_url", "interval", "idle_timeout"))
+
+
+def cmd_replay(args):
+    import replay_server
+    replay_server.main(args.session_key, record=args.record, serve_port=args.serve, synthetic=args.synthetic, **_given(args, "speed"))
+
+
+def cmd_benchmark(args):
+    import benchmark
+    return benchmark.main(args.sizes, args.stages, args.update_baselines)
+
+
+def cmd_query(args):
+    import perf_query
+    if args.serve is not None:
+        perf_query.main(args.serve)
+        return
+    malformed = [f for f in args.filters if "=" not in f]
+    if malformed:
+        logging.error(f"Filters must be COLUMN=VALUE, not {' '.join(malformed)}")
+        return 2
+    filters = dict(f.split("=", 1) for f in args.filters)
+    try:
+        rows = perf_query.PerfQuery().query(sort=args.sort, limit=args.limit, upgraded=args.upgraded, **filters)
+    except ValueError as e:
+        logging.error(e)
+        return 2
+    print(json.dumps(rows, indent=2))
+
+
+# Status and inspect, with the standard library only
+
+def _connect_read_only(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+
+
+def _shards(folder: str = CACHE_FOLDER_DRIVER_STATS) -> dict:
+    # Shard paths as in stats_store.shard_path, by season
+    shards = {}
+    for path in glob.glob(os.path.join(folder, "season_year=*.sqlite")):
+        match = SHARD_PATTERN.search(path)
+        if match:
+            shards[int(match.group(1))] = path
+    return dict(sorted(shards.items()))
+
+
+def _partitions(folder: str) -> dict:
+    if not os.path.isdir(folder):
+        return {}
+    return {int(match.group(1)): entry.path for entry in os.scandir(folder)
+            if entry.is_dir() and (match := PARTITION_PATTERN.search(entry.name))}
+
+
+def _file_info(path: str, now: float) -> dict:
+    if not os.path.exists(path):
+        return {"path": path, "exists": False}
+    stat = os.stat(path)
+    return {"path": path, "exists": True, "bytes": stat.st_size, "modified_at": stat.st_mtime, "age_seconds": now - stat.st_mtime}
+
+
+def _load_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def store_coverage() -> dict:
+    """Returns the rows, races and lap store sessions of every season in the driver stats store."""
+    lap_seasons = _partitions(CACHE_FOLDER_LAPS)
+    seasons = {}
+    for season, path in _shards().items():
+        conn = _connect_read_only(path)
+        try:
+            rows, races = conn.execute(f"SELECT COUNT(*), COUNT(DISTINCT session_key) FROM {DRIVER_STATS_TABLE}").fetchone()
+        finally:
+            conn.close()
+        seasons[str(season)] = {
+            "rows": rows,
+            "races": races,
+            "lap_sessions": len(_partitions(lap_seasons[season])) if season in lap_seasons else 0,
+        }
+    return seasons
+
+
+def response_cache_usage(folder: str = CACHE_FOLDER_OPENF1) -> dict:
+    files, total_bytes = 0, 0
+    if os.path.isdir(folder):
+        for shard in os.scandir(folder):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".json.gz"):
+                        files += 1
+                        total_bytes += entry.stat().st_size
+    return {"responses": files, "bytes": total_bytes}
+
+
+def fia_docs_coverage() -> dict:
+    listed = 0
+    if os.path.exists(CACHE_FILE_FIA_DOCS):
+        with open(CACHE_FILE_FIA_DOCS, newline="") as f:
+            listed = sum(1 for row in csv.DictReader(f) if row.get("pdf_url"))
+    downloaded = len(glob.glob(os.path.join(CACHE_FOLDER_FIA_DOCS, "*.pdf")))
+    return {"listed": listed, "downloaded": downloaded}
+
+
+def last_run() -> dict:
+    """Returns what is known of the last pipeline run and the last run with metrics enabled."""
+    state = _load_json(PIPELINE_STATE_FILE) or {}
+    metrics = _load_json(METRICS_REPORT_FILE)
+    form_state = _load_json(FORM_STATE_FILE)
+    return {
+        "pipeline": state.get("last_run"),
+        "pipeline_stages": sorted(stage for stage in state if stage != "last_run"),
+        "metrics": None if metrics is None else {
+            "finished_at": metrics.get("finished_at"),
+            "stages": {name: round(stage["wall_seconds"], 3) for name, stage in metrics.get("stages", {}).items()},
+        },
+        "form_races": len(form_state["races"]) if form_state else 0,
+    }
+
+
+def status() -> dict:
+    now = time.time()
+    return {
+        "checked_at": now,
+        "store": store_coverage(),
+        "legacy_store": os.path.exists(CACHE_DB_DRIVER_STATS),
+        "response_cache": response_cache_usage(),
+        "fia_docs": fia_docs_coverage(),
+        "outputs": [_file_info(path, now) for path in OUTPUT_FILES],
+        "last_run": last_run(),
+    }
+
+
+def _age(seconds: float) -> str:
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{seconds / size:.1f}{unit}"
+    return f"{seconds:.0f}s"
+
+
+def _timestamp(value) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(value)) if value else "never"
+
+
+def print_status(report: dict):
+    print("Driver stats store:")
+    if not report["store"]:
+        print(f"  empty{' (legacy store not yet imported)' if report['legacy_store'] else ''}")
+    for season, coverage in report["store"].items():
+        print(f"  {season}: {coverage['races']} races, {coverage['rows']} rows, laps stored for {coverage['lap_sessions']} races")
+    cache = report["response_cache"]
+    print(f"OpenF1 response cache: {cache['responses']} responses, {cache['bytes'] / 1024 ** 2:.1f} MiB")
+    print(f"FIA documents: {report['fia_docs']['downloaded']} of {report['fia_docs']['listed']} downloaded")
+    print("Outputs:")
+    for output in report["outputs"]:
+        detail = f"{output['bytes'] / 1024:.0f} KiB, updated {_age(output['age_seconds'])} ago" if output["exists"] else "missing"
+        print(f"  {output['path']}: {detail}")
+    run = report["last_run"]
+    pipeline_run = run["pipeline"]
+    if pipeline_run:
+        print(f"Last pipeline run: {_timestamp(pipeline_run['finished_at'])}, {pipeline_run['results']}")
+    else:
+        print(f"Last pipeline run: unknown; stages recorded: {', '.join(run['pipeline_stages']) or 'none'}")
+    if run["metrics"]:
+        print(f"Last metrics report: {_timestamp(run['metrics']['finished_at'])}, stage seconds {run['metrics']['stages']}")
+    print(f"Form: {run['form_races']} races applied")
+
+
+def cmd_status(args):
+    """Prints the status, and returns 1 if an output is missing or older than --max-age hours, else 0."""
+    report = status()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_status(report)
+    if args.max_age is not None:
+        stale = [output["path"] for output in report["outputs"]
+                 if output["path"] != OUTPUT_FILE_LIVE_STANDINGS
+                 and (not output["exists"] or output["age_seconds"] > args.max_age * 3600)]
+        if stale:
+            print(f"Stale or missing: {', '.join(stale)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def inspect_races(season_years=None) -> list:
+    """
+    Returns one dict per race in the driver stats store (optionally only for some seasons), in season and
+    race order: its drivers, how many lack lap times, positions or tidy columns, and whether its laps
+    are in the lap store.
+    """
+    lap_seasons = _partitions(CACHE_FOLDER_LAPS)
+    races = []
+    for season, path in _shards().items():
+        if season_years and season not in season_years:
+            continue
+        lap_sessions = _partitions(lap_seasons[season]) if season in lap_seasons else {}
+        conn = _connect_read_only(path)
+        try:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({DRIVER_STATS_TABLE})")}
+            tidy = "SUM(team_name_mapped IS NULL)" if "team_name_mapped" in columns else "COUNT(*)"
+            rows = conn.execute(
+                f"SELECT race_number, session_key, MIN(date), MIN(country), COUNT(*), SUM(avg_lap_time IS NULL), "
+                f"SUM(final_position IS NULL), {tidy} FROM {DRIVER_STATS_TABLE} "
+                f"GROUP BY session_key ORDER BY MIN(date), race_number").fetchall()
+        finally:
+            conn.close()
+        for race_number, session_key, date, country, drivers, no_laps, no_position, untidy in rows:
+            races.append({
+                "season_year": season, "race_number": race_number, "session_key": session_key, "date": date,
+                "country": country, "drivers": drivers, "missing_lap_times": no_laps,
+                "missing_positions": no_position, "untidied": untidy, "laps_stored": session_key in lap_sessions,
+            })
+    return races
+
+
+def cmd_inspect(args):
+    races = inspect_races(_seasons(args.seasons))
+    if args.json:
+        print(json.dumps(races, indent=2))
+        return 0
+    print(f"{'season':>6} {'race':>4} {'session':>7}  {'date':<10}  {'country':<20} {'drivers':>7} {'no laps':>7} "
+          f"{'no pos':>6} {'untidy':>6}  laps stored")
+    for race in races:
+        print(f"{race['season_year']:>6} {race['race_number']:>4} {race['session_key']:>7}  {str(race['date'])[:10]:<10}  "
+              f"{str(race['country'])[:20]:<20} {race['drivers']:>7} {race['missing_lap_times']:>7} "
+              f"{race['missing_positions']:>6} {race['untidied']:>6}  {'yes' if race['laps_stored'] else 'no'}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="f1", description="F1 performance and upgrades toolkit.")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    def command(name, func, help_text):
+        sub = commands.add_parser(name, help=help_text, description=help_text)
+        sub.set_defaults(func=func)
+        return sub
+
+    def seasons_option(sub):
+        sub.add_argument("--seasons", nargs="+", type=int, metavar="YEAR", help="only these seasons (default: all)")
+
+    sub = command("ingest", cmd_ingest, "Fetch driver stats from OpenF1 into the store.")
+    seasons_option(sub)
+    sub.add_argument("--offline", action="store_true", help="only use cached API responses")
+    sub.add_argument("--per-driver", action="store_true", help="fetch laps and positions per driver instead of per session")
+    seasons_option(command("tidy", cmd_tidy, "Add driver surnames and mapped team names to the store."))
+    sub = command("rating", cmd_rating, "Score driver performance.")
+    seasons_option(sub)
+    sub.add_argument("--full", action="store_true", help="rescore every session, not only changed ones")
+    command("upgrades", cmd_upgrades, "Merge driver performance with the team upgrades.")
+    command("form", cmd_form, "Update the rolling and season-to-date form of drivers and teams.")
+    sub = command("correlation", cmd_correlation, "Correlate upgrades with race-to-race changes in score.")
+    sub.add_argument("--resamples", type=int, help="bootstrap resamples and permutations per group (default: 10000)")
+    sub.add_argument("--workers", type=int, dest="max_workers", help="processes to spread the groups across (default: 1)")
+    sub = command("laps", cmd_laps, "Backfill the lap store from the OpenF1 response cache.")
+    sub.add_argument("--online", action="store_true", help="fetch laps missing from the response cache")
+    command("pace", cmd_pace, "Compute lap pace columns from the lap store.")
+    sub = command("docs", cmd_docs, "Download the FIA car presentation PDFs.")
+    sub.add_argument("--add", action="store_true", help="first prompt for new PDF URLs to add")
+    sub.add_argument("--no-revalidate", action="store_true", help="do not check downloaded PDFs for changes")
+    command("extract", cmd_extract, "Extract the upgrade tables from the downloaded FIA PDFs.")
+    sub = command("pipeline", cmd_pipeline, "Run the tidy, rating, upgrades, form and correlation stages.")
+    seasons_option(sub)
+    sub.add_argument("--fetch", action="store_true", help="ingest from OpenF1 first")
+    sub.add_argument("--force", action="store_true", help="run every stage even if its inputs are unchanged")
+    sub = command("live", cmd_live, "Follow a race in progress.")
+    sub.add_argument("session_key", type=int)
+    sub.add_argument("--base-url", help="API to poll (default: OpenF1)")
+    sub.add_argument("--interval", type=float, help="seconds between polls (default: 1)")
+    sub.add_argument("--idle-timeout", type=float, help="seconds without new data before stopping (default: 600)")
+    sub = command("replay", cmd_replay, "Record a race, or replay one through a local stand-in for OpenF1.")
+    sub.add_argument("session_key", type=int, nargs="?")
+    sub.add_argument("--record", action="store_true", help="record a finished session instead of replaying it")
+    sub.add_argument("--synthetic", action="store_true", help="replay a synthetic race")
+    sub.add_argument("--speed", type=float, help="replay speed relative to real time (default: 10)")
+    sub.add_argument("--serve", type=int, metavar="PORT", help="only serve the replay on PORT")
+    sub = command("query", cmd_query, "Query the performance and upgrades output, or serve queries as JSON over HTTP.")
+    sub.add_argument("filters", nargs="*", metavar="COLUMN=VALUE",
+                     help="driver_number, team_name_mapped, session_key, season_year, race_number or race_location")
+    sub.add_argument("--sort", help="column to sort by, descending if prefixed with '-', e.g. --sort=-weighted_score (default: race order)")
+    sub.add_argument("--limit", type=int, help="most rows to return")
+    sub.add_argument("--upgraded", action="store_true", help="only races where the team brought an upgrade")
+    sub.add_argument("--serve", type=int, nargs="?", const=QUERY_PORT, metavar="PORT",
+                     help=f"serve queries on PORT (default: {QUERY_PORT})")
+    sub = command("benchmark", cmd_benchmark, "Time the stages on synthetic data against the stored baselines.")
+    sub.add_argument("--sizes", nargs="+", help="sizes to run (default: all)")
+    sub.add_argument("--stages", nargs="+", help="stages to run (default: all)")
+    sub.add_argument("--update-baselines", action="store_true", help="store these timings as the new baselines")
+
+    sub = command("status", cmd_status, "Report store coverage, output ages and the last run, without loading pandas.")
+    sub.add_argument("--json", action="store_true", help="print the status as JSON")
+    sub.add_argument("--max-age", type=float, metavar="HOURS", help="exit with 1 if an output is missing or older than this")
+    sub = command("inspect", cmd_inspect, "List every stored race with its gaps in coverage, without loading pandas.")
+    seasons_option(sub)
+    sub.add_argument("--json", action="store_true", help="print the races as JSON")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.func not in (cmd_status, cmd_inspect):
+        setup_logging()
+    if args.command == "replay" and args.session_key is None and not args.synthetic:
+        build_parser().error("replay needs a session_key unless --synthetic is given")
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Rolling and season-to-date form of every driver and team, maintained incrementally from the weighted
+scores in the performance and upgrades output.  Each race updates a fixed amount of state per driver and
+team it involves: the last FORM_WINDOW scores and upgrade counts, an EWMA of the score, and season-to-date
+sums that reset at each new season.  The state is saved to FORM_STATE_FILE, so adding a race only applies
+that race, and the current form of every driver and team is written to OUTPUT_FILE_FORM for dashboards.
+If a race that was already applied changes or disappears, the state is rebuilt from the first race.  Only
+the new races, and the earlier ones the caller says may have changed, are fingerprinted.
+"""
+
+import json
+import logging
+import os
+from collections import deque
+
+import pandas as pd
+
+import instrumentation
+from common import setup_logging, FORM_STATE_FILE, OUTPUT_FILE_FORM
+from performance_rating import session_fingerprints
+from process_upgrades import load_perf_and_upgrades
+
+# Races in the rolling window, and weight of the latest race in the EWMA
+FORM_WINDOW = 5
+FORM_EWMA_ALPHA = 0.3
+# Column identifying each kind of entity
+FORM_ENTITIES = {"driver": "driver_name", "team": "team_name_mapped"}
+FORM_INPUT_COLUMNS = ["season_year", "race_number", "session_key", "date", "driver_name", "team_name_mapped",
+                      "weighted_score", "upgrade_count"]
+
+
+class EntityForm:
+    """Form of one driver or team, updated one race at a time."""
+
+    def __init__(self, window: int = FORM_WINDOW):
+        self.scores = deque(maxlen=window)
+        self.upgrades = deque(maxlen=window)
+        self.ewma = None
+        self.races = 0
+        self.season_year = None
+        self.race_number = None
+        self.season_score_sum = 0.0
+        self.season_races = 0
+        self.season_upgrades = 0
+
+    def update(self, season_year: int, race_number: int, score: float, upgrades: int, alpha: float = FORM_EWMA_ALPHA):
+        """Adds one race, in constant time."""
+        if season_year != self.season_year:
+            self.season_score_sum, self.season_races, self.season_upgrades = 0.0, 0, 0
+        self.season_year, self.race_number = season_year, race_number
+        self.scores.append(score)
+        self.upgrades.append(upgrades)
+        self.ewma = score if self.ewma is None else alpha * score + (1 - alpha) * self.ewma
+        self.races += 1
+        self.season_score_sum += score
+        self.season_races += 1
+        self.season_upgrades += upgrades
+
+    def row(self) -> dict:
+        return {
+            "season_year": self.season_year,
+            "race_number": self.race_number,
+            "races": self.races,
+            "last_score": self.scores[-1],
+            "rolling_mean": sum(self.scores) / len(self.scores),
+            "ewma": self.ewma,
+            "season_mean": self.season_score_sum / self.season_races,
+            "season_races": self.season_races,
+            "rolling_upgrades": sum(self.upgrades),
+            "season_upgrades": self.season_upgrades,
+        }
+
+    def to_dict(self) -> dict:
+        return {key: list(value) if isinstance(value, deque) else value for key, value in vars(self).items()}
+
+    @classmethod
+    def from_dict(cls, state: dict, window: int = FORM_WINDOW) -> "EntityForm":
+        entity = cls(window)
+        for key, value in state.items():
+            setattr(entity, key, deque(value, maxlen=window) if key in ("scores", "upgrades") else value)
+        return entity
+
+
+class FormEngine:
+    """
+    Form of every driver and team, with the fingerprint of every race applied so far so that changes to
+    earlier races can be detected.  Races must be added in date order.
+    """
+
+    def __init__(self, window: int = FORM_WINDOW, alpha: float = FORM_EWMA_ALPHA):
+        self.window = window
+        self.alpha = alpha
+        self.entities = {kind: {} for kind in FORM_ENTITIES}
+        # str(session_key): [date, season_year, fingerprint]
+        self.races = {}
+
+    def last_race(self):
+        """Returns the (date, season_year) of the latest race applied, or None."""
+        return max((tuple(race[:2]) for race in self.races.values()), default=None)
+
+    def add_race(self, df_race: pd.DataFrame, fingerprint: str = None):
+        """
+        Applies the rows of one race from the performance and upgrades output, updating every driver
+        and team in it.  A team's score for the race is the mean of its drivers' weighted scores, and
+        its drivers share its upgrade count.  Rows without a weighted score are ignored.
+        """
+        first = df_race.iloc[0]
+        season_year, race_number = int(first["season_year"]), int(first["race_number"])
+        scores = df_race["weighted_score"].tolist()
+        upgrades = df_race["upgrade_count"].fillna(0).astype(int).tolist()
+        # A race has a couple of dozen rows, for which plain Python is faster than a pandas groupby
+        for kind, column in FORM_ENTITIES.items():
+            totals = {}
+            for name, score, count in zip(df_race[column].tolist(), scores, upgrades):
+                if pd.isna(name) or pd.isna(score):
+                    continue
+                total = totals.setdefault(name, [0.0, 0, 0])
+                total[0] += score
+                total[1] += 1
+                total[2] = max(total[2], count)
+            entities = self.entities[kind]
+            for name, (score_sum, n, count) in totals.items():
+                if name not in entities:
+                    entities[name] = EntityForm(self.window)
+                entities[name].update(season_year, race_number, score_sum / n, count, self.alpha)
+        self.races[str(int(first["session_key"]))] = [str(first["date"]), season_year, fingerprint]
+
+    def table(self, kind: str) -> pd.DataFrame:
+        """
+        Returns the current form of every driver or team (kind), one row each.  Ranks (1 is best) are
+        among the entities that raced in the latest season, and missing for the others.
+        """
+        rows = [{"kind": kind, "name": name, **entity.row()} for name, entity in self.entities[kind].items()]
+        df = pd.DataFrame(rows, columns=["kind", "name", "season_year", "race_number", "races", "last_score",
+                                         "rolling_mean", "ewma", "season_mean", "season_races",
+                                         "rolling_upgrades", "season_upgrades"])
+        last_race = self.last_race()
+        is_current = df["season_year"] == (last_race[1] if last_race else None)
+        for col in ["rolling_mean", "ewma", "season_mean"]:
+            df[f"rank_{col}"] = df[col].where(is_current).rank(method="min", ascending=False).astype("Int16")
+        return df.sort_values(["rank_ewma", "name"], ignore_index=True)
+
+    def to_dict(self) -> dict:
+        return {
+            "window": self.window,
+            "alpha": self.alpha,
+            "races": self.races,
+            "entities": {kind: {name: entity.to_dict() for name, entity in entities.items()}
+                         for kind, entities in self.entities.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "FormEngine":
+        engine = cls(state["window"], state["alpha"])
+        engine.races = state["races"]
+        for kind, entities in state["entities"].items():
+            engine.entities[kind] = {name: EntityForm.from_dict(entity, engine.window) for name, entity in entities.items()}
+        return engine
+
+
+def load_engine(path: str = FORM_STATE_FILE, window: int = FORM_WINDOW, alpha: float = FORM_EWMA_ALPHA) -> FormEngine:
+    """Returns the saved engine, or a new one if there is none or it was saved with other parameters."""
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        if state.get("window") == window and state.get("alpha") == alpha:
+            return FormEngine.from_dict(state)
+        logging.info(f"Form parameters changed since {path} was saved; rebuilding")
+    return FormEngine(window, alpha)
+
+
+def save_engine(engine: FormEngine, path: str = FORM_STATE_FILE):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(engine.to_dict(), f)
+    os.replace(tmp_path, path)
+
+
+def _fingerprints(df: pd.DataFrame, session_keys) -> pd.Series:
+    # Fingerprints of some races only, keyed like FormEngine.races
+    df = df[df["session_key"].isin(list(session_keys))]
+    fingerprints = session_fingerprints(df, FORM_INPUT_COLUMNS)
+    fingerprints.index = fingerprints.index.astype(int).astype(str)
+    return fingerprints
+
+
+def update_form(engine: FormEngine, df_perf_merged: pd.DataFrame, changed_sessions=None) -> FormEngine:
+    """
+    Applies every race in df_perf_merged that engine has not seen, in date order, and returns the
+    engine.  Returns a new engine rebuilt from every race instead if a race already applied has changed
+    or gone, or if a new race comes before the latest one applied.  Only the new races are fingerprinted,
+    and of the races already applied, those in changed_sessions (session_keys whose rows may have
+    changed), or all of them if changed_sessions is None, for callers that cannot tell.
+    """
+    df = df_perf_merged[FORM_INPUT_COLUMNS]
+    order = df.drop_duplicates("session_key").astype({"date": str}).sort_values(["date", "session_key"])
+    keys = order["session_key"].astype(int).astype(str)
+    is_applied = keys.isin(engine.races.keys()).to_numpy()
+    removed = len(engine.races) - int(is_applied.sum())
+    if changed_sessions is None:
+        to_check = keys[is_applied]
+    else:
+        to_check = keys[is_applied & keys.isin({str(int(key)) for key in changed_sessions}).to_numpy()]
+    new = order[~is_applied]
+    fingerprints = _fingerprints(df, pd.concat([new["session_key"], order["session_key"][keys.isin(to_check)]]))
+
+    last_race = engine.last_race()
+    changed = [key for key in to_check if fingerprints.get(key) != engine.races[key][2]]
+    if changed or removed or (last_race and len(new) and new["date"].iloc[0] < last_race[0]):
+        logging.info(f"{len(changed) + removed} races changed or removed since the form was last updated; rebuilding")
+        engine = FormEngine(engine.window, engine.alpha)
+        new = order
+        fingerprints = _fingerprints(df, order["session_key"])
+
+    df_new = df[df["session_key"].isin(new["session_key"])]
+    rows_by_race = df_new.groupby("session_key", sort=False).indices
+    for session_key in new["session_key"]:
+        engine.add_race(df_new.iloc[rows_by_race[session_key]], fingerprints[str(int(session_key))])
+    logging.info(f"Added {len(new)} races to the form of {sum(len(e) for e in engine.entities.values())} drivers and teams")
+    return engine
+
+
+def form_table(engine: FormEngine) -> pd.DataFrame:
+    """Returns the form tables of every kind of entity, one after the other."""
+    return pd.concat([engine.table(kind) for kind in FORM_ENTITIES], ignore_index=True)
+
+
+def refresh(df_perf_merged: pd.DataFrame, state_path: str = FORM_STATE_FILE, output_path: str = OUTPUT_FILE_FORM,
+            changed_sessions=None) -> pd.DataFrame:
+    """
+    Updates the saved form with any new races in df_perf_merged (see update_form for changed_sessions),
+    writes the form table and returns it.
+    """
+    engine = update_form(load_engine(state_path), df_perf_merged, changed_sessions)
+    save_engine(engine, state_path)
+    df_form = form_table(engine)
+    df_form.to_parquet(output_path, index=False)
+    logging.info(f"Form of {len(df_form)} drivers and teams written to {output_path}")
+    return df_form
+
+
+@instrumentation.timed("form")
+def main():
+    df_perf_merged = load_perf_and_upgrades()
+    if df_perf_merged is None:
+        logging.error("No performance and upgrades output yet; run process_upgrades.py first")
+        return
+    df_form = refresh(df_perf_merged)
+    instrumentation.set_rows(len(df_form))
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
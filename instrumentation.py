@@ -0,0 +1,298 @@
+"""
+Lightweight run metrics shared by all scripts: wall and CPU time, rows per second and peak RSS growth per stage,
+OpenF1 call counts and a latency histogram per endpoint, time spent sleeping for rate limits and retries,
+and cache hit rates.  Metrics are off by default, and every recording function returns straight away
+when they are, so instrumented code costs one flag check.  Set F1_METRICS=1 to enable them for any script
+run through common.setup_logging; the metrics are then written at exit as a JSON run report
+(METRICS_REPORT_FILE) and a Prometheus textfile (METRICS_TEXTFILE) for node_exporter's textfile collector.
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from common import METRICS_REPORT_FILE, METRICS_TEXTFILE
+
+# Upper bounds in seconds of the OpenF1 latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_stages = {}
+_api_calls = {}
+_waits = {}
+_caches = {}
+_started_at = time.time()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable(write_at_exit: bool = True, report_path: str = METRICS_REPORT_FILE, textfile_path: str = METRICS_TEXTFILE):
+    """Starts recording metrics, optionally writing both outputs when the process exits."""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    if write_at_exit:
+        atexit.register(write_outputs, report_path, textfile_path)
+
+
+def enable_from_env():
+    """Calls enable() if the F1_METRICS environment variable is set to anything but '' or '0'."""
+    if os.environ.get("F1_METRICS", "0") not in ("", "0"):
+        enable()
+
+
+def reset():
+    """Discards everything recorded so far."""
+    global _started_at
+    with _lock:
+        for metrics in (_stages, _api_calls, _waits, _caches):
+            metrics.clear()
+        _started_at = time.time()
+
+
+def peak_rss_bytes() -> int:
+    """Returns the peak resident set size of the process so far, or None where it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _Stage:
+    """Context manager timing one run of a stage; set .rows inside it to report rows per second."""
+
+    def __init__(self, name: str, rows: int = None):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        stack = getattr(_local, "stages", None)
+        if stack is None:
+            stack = _local.stages = []
+        stack.append(self)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._rss = peak_rss_bytes()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _local.stages.pop()
+        rss = peak_rss_bytes()
+        with _lock:
+            entry = _stages.setdefault(self.name, {"runs": 0, "failures": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "rows": 0,
+                                                   "peak_rss_increase_bytes": None, "process_peak_rss_bytes": None})
+            entry["runs"] += 1
+            entry["failures"] += exc_type is not None
+            entry["wall_seconds"] += wall
+            entry["cpu_seconds"] += cpu
+            entry["rows"] += self.rows or 0
+            if rss is not None:
+                # The OS only keeps the peak of the whole process, so a stage's own memory shows as how far
+                # it raised that peak: zero if it stayed below what an earlier stage reached
+                entry["peak_rss_increase_bytes"] = max(entry["peak_rss_increase_bytes"] or 0, rss - self._rss)
+                entry["process_peak_rss_bytes"] = max(entry["process_peak_rss_bytes"] or 0, rss)
+        return False
+
+
+class _NullStage:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, rows: int = None):
+    """Returns a context manager that records a run of the named stage, or a no-op one when disabled."""
+    return _Stage(name, rows) if _enabled else _NULL_STAGE
+
+
+def timed(name: str):
+    """Decorator recording every call of a function as a run of the named stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_rows(rows: int):
+    """Sets the number of rows processed by the innermost stage running on this thread."""
+    if not _enabled:
+        return
+    stack = getattr(_local, "stages", None)
+    if stack:
+        stack[-1].rows = rows
+
+
+def record_api_call(endpoint: str, seconds: float, status):
+    """Records one HTTP request to an OpenF1 endpoint, with its HTTP status or 'error' if it failed to complete."""
+    if not _enabled:
+        return
+    endpoint = endpoint.strip("/")
+    with _lock:
+        entry = _api_calls.setdefault(endpoint, {"count": 0, "statuses": {}, "seconds": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)})
+        entry["count"] += 1
+        entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+        entry["seconds"] += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                entry["buckets"][i] += 1
+                break
+
+
+def record_wait(reason: str, seconds: float):
+    """Records time spent sleeping, e.g. for 'rate_limit' tokens or a 'retry_backoff'."""
+    if not _enabled or seconds <= 0:
+        return
+    with _lock:
+        _waits[reason] = _waits.get(reason, 0.0) + seconds
+
+
+def record_cache(cache: str, hit: bool):
+    """Records a lookup in the named cache."""
+    if not _enabled:
+        return
+    with _lock:
+        entry = _caches.setdefault(cache, {"hits": 0, "misses": 0})
+        entry["hits" if hit else "misses"] += 1
+
+
+def report() -> dict:
+    """Returns everything recorded so far as a JSON-serializable dict."""
+    with _lock:
+        stages = {
+            name: {**entry, "rows_per_second": entry["rows"] / entry["wall_seconds"] if entry["rows"] and entry["wall_seconds"] else None}
+            for name, entry in _stages.items()
+        }
+        api_calls = {
+            endpoint: {
+                "count": entry["count"],
+                "statuses": dict(entry["statuses"]),
+                "mean_seconds": entry["seconds"] / entry["count"],
+                "latency_buckets": {str(bound): n for bound, n in zip(LATENCY_BUCKETS, entry["buckets"])},
+            }
+            for endpoint, entry in _api_calls.items()
+        }
+        caches = {
+            name: {**entry, "hit_rate": entry["hits"] / (entry["hits"] + entry["misses"])}
+            for name, entry in _caches.items()
+        }
+        waits = dict(_waits)
+    return {
+        "started_at": _started_at,
+        "finished_at": time.time(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "stages": stages,
+        "api_calls": api_calls,
+        "wait_seconds": waits,
+        "caches": caches,
+    }
+
+
+def _atomic_write(path: str, text: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_report(path: str = METRICS_REPORT_FILE):
+    _atomic_write(path, json.dumps(report(), indent=2, sort_keys=True))
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(run_report: dict = None) -> str:
+    """Returns a report in the Prometheus text exposition format."""
+    run_report = run_report or report()
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    stages = run_report["stages"]
+    metric("f1_stage_runs_total", "counter", "Runs of each pipeline stage.",
+           [({"stage": name}, entry["runs"]) for name, entry in stages.items()])
+    metric("f1_stage_failures_total", "counter", "Runs of each pipeline stage that raised an exception.",
+           [({"stage": name}, entry["failures"]) for name, entry in stages.items()])
+    metric("f1_stage_wall_seconds_total", "counter", "Wall-clock time spent in each pipeline stage.",
+           [({"stage": name}, entry["wall_seconds"]) for name, entry in stages.items()])
+    metric("f1_stage_cpu_seconds_total", "counter", "Process CPU time spent in each pipeline stage.",
+           [({"stage": name}, entry["cpu_seconds"]) for name, entry in stages.items()])
+    metric("f1_stage_rows_total", "counter", "Rows processed by each pipeline stage.",
+           [({"stage": name}, entry["rows"]) for name, entry in stages.items()])
+    metric("f1_stage_peak_rss_increase_bytes", "gauge", "Most any run of each pipeline stage raised the process peak resident set size by.",
+           [({"stage": name}, entry["peak_rss_increase_bytes"]) for name, entry in stages.items() if entry["peak_rss_increase_bytes"] is not None])
+
+    api_calls = run_report["api_calls"]
+    metric("f1_openf1_requests_total", "counter", "OpenF1 HTTP requests by endpoint and status.",
+           [({"endpoint": endpoint, "status": status}, n)
+            for endpoint, entry in api_calls.items() for status, n in entry["statuses"].items()])
+    name = "f1_openf1_request_duration_seconds"
+    lines.append(f"# HELP {name} OpenF1 HTTP request latency.")
+    lines.append(f"# TYPE {name} histogram")
+    for endpoint, entry in api_calls.items():
+        label = f'endpoint="{_label(endpoint)}"'
+        cumulative = 0
+        for bound, n in entry["latency_buckets"].items():
+            cumulative += n
+            lines.append(f'{name}_bucket{{{label},le="{"+Inf" if bound == "inf" else bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{label}}} {entry['mean_seconds'] * entry['count']}")
+        lines.append(f"{name}_count{{{label}}} {entry['count']}")
+
+    metric("f1_wait_seconds_total", "counter", "Time spent sleeping, by reason.",
+           [({"reason": reason}, seconds) for reason, seconds in run_report["wait_seconds"].items()])
+    metric("f1_cache_requests_total", "counter", "Cache lookups by cache and result.",
+           [({"cache": name, "result": result}, entry[key])
+            for name, entry in run_report["caches"].items() for result, key in (("hit", "hits"), ("miss", "misses"))])
+    if run_report["peak_rss_bytes"] is not None:
+        metric("f1_process_peak_rss_bytes", "gauge", "Peak resident set size of the run.", [({}, run_report["peak_rss_bytes"])])
+    metric("f1_run_finished_timestamp_seconds", "gauge", "Time the run finished.", [({}, run_report["finished_at"])])
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str = METRICS_TEXTFILE):
+    _atomic_write(path, prometheus_text())
+
+
+def write_outputs(report_path: str = METRICS_REPORT_FILE, textfile_path: str = METRICS_TEXTFILE):
+    """Writes the JSON run report and the Prometheus textfile from one snapshot of the metrics."""
+    run_report = report()
+    _atomic_write(report_path, json.dumps(run_report, indent=2, sort_keys=True))
+    _atomic_write(textfile_path, prometheus_text(run_report))
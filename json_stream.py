@@ -0,0 +1,75 @@
+"""
+Incremental parsing of JSON array bodies, as returned by every OpenF1 endpoint.  Elements are yielded
+one at a time as soon as they have been fully received, so memory use is bounded by the chunk size and
+the largest single element rather than by the size of the whole response.
+"""
+
+import codecs
+import json
+
+READ_CHUNK_SIZE = 64 * 1024
+# Characters that can follow a complete array element
+ELEMENT_TERMINATORS = " \t\r\n,]"
+
+
+def decode_chunks(byte_chunks, encoding: str = "utf-8"):
+    """Yields text from an iterable of byte chunks, handling multi-byte characters split across chunks."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in byte_chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def _skip_separators(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+        pos += 1
+    return pos
+
+
+def iter_json_array(text_chunks):
+    """
+    Yields the elements of a JSON array read from an iterable of text chunks.  Anything after the
+    closing bracket is ignored.  Raises ValueError if the input is not a complete JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    for chunk in text_chunks:
+        buffer += chunk
+        pos = 0
+        if not started:
+            pos = _skip_separators(buffer, pos)
+            if pos == len(buffer):
+                buffer = ""
+                continue
+            if buffer[pos] != "[":
+                raise ValueError(f"Expected a JSON array, found {buffer[pos:pos + 20]!r}")
+            started = True
+            pos += 1
+        while True:
+            pos = _skip_separators(buffer, pos)
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Element not fully received yet
+            if end == len(buffer) or buffer[end] not in ELEMENT_TERMINATORS:
+                # A number may continue in the next chunk, e.g. '3' then '.14' or '1e' then '5'
+                break
+            yield element
+            pos = end
+        buffer = buffer[pos:]
+
+    # The final element may have been held back waiting for more input
+    pos = _skip_separators(buffer, 0)
+    if started and pos < len(buffer) and buffer[pos] != "]":
+        element, end = decoder.raw_decode(buffer, pos)
+        yield element
+        pos = _skip_separators(buffer, end)
+    if not started or pos >= len(buffer) or buffer[pos] != "]":
+        raise ValueError("Incomplete JSON array")
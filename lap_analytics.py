@@ -0,0 +1,156 @@
+"""
+Lap-level pace analytics computed from whole arrays of laps at once, without Python loops over drivers.
+Lap 1, pit out-laps, in-laps and laps slower than a threshold over the driver's median (safety car,
+incidents) are excluded before computing pace, and stints are split at each pit out-lap.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+from common import setup_logging, CACHE_FILE_DRIVER_STATS
+from lap_store import read_laps, laps_to_arrays
+from stats_store import DriverStatsStore
+
+# Laps slower than this multiple of the driver's median lap in the session are treated as outliers
+OUTLIER_THRESHOLD = 1.07
+# Percentile of clean laps reported as 'percentile_lap_time'
+PACE_PERCENTILE = 25
+# Stints with fewer clean laps than this are ignored for the degradation slope
+MIN_STINT_LAPS = 5
+
+PACE_COLUMNS = ["clean_laps", "median_lap_time", "percentile_lap_time", "stint_count", "deg_slope"]
+LAP_COLUMNS_NEEDED = ["driver_number", "lap_number", "lap_duration", "is_pit_out_lap"]
+
+
+def grouped_percentile(groups: np.ndarray, values: np.ndarray, q: float, n_groups: int) -> np.ndarray:
+    """
+    Returns the q-th percentile (linear interpolation, as np.percentile) of values for each group id
+    in range(n_groups).  Groups with no values get NaN.
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = np.full(n_groups, np.nan)
+    has_values = counts > 0
+    position = starts[has_values] + (q / 100.0) * (counts[has_values] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    fraction = position - lower
+    result[has_values] = sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+    return result
+
+
+def grouped_slope(groups: np.ndarray, x: np.ndarray, y: np.ndarray, n_groups: int) -> np.ndarray:
+    """Returns the least-squares slope of y against x for each group id, or NaN where it is undefined."""
+    n = np.bincount(groups, minlength=n_groups).astype(float)
+    sx = np.bincount(groups, weights=x, minlength=n_groups)
+    sy = np.bincount(groups, weights=y, minlength=n_groups)
+    sxx = np.bincount(groups, weights=x * x, minlength=n_groups)
+    sxy = np.bincount(groups, weights=x * y, minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denominator = n * sxx - sx * sx
+        return np.where(denominator > 0, (n * sxy - sx * sy) / denominator, np.nan)
+
+
+def lap_pace_summary(session_keys, driver_numbers, lap_numbers, lap_durations, is_pit_out_laps) -> pd.DataFrame:
+    """
+    Returns one row per (session_key, driver_number) with:
+    - clean_laps: laps remaining after excluding lap 1, pit out-laps, in-laps and outliers
+    - median_lap_time / percentile_lap_time: median and PACE_PERCENTILE-th percentile of clean laps
+    - stint_count: number of stints, split at each pit out-lap
+    - deg_slope: seconds lost per lap to tyre degradation, the lap-weighted mean of the linear slope
+      of clean lap time against lap number within each stint of at least MIN_STINT_LAPS clean laps
+    All arguments are equal-length arrays with one entry per lap, in any order.
+    """
+    session_keys = np.asarray(session_keys, dtype=np.int64)
+    driver_numbers = np.asarray(driver_numbers, dtype=np.int64)
+    lap_numbers = np.asarray(lap_numbers, dtype=np.int64)
+    lap_durations = np.asarray(lap_durations, dtype=float)
+    is_pit_out_laps = np.asarray(is_pit_out_laps, dtype=bool)
+
+    # Sort laps by driver within session, then by lap number
+    order = np.lexsort((lap_numbers, driver_numbers, session_keys))
+    session_keys, driver_numbers = session_keys[order], driver_numbers[order]
+    lap_numbers, lap_durations, is_pit_out_laps = lap_numbers[order], lap_durations[order], is_pit_out_laps[order]
+
+    pairs, driver_ids = np.unique(np.column_stack((session_keys, driver_numbers)), axis=0, return_inverse=True)
+    driver_ids = driver_ids.ravel()
+    n_drivers = len(pairs)
+    if n_drivers == 0:
+        return pd.DataFrame(columns=["session_key", "driver_number"] + PACE_COLUMNS)
+
+    # Stints start at each pit out-lap; the lap before a pit out-lap by the same driver is an in-lap
+    new_driver = np.concatenate(([True], driver_ids[1:] != driver_ids[:-1]))
+    stint_start = new_driver | is_pit_out_laps
+    stint_ids = np.cumsum(stint_start) - 1
+    is_in_lap = np.concatenate((is_pit_out_laps[1:] & ~new_driver[1:], [False]))
+
+    candidate = np.isfinite(lap_durations) & (lap_numbers > 1) & ~is_pit_out_laps & ~is_in_lap
+    driver_median = grouped_percentile(driver_ids[candidate], lap_durations[candidate], 50, n_drivers)
+    with np.errstate(invalid="ignore"):
+        clean = candidate & (lap_durations <= OUTLIER_THRESHOLD * driver_median[driver_ids])
+
+    clean_drivers = driver_ids[clean]
+    clean_laps = np.bincount(clean_drivers, minlength=n_drivers)
+    median_lap_time = grouped_percentile(clean_drivers, lap_durations[clean], 50, n_drivers)
+    percentile_lap_time = grouped_percentile(clean_drivers, lap_durations[clean], PACE_PERCENTILE, n_drivers)
+
+    n_stints = stint_ids[-1] + 1
+    stint_driver = driver_ids[stint_start]
+    stint_count = np.bincount(stint_driver, minlength=n_drivers)
+    stint_laps = np.bincount(stint_ids[clean], minlength=n_stints)
+    stint_slope = grouped_slope(stint_ids[clean], lap_numbers[clean].astype(float), lap_durations[clean], n_stints)
+    usable = (stint_laps >= MIN_STINT_LAPS) & np.isfinite(stint_slope)
+    weights = np.where(usable, stint_laps, 0).astype(float)
+    weighted_slopes = np.bincount(stint_driver, weights=np.where(usable, stint_slope, 0.0) * weights, minlength=n_drivers)
+    total_weights = np.bincount(stint_driver, weights=weights, minlength=n_drivers)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deg_slope = np.where(total_weights > 0, weighted_slopes / total_weights, np.nan)
+
+    return pd.DataFrame({
+        "session_key": pairs[:, 0],
+        "driver_number": pairs[:, 1],
+        "clean_laps": clean_laps,
+        "median_lap_time": median_lap_time,
+        "percentile_lap_time": percentile_lap_time,
+        "stint_count": stint_count,
+        "deg_slope": deg_slope,
+    })
+
+
+def session_lap_pace(session_key, laps) -> pd.DataFrame:
+    """Returns lap_pace_summary for a list of /laps entries from a single session, indexed by driver_number."""
+    arrays = laps_to_arrays(laps)
+    session_keys = np.full(len(arrays["driver_number"]), session_key)
+    df = lap_pace_summary(session_keys, *(arrays[col] for col in LAP_COLUMNS_NEEDED))
+    return df.drop(columns="session_key").set_index("driver_number")
+
+
+def stored_lap_pace(season_years=None) -> pd.DataFrame:
+    """Returns lap_pace_summary for every session in the lap store, optionally restricted to some seasons."""
+    arrays = read_laps(season_years, LAP_COLUMNS_NEEDED)
+    return lap_pace_summary(arrays["session_key"], *(arrays[col] for col in LAP_COLUMNS_NEEDED))
+
+
+@instrumentation.timed("lap_pace")
+def main():
+    """Computes the pace columns for every session in the lap store and adds them to the driver stats store."""
+    df_pace = stored_lap_pace()
+    logging.info(f"Computed lap pace for {len(df_pace)} drivers")
+    store = DriverStatsStore()
+    known_keys = store.cached_keys()
+    df_pace = df_pace[[key in known_keys for key in zip(df_pace["session_key"], df_pace["driver_number"])]]
+    store.upsert(df_pace)
+    store.export_csv(CACHE_FILE_DRIVER_STATS)
+    store.close()
+    logging.info(f"Updated lap pace columns for {len(df_pace)} rows")
+    instrumentation.set_rows(len(df_pace))
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
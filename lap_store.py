@@ -0,0 +1,168 @@
+"""
+Columnar store for the raw lap data returned by the OpenF1 /laps endpoint.  Each race session is kept in
+its own partition folder, CACHE_FOLDER_LAPS/season_year=YYYY/session_key=NNNN, holding one typed .npy file
+per column.  Reads use memory-mapped arrays, so lap-level analytics over many seasons only page in the
+columns they touch rather than loading whole seasons into pandas.
+"""
+
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+from common import setup_logging, CACHE_FOLDER_LAPS
+from openf1_client import get_client
+from stats_store import load_driver_stats
+
+# Columns kept from /laps, with the dtype each is stored as
+LAP_COLUMNS = {
+    "driver_number": np.int16,
+    "lap_number": np.int16,
+    "lap_duration": np.float32,
+    "duration_sector_1": np.float32,
+    "duration_sector_2": np.float32,
+    "duration_sector_3": np.float32,
+    "i1_speed": np.float32,
+    "i2_speed": np.float32,
+    "st_speed": np.float32,
+    "is_pit_out_lap": np.bool_,
+    "date_start": "datetime64[ms]",
+}
+# Columns added by read_laps to identify the partition each lap came from
+PARTITION_COLUMNS = {"season_year": np.int16, "session_key": np.int32}
+# Stored in place of a missing value in integer columns
+INT_MISSING = -1
+
+
+def partition_path(season_year, session_key, folder: str = CACHE_FOLDER_LAPS) -> str:
+    return os.path.join(folder, f"season_year={int(season_year)}", f"session_key={int(session_key)}")
+
+
+def laps_to_arrays(laps) -> dict:
+    """Converts a list of /laps entries into a dict of typed NumPy arrays, one per column in LAP_COLUMNS."""
+    df_laps = pd.DataFrame(laps, columns=list(LAP_COLUMNS.keys()))
+    arrays = {}
+    for col, dtype in LAP_COLUMNS.items():
+        values = df_laps[col]
+        if dtype == "datetime64[ms]":
+            dates = pd.to_datetime(values, utc=True, format="ISO8601").dt.tz_localize(None)
+            arrays[col] = dates.to_numpy(dtype="datetime64[ms]")
+        elif np.issubdtype(dtype, np.integer):
+            arrays[col] = pd.to_numeric(values).fillna(INT_MISSING).to_numpy(dtype=dtype)
+        elif dtype == np.bool_:
+            arrays[col] = values.fillna(False).to_numpy(dtype=dtype)
+        else:
+            arrays[col] = pd.to_numeric(values).to_numpy(dtype=dtype)
+    return arrays
+
+
+def write_session_laps(season_year, session_key, laps, folder: str = CACHE_FOLDER_LAPS) -> int:
+    """
+    Writes the laps for one session to its partition, replacing any previous copy.  The columns are
+    written to a temporary folder which is then renamed into place.  Returns the number of laps written.
+    """
+    arrays = laps_to_arrays(laps)
+    path = partition_path(season_year, session_key, folder)
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for col, values in arrays.items():
+        np.save(os.path.join(tmp_path, f"{col}.npy"), values)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return len(arrays["driver_number"])
+
+
+def has_session_laps(season_year, session_key, folder: str = CACHE_FOLDER_LAPS) -> bool:
+    return os.path.isdir(partition_path(season_year, session_key, folder))
+
+
+def read_session_laps(season_year, session_key, columns=None, folder: str = CACHE_FOLDER_LAPS, mmap: bool = True) -> dict:
+    """
+    Returns a dict of column name to array for one session's laps.  With mmap=True (the default) the
+    arrays are read-only memory maps of the files on disk.
+    """
+    path = partition_path(season_year, session_key, folder)
+    mmap_mode = "r" if mmap else None
+    return {col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode=mmap_mode) for col in (columns or LAP_COLUMNS.keys())}
+
+
+def list_partitions(season_years=None, folder: str = CACHE_FOLDER_LAPS) -> list:
+    """Returns the sorted (season_year, session_key) pairs stored, optionally restricted to the given seasons."""
+    partitions = []
+    if not os.path.exists(folder):
+        return partitions
+    wanted = {int(year) for year in season_years} if season_years is not None else None
+    for season_dir in os.listdir(folder):
+        if not season_dir.startswith("season_year="):
+            continue
+        season_year = int(season_dir.split("=", 1)[1])
+        if wanted is not None and season_year not in wanted:
+            continue
+        for session_dir in os.listdir(os.path.join(folder, season_dir)):
+            if session_dir.startswith("session_key=") and not session_dir.endswith(".tmp"):
+                partitions.append((season_year, int(session_dir.split("=", 1)[1])))
+    return sorted(partitions)
+
+
+def iter_laps(season_years=None, columns=None, folder: str = CACHE_FOLDER_LAPS):
+    """Yields (season_year, session_key, arrays) for every stored session, see read_session_laps."""
+    for season_year, session_key in list_partitions(season_years, folder):
+        yield season_year, session_key, read_session_laps(season_year, session_key, columns, folder)
+
+
+def read_laps(season_years=None, columns=None, folder: str = CACHE_FOLDER_LAPS) -> dict:
+    """
+    Returns the requested columns for every stored session concatenated into single arrays, plus
+    'season_year' and 'session_key' columns identifying the partition each lap came from.
+    Only the requested columns are read from disk.
+    """
+    columns = list(columns or LAP_COLUMNS.keys())
+    parts = {col: [] for col in columns + ["season_year", "session_key"]}
+    for season_year, session_key, arrays in iter_laps(season_years, columns, folder):
+        n_laps = len(arrays[columns[0]])
+        for col in columns:
+            parts[col].append(arrays[col])
+        parts["season_year"].append(np.full(n_laps, season_year, dtype=PARTITION_COLUMNS["season_year"]))
+        parts["session_key"].append(np.full(n_laps, session_key, dtype=PARTITION_COLUMNS["session_key"]))
+    result = {}
+    for col, chunks in parts.items():
+        if chunks:
+            result[col] = np.concatenate(chunks)
+        else:
+            result[col] = np.empty(0, dtype=LAP_COLUMNS.get(col, PARTITION_COLUMNS.get(col)))
+    return result
+
+
+@instrumentation.timed("lap_store_backfill")
+def main(offline=True):
+    """
+    Fills the lap store for every session in the driver stats store that has no partition yet.
+    By default only responses in the OpenF1 response cache are used, so no API calls are made.
+    """
+    client = get_client(offline=offline)
+    df_sessions = load_driver_stats(columns=["season_year", "session_key"]).drop_duplicates()
+    written = 0
+    total_laps = 0
+    for season_year, session_key in df_sessions.itertuples(index=False):
+        if has_session_laps(season_year, session_key):
+            continue
+        try:
+            laps = client.get_json("laps", {"session_key": session_key})
+        except LookupError as e:
+            logging.info(f"Skipping session {session_key}: {e}")
+            continue
+        n_laps = write_session_laps(season_year, session_key, laps)
+        logging.info(f"Stored {n_laps} laps for session {session_key}")
+        written += 1
+        total_laps += n_laps
+    logging.info(f"Stored laps for {written} sessions in {CACHE_FOLDER_LAPS}")
+    instrumentation.set_rows(total_laps)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,273 @@
+"""
+Live mode for a race in progress.  LiveSession polls the OpenF1 /laps and /position endpoints for one
+session_key, asking each only for the records from its date cursor onwards, and folds every new record
+into running totals per driver: best and average lap time, grid (earliest) and current (latest) position.
+After each poll that brought new data, the session's rows are scored with the per-session normalization
+and weights of performance_rating, which never depend on any other session, so the standings are updated
+within a poll interval of the data reaching OpenF1 without rescoring anything else.  Live responses are
+never written to the response cache.  replay_server.py streams a recorded session through a local
+stand-in for the API, to run this against a race that is not live.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import instrumentation
+from common import setup_logging, OPENF1_BASE_URL, OPENF1_LIVE_RATE_LIMITS, OUTPUT_FILE_LIVE_STANDINGS
+from openf1_client import OpenF1Client
+from performance_rating import SCORE_DIRECTIONS, SCORE_WEIGHTS, add_normalized_score_columns, score_weight_matrix
+from tidy_race_stats import TEAM_NAME_MAPPING
+
+# Seconds between the starts of two polls, and without new data before the session counts as over
+LIVE_POLL_INTERVAL = 1.0
+LIVE_IDLE_TIMEOUT = 600.0
+# Every driver's latest lap is fetched again on each poll, until its duration is known and the next one
+# has started, unless it started this many seconds before the latest lap of anyone (e.g. a retired driver)
+ACTIVE_LAP_SECONDS = 300
+STANDINGS_COLUMNS = ["session_key", "driver_number", "driver_name", "team_name", "team_name_mapped", "laps",
+                     "best_lap_time", "avg_lap_time", "grid_position", "final_position", "position_change"]
+
+
+def parse_date(value) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+class DriverLive:
+    """Running lap and position totals of one driver, updated one /laps or /position record at a time."""
+
+    def __init__(self):
+        # lap_number: lap_duration, kept so a lap fetched again or completed later is only counted once
+        self.laps = {}
+        self.best_lap_time = None
+        self.lap_time_sum = 0.0
+        self.timed_laps = 0
+        # (date, position) of the earliest and latest /position records
+        self.first = None
+        self.last = None
+        # Raw and parsed date_start of the latest lap
+        self.last_lap_start = None
+        self.last_lap_date = None
+
+    def add_lap(self, lap: dict) -> bool:
+        """Adds or updates one /laps record and returns whether anything changed."""
+        lap_number = lap.get("lap_number")
+        if lap_number is None:
+            return False
+        duration = lap.get("lap_duration")
+        previous = self.laps.get(lap_number)
+        if lap_number in self.laps and previous == duration:
+            return False
+        self.laps[lap_number] = duration
+        if previous is not None:
+            # A revised lap time; recount the driver's laps rather than undo the old one
+            durations = [d for d in self.laps.values() if d is not None]
+            self.best_lap_time = min(durations, default=None)
+            self.lap_time_sum, self.timed_laps = sum(durations), len(durations)
+        elif duration is not None:
+            self.best_lap_time = duration if self.best_lap_time is None else min(self.best_lap_time, duration)
+            self.lap_time_sum += duration
+            self.timed_laps += 1
+
+        date = parse_date(lap.get("date_start"))
+        if date is not None and (self.last_lap_date is None or date >= self.last_lap_date):
+            self.last_lap_start, self.last_lap_date = lap["date_start"], date
+        return True
+
+    def add_position(self, date: datetime, position) -> bool:
+        """Adds one /position record and returns whether the grid or current position changed."""
+        changed = False
+        # As in position_stream.scan_positions: the first of tied earliest and the last of tied latest records
+        if self.first is None or date < self.first[0]:
+            self.first = (date, position)
+            changed = True
+        if self.last is None or date >= self.last[0]:
+            changed = changed or self.last != (date, position)
+            self.last = (date, position)
+        return changed
+
+    def row(self) -> dict:
+        grid_position = self.first[1] if self.first else None
+        final_position = self.last[1] if self.last else None
+        return {
+            "laps": len(self.laps),
+            "best_lap_time": self.best_lap_time,
+            "avg_lap_time": self.lap_time_sum / self.timed_laps if self.timed_laps else None,
+            "grid_position": grid_position,
+            "final_position": final_position,
+            "position_change": grid_position - final_position if grid_position is not None and final_position is not None else None,
+        }
+
+
+class LiveSession:
+    """
+    Live stats and scores of one race session.  poll() fetches the new /laps and /position records,
+    and standings holds the latest scored table, where final_position is the current position.
+    """
+
+    def __init__(self, session_key, client: OpenF1Client):
+        self.session_key = int(session_key)
+        self.client = client
+        self.drivers = {}
+        # driver_number: /drivers record
+        self.info = {}
+        self.lap_cursor = None
+        self.position_cursor = None
+        self.position_date = None
+        self.standings = None
+
+    def load_drivers(self):
+        self.info = {d["driver_number"]: d for d in self.client.get_json("drivers", {"session_key": self.session_key})}
+
+    def _params(self, field: str, cursor) -> dict:
+        params = {"session_key": self.session_key}
+        # Sent as 'field%3E=cursor', which the API reads as field>=cursor; records at the cursor are seen again
+        if cursor is not None:
+            params[f"{field}>"] = cursor
+        return params
+
+    def _driver(self, driver_number) -> DriverLive:
+        if driver_number not in self.drivers:
+            self.drivers[driver_number] = DriverLive()
+        return self.drivers[driver_number]
+
+    def apply(self, laps: list, positions: list) -> bool:
+        """Adds /laps and /position records, moves the cursors on and returns whether anything changed."""
+        changed = False
+        for lap in laps:
+            if lap.get("driver_number") is not None:
+                changed = self._driver(lap["driver_number"]).add_lap(lap) or changed
+        for entry in positions:
+            date = parse_date(entry.get("date"))
+            if entry.get("driver_number") is None or date is None:
+                continue
+            changed = self._driver(entry["driver_number"]).add_position(date, entry.get("position")) or changed
+            if self.position_date is None or date > self.position_date:
+                self.position_cursor, self.position_date = entry["date"], date
+        self.lap_cursor = self._lap_cursor()
+        return changed
+
+    def _lap_cursor(self):
+        # The start of the earliest of the active drivers' latest laps, so that no lap still in progress,
+        # or published late, is skipped
+        started = [d for d in self.drivers.values() if d.last_lap_date is not None]
+        if not started:
+            return None
+        horizon = max(d.last_lap_date for d in started) - timedelta(seconds=ACTIVE_LAP_SECONDS)
+        return min((d for d in started if d.last_lap_date >= horizon), key=lambda d: d.last_lap_date).last_lap_start
+
+    def poll(self) -> bool:
+        """Fetches the records since the cursors, rescoring the session if any changed.  Returns whether any did."""
+        laps, positions = self.client.fetch_many([
+            ("laps", self._params("date_start", self.lap_cursor)),
+            ("position", self._params("date", self.position_cursor)),
+        ])
+        with instrumentation.stage("live_score", rows=len(laps) + len(positions)):
+            changed = self.apply(laps, positions)
+            if changed:
+                self.standings = self.score()
+        return changed
+
+    def table(self) -> pd.DataFrame:
+        """Returns the current stats of every driver, one row each, in the columns of STANDINGS_COLUMNS."""
+        rows = []
+        for driver_number, driver in sorted(self.drivers.items()):
+            info = self.info.get(driver_number, {})
+            team_name = info.get("team_name")
+            rows.append({
+                "session_key": self.session_key,
+                "driver_number": driver_number,
+                "driver_name": info.get("full_name"),
+                "team_name": team_name,
+                "team_name_mapped": TEAM_NAME_MAPPING.get(team_name, team_name),
+                **driver.row(),
+            })
+        return pd.DataFrame(rows, columns=STANDINGS_COLUMNS)
+
+    def score(self) -> pd.DataFrame:
+        """
+        Returns table() with the normalized scores, weighted_score and its rank (1 is best) added, in
+        current race order.  Only this session's rows are scored, as the normalization is per session.
+        Weighted metrics the live table does not have, such as the lap pace columns, are left out.
+        """
+        df = self.table()
+        metrics = [col for col in SCORE_WEIGHTS if col in df.columns]
+        df = add_normalized_score_columns(df, {col: SCORE_DIRECTIONS[col] for col in metrics})
+        df["weighted_score"] = score_weight_matrix(df, [[SCORE_WEIGHTS[col] for col in metrics]], metrics)[:, 0]
+        df["rank_weighted_score"] = df["weighted_score"].rank(method="min", ascending=False).astype("Int16")
+        return df.sort_values(["final_position", "driver_number"], ignore_index=True)
+
+
+def live_client(base_url: str = OPENF1_BASE_URL, rate_limits=OPENF1_LIVE_RATE_LIMITS) -> OpenF1Client:
+    """
+    Returns a client without a response cache, as live responses change with every poll.  Live data
+    needs an OpenF1 account, whose access token is read from the OPENF1_ACCESS_TOKEN environment variable.
+    """
+    client = OpenF1Client(base_url=base_url, rate_limits=rate_limits, max_workers=2, max_retries=2, timeout=10)
+    token = os.environ.get("OPENF1_ACCESS_TOKEN")
+    if token:
+        client.session.headers["Authorization"] = f"Bearer {token}"
+    return client
+
+
+def write_standings(session: LiveSession, path: str = OUTPUT_FILE_LIVE_STANDINGS):
+    """Writes the session's standings as JSON, replacing the previous file in one step."""
+    standings = json.loads(session.standings.to_json(orient="records"))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"session_key": session.session_key, "updated_at": time.time(), "standings": standings}, f)
+    os.replace(tmp_path, path)
+
+
+def run(session_key, client: OpenF1Client = None, interval: float = LIVE_POLL_INTERVAL, idle_timeout: float = LIVE_IDLE_TIMEOUT,
+        output_path: str = OUTPUT_FILE_LIVE_STANDINGS, until=None) -> LiveSession:
+    """
+    Polls a session every interval seconds, writing the standings to output_path after every poll that
+    changed them, until no new data has arrived for idle_timeout seconds or until() has returned True.
+    until() is checked before each poll, so the last poll sees all the data published by then.  Returns
+    the LiveSession.
+    """
+    session = LiveSession(session_key, client or live_client())
+    session.load_drivers()
+    logging.info(f"Following session {session.session_key} with {len(session.info)} drivers")
+    last_data = time.monotonic()
+    while True:
+        started = time.monotonic()
+        done = until is not None and until()
+        if session.poll():
+            last_data = started
+            if output_path:
+                write_standings(session, output_path)
+            leader = session.standings.iloc[0]
+            logging.info(f"Standings updated {(time.monotonic() - started) * 1000:.0f} ms after polling: "
+                         f"{int(session.standings['laps'].max())} laps, leader {leader['driver_name'] or leader['driver_number']}")
+        elif started - last_data > idle_timeout:
+            logging.info(f"No new data for {idle_timeout:.0f}s; session {session.session_key} is over")
+            break
+        if done:
+            break
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    return session
+
+
+def main(session_key, base_url: str = OPENF1_BASE_URL, interval: float = LIVE_POLL_INTERVAL, idle_timeout: float = LIVE_IDLE_TIMEOUT):
+    try:
+        run(session_key, live_client(base_url), interval, idle_timeout)
+    except KeyboardInterrupt:
+        logging.info("Stopped")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Follow a race in progress and keep its standings up to date.")
+    parser.add_argument("session_key", type=int, help="OpenF1 session_key of the race")
+    parser.add_argument("--base-url", default=OPENF1_BASE_URL, help="API to poll, e.g. a replay_server.py stand-in")
+    parser.add_argument("--interval", type=float, default=LIVE_POLL_INTERVAL, help="seconds between polls")
+    parser.add_argument("--idle-timeout", type=float, default=LIVE_IDLE_TIMEOUT, help="seconds without new data before stopping")
+    args = parser.parse_args()
+    main(args.session_key, args.base_url, args.interval, args.idle_timeout)
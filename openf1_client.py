@@ -0,0 +1,298 @@
+"""
+Shared, rate-limited HTTP client for the OpenF1 API.  All scripts go through one pooled requests.Session,
+and every call first takes a token from each of the configured token buckets, so the API quota is
+respected however many worker threads are fetching at once.  Responses with HTTP 429 or 5xx are retried
+with jittered exponential backoff, honouring any Retry-After header sent by the server.  Decoded responses
+can be kept in a ResponseCache, and in offline mode the client only ever reads from that cache, expired
+entries included.  Responses that may still change (empty ones, and those for a session that has not
+ended and settled yet) are cached with a short TTL rather than for good.
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+from response_cache import ResponseCache
+from json_stream import iter_json_array, decode_chunks, READ_CHUNK_SIZE
+from common import (
+    OPENF1_BASE_URL,
+    OPENF1_CACHE_PROVISIONAL_TTL,
+    OPENF1_SESSION_SETTLE_SECONDS,
+    OPENF1_RATE_LIMITS,
+    OPENF1_MAX_WORKERS,
+    OPENF1_MAX_RETRIES,
+)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing on average `rate` acquisitions per second, with bursts of
+    up to `capacity`.  acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            instrumentation.record_wait("rate_limit", wait)
+            time.sleep(wait)
+
+    def drain(self):
+        """Empties the bucket, e.g. after the server has told us we are over quota."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = 0
+
+
+def parse_retry_after(value) -> float:
+    """Returns the number of seconds to wait for a Retry-After header value, or None if it is missing or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class OpenF1Client:
+    """
+    Pooled, rate-limited client for the OpenF1 API.  get_json() fetches a single endpoint, and
+    fetch_many() fetches a list of (endpoint, params) calls concurrently on a thread pool.
+    If a cache is given, get_json() serves responses from it before calling the API, and with
+    offline=True a cache miss raises LookupError instead of touching the network.  The end of every
+    session seen in a /sessions response is kept, to tell which sessions' responses are final.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OPENF1_BASE_URL,
+        rate_limits=OPENF1_RATE_LIMITS,
+        max_workers: int = OPENF1_MAX_WORKERS,
+        max_retries: int = OPENF1_MAX_RETRIES,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 30.0,
+        timeout: float = 30,
+        cache: ResponseCache = None,
+        offline: bool = False,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.buckets = [TokenBucket(rate, capacity) for rate, capacity in rate_limits]
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pause_until = 0.0
+        self._pause_lock = threading.Lock()
+        # session_key: date_end as a POSIX timestamp
+        self.session_ends = {}
+
+    def _wait_for_turn(self):
+        # A 429 on any thread pauses every worker until the server's Retry-After has passed, including
+        # workers that were already waiting for a token when it came, so the pause is checked again after
+        while True:
+            with self._pause_lock:
+                pause = self._pause_until - time.monotonic()
+            if pause > 0:
+                instrumentation.record_wait("quota_pause", pause)
+                time.sleep(pause)
+            for bucket in self.buckets:
+                bucket.acquire()
+            with self._pause_lock:
+                if self._pause_until <= time.monotonic():
+                    return
+
+    def _pause(self, seconds: float):
+        with self._pause_lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+        for bucket in self.buckets:
+            bucket.drain()
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: a random wait between zero and the capped exponential delay
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def get(self, endpoint: str, params: dict = None, **kwargs) -> requests.Response:
+        """
+        Performs a rate-limited GET of BASE_URL/endpoint, retrying on 429, 5xx and connection errors.
+        Returns the successful response, or raises the last error once retries are exhausted.
+        """
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_turn()
+            logging.info(f"API call: {url} | params: {params}")
+            start = time.perf_counter()
+            try:
+                resp = self.session.get(url, params=params, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                instrumentation.record_api_call(endpoint, time.perf_counter() - start, "error")
+                if attempt == self.max_retries:
+                    raise
+                wait = self._backoff(attempt)
+                logging.warning(f"API error for {url}: {e}; retrying in {wait:.1f}s")
+                instrumentation.record_wait("retry_backoff", wait)
+                time.sleep(wait)
+                continue
+            instrumentation.record_api_call(endpoint, time.perf_counter() - start, resp.status_code)
+
+            if resp.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                resp.raise_for_status()
+                return resp
+
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            wait = retry_after if retry_after is not None else self._backoff(attempt)
+            logging.warning(f"API returned HTTP {resp.status_code} for {url}; retrying in {wait:.1f}s")
+            resp.close()
+            if resp.status_code == 429:
+                self._pause(wait)
+            else:
+                instrumentation.record_wait("retry_backoff", wait)
+                time.sleep(wait)
+
+    def _record_session_ends(self, endpoint: str, data):
+        if endpoint.strip("/") != "sessions":
+            return
+        for session in data:
+            if session.get("session_key") is not None and session.get("date_end"):
+                date_end = datetime.fromisoformat(session["date_end"].replace("Z", "+00:00"))
+                self.session_ends[int(session["session_key"])] = date_end.timestamp()
+
+    def provisional_ttl(self, params: dict = None, empty: bool = False):
+        """
+        Returns OPENF1_CACHE_PROVISIONAL_TTL for a response that may still change: an empty one, or one
+        for a session that ended less than OPENF1_SESSION_SETTLE_SECONDS ago or is yet to end.  Returns
+        None for a final response, including one for a session whose end has not been seen.
+        """
+        if empty:
+            return OPENF1_CACHE_PROVISIONAL_TTL
+        session_key = (params or {}).get("session_key")
+        date_end = self.session_ends.get(int(session_key)) if session_key is not None else None
+        if date_end is not None and time.time() < date_end + OPENF1_SESSION_SETTLE_SECONDS:
+            return OPENF1_CACHE_PROVISIONAL_TTL
+        return None
+
+    def get_json(self, endpoint: str, params: dict = None):
+        """Fetches an endpoint and returns the decoded JSON body, using the response cache if there is one."""
+        if self.cache is not None:
+            data = self.cache.get(endpoint, params, allow_stale=self.offline)
+            if data is not None:
+                logging.info(f"Cache hit: {endpoint} | params: {params} | entries: {len(data)}")
+                self._record_session_ends(endpoint, data)
+                return data
+        if self.offline:
+            raise LookupError(f"No cached response for {endpoint} with params {params} in offline mode")
+
+        data = self.get(endpoint, params).json()
+        logging.info(f"Entries returned: {len(data)}")
+        self._record_session_ends(endpoint, data)
+        if self.cache is not None:
+            self.cache.put(endpoint, params, data, ttl=self.provisional_ttl(params, empty=not data))
+        return data
+
+    def stream_json(self, endpoint: str, params: dict = None):
+        """
+        Yields the elements of an endpoint's JSON array response one at a time, parsing the body
+        incrementally as it arrives rather than decoding it in one go.  The raw body is written to
+        the response cache as it streams, and cached responses are streamed back from disk.
+        """
+        if self.cache is not None:
+            cached = self.cache.iter_data(endpoint, params, allow_stale=self.offline)
+            if cached is not None:
+                logging.info(f"Cache hit: {endpoint} | params: {params}")
+                yield from cached
+                return
+        if self.offline:
+            raise LookupError(f"No cached response for {endpoint} with params {params} in offline mode")
+
+        resp = self.get(endpoint, params, stream=True)
+        writer = self.cache.open_writer(endpoint, params, ttl=self.provisional_ttl(params)) if self.cache is not None else None
+        finished = False
+        try:
+            def body_chunks():
+                for chunk in resp.iter_content(READ_CHUNK_SIZE):
+                    if writer is not None:
+                        writer.write(chunk)
+                    yield chunk
+
+            count = 0
+            for element in iter_json_array(decode_chunks(body_chunks())):
+                count += 1
+                yield element
+            logging.info(f"Entries returned: {count}")
+            if writer is not None:
+                if count:
+                    writer.commit()
+                else:
+                    writer.abort()
+                    self.cache.put(endpoint, params, [], ttl=self.provisional_ttl(params, empty=True))
+                finished = True
+        finally:
+            resp.close()
+            if writer is not None and not finished:
+                writer.abort()
+
+    def fetch_many(self, calls: list) -> list:
+        """
+        Fetches a list of (endpoint, params) tuples concurrently and returns the decoded JSON bodies
+        in the same order as calls.
+        """
+        if len(calls) <= 1:
+            return [self.get_json(endpoint, params) for endpoint, params in calls]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda call: self.get_json(*call), calls))
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client(offline: bool = None) -> OpenF1Client:
+    """
+    Returns the process-wide shared OpenF1Client backed by the on-disk ResponseCache, creating it
+    on first use.  If offline is given, the shared client is switched into or out of offline mode.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = OpenF1Client(cache=ResponseCache())
+        if offline is not None:
+            _default_client.offline = offline
+        return _default_client
@@ -0,0 +1,270 @@
+"""
+Read-only query service over the performance and upgrades output, for the lookups analysts otherwise make
+by loading the whole workbook into pandas: a driver across seasons, a team in races with upgrades, or the
+top drivers by weighted_score at a circuit.  The output is loaded once, from the Parquet file if there is
+one, else from the workbook (through its Parquet sidecar) or, before process_upgrades has run, from the
+performance_rating output.  Every filter column has an index from its values to row positions, so a
+lookup only touches the rows it returns, and results are kept in an LRU cache.  The source files are
+checked by size and modification time before every query, and the output is reloaded and the cache
+cleared as soon as any of them changes.  start_server() answers the same queries as JSON over local HTTP.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+from common import (
+    setup_logging,
+    CACHE_FILE_DRIVER_PERF,
+    OUTPUT_FILE_PERF_AND_UPGRADES,
+    OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET,
+    QUERY_CACHE_SIZE,
+    QUERY_PORT,
+)
+from schema import apply_schema, read_csv_typed
+from xlsx_cache import read_excel_cached
+
+# In order of preference; the first that exists is loaded
+QUERY_SOURCES = [OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET, OUTPUT_FILE_PERF_AND_UPGRADES, CACHE_FILE_DRIVER_PERF]
+# Filter name: indexed column(s).  A season on its own is looked up through the race index.
+QUERY_INDEXES = {
+    "driver_number": "driver_number",
+    "team_name_mapped": "team_name_mapped",
+    "session_key": "session_key",
+    "race": ["season_year", "race_number"],
+    "race_location": "race_location",
+}
+QUERY_FILTERS = {
+    "driver_number": int,
+    "team_name_mapped": str,
+    "session_key": int,
+    "season_year": int,
+    "race_number": int,
+    "race_location": str,
+}
+# Rows come back in race order unless sorted by one of these, e.g. sort=-weighted_score
+SORT_COLUMNS = ["weighted_score", "score_best_lap_time", "score_avg_lap_time", "score_position_change",
+                "score_final_position", "best_lap_time", "avg_lap_time", "grid_position", "final_position",
+                "position_change", "upgrade_count"]
+
+
+def _load(path: str) -> pd.DataFrame:
+    if path.endswith(".parquet"):
+        return apply_schema(pd.read_parquet(path))
+    if path.endswith(".xlsx"):
+        return apply_schema(read_excel_cached(path))
+    return read_csv_typed(path)
+
+
+class PerfQuery:
+    """
+    Indexed, cached lookups over the first of sources that exists.  Safe to share between threads;
+    the rows returned are shared with the cache and must not be modified.
+    """
+
+    def __init__(self, sources: list = None, cache_size: int = QUERY_CACHE_SIZE):
+        self.sources = sources or QUERY_SOURCES
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.signature = None
+        self.source = None
+        self.records = []
+        self.indexes = {}
+        self.seasons = {}
+        self.sort_values = {}
+        self.upgraded = None
+
+    def _signature(self) -> tuple:
+        signature = []
+        for path in self.sources:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def refresh(self) -> bool:
+        """Reloads the output and clears the cache if a source file has changed.  Returns whether it did."""
+        signature = self._signature()
+        if signature == self.signature:
+            return False
+        if not signature:
+            raise FileNotFoundError(f"None of {', '.join(self.sources)} exists; run performance_rating.py first")
+        with instrumentation.stage("query_load") as stage:
+            self.source = signature[0][0]
+            df = _load(self.source)
+            self._build(df)
+            stage.rows = len(df)
+        self.signature = signature
+        self.cache.clear()
+        logging.info(f"Loaded {len(self.records)} rows from {self.source} for queries")
+        return True
+
+    def _build(self, df: pd.DataFrame):
+        df = df.sort_values(["season_year", "race_number", "final_position", "driver_number"], ignore_index=True)
+        self.records = json.loads(df.to_json(orient="records"))
+        self.indexes = {name: df.groupby(columns, observed=True, sort=False).indices for name, columns in QUERY_INDEXES.items()}
+        # Rows are in race order, so each season's rows are its races' rows one after the other
+        seasons = {}
+        for (season_year, _), positions in sorted(self.indexes["race"].items()):
+            seasons.setdefault(season_year, []).append(positions)
+        self.seasons = {season_year: np.concatenate(parts) for season_year, parts in seasons.items()}
+        self.sort_values = {col: df[col].to_numpy(dtype="float64", na_value=np.nan) for col in SORT_COLUMNS if col in df.columns}
+        # Rows of races where the team brought at least one upgrade; none before process_upgrades has run
+        upgrades = self.sort_values.get("upgrade_count")
+        self.upgraded = np.flatnonzero(upgrades > 0) if upgrades is not None else np.array([], dtype=np.intp)
+
+    def _positions(self, filters: dict, upgraded: bool) -> np.ndarray:
+        lookups = []
+        if "season_year" in filters and "race_number" in filters:
+            lookups.append(self.indexes["race"].get((filters["season_year"], filters["race_number"])))
+        elif "season_year" in filters:
+            lookups.append(self.seasons.get(filters["season_year"]))
+        elif "race_number" in filters:
+            raise ValueError("race_number needs a season_year")
+        for name in ["driver_number", "team_name_mapped", "session_key", "race_location"]:
+            if name in filters:
+                lookups.append(self.indexes[name].get(filters[name]))
+        if upgraded:
+            lookups.append(self.upgraded)
+        if not lookups:
+            return np.arange(len(self.records))
+        if any(positions is None for positions in lookups):
+            return np.array([], dtype=np.intp)
+        # Index positions are in ascending order, so intersecting keeps the race order
+        lookups.sort(key=len)
+        positions = lookups[0]
+        for other in lookups[1:]:
+            positions = np.intersect1d(positions, other, assume_unique=True)
+        return positions
+
+    def query(self, sort: str = None, limit: int = None, upgraded: bool = False, **filters) -> list:
+        """
+        Returns the rows matching every filter in filters (any of QUERY_FILTERS), in race order or sorted
+        by a column of SORT_COLUMNS (descending if prefixed with '-'), up to limit rows.  With
+        upgraded=True, only rows of races where the driver's team brought an upgrade are returned.
+        Raises ValueError for an unknown filter or sort column, or a negative limit.
+        """
+        unknown = set(filters) - set(QUERY_FILTERS)
+        if unknown:
+            raise ValueError(f"Unknown filters {sorted(unknown)}; expected some of {list(QUERY_FILTERS)}")
+        filters = {name: QUERY_FILTERS[name](value) for name, value in filters.items() if value is not None}
+        if sort is not None and sort.lstrip("-") not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort}; expected one of {SORT_COLUMNS}")
+        if limit is not None and limit < 0:
+            raise ValueError(f"limit must not be negative, got {limit}")
+        key = (tuple(sorted(filters.items())), sort, limit, bool(upgraded))
+        with self.lock:
+            self.refresh()
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                instrumentation.record_cache("query", hit=True)
+                return self.cache[key]
+            instrumentation.record_cache("query", hit=False)
+            positions = self._positions(filters, upgraded)
+            if sort is not None:
+                values = self.sort_values.get(sort.lstrip("-"))
+                if values is None:
+                    raise ValueError(f"{self.source} has no {sort.lstrip('-')} column")
+                values = values[positions]
+                # Stable, with missing values last either way
+                order = np.argsort(-values if sort.startswith("-") else values, kind="stable")
+                positions = positions[order]
+            if limit is not None:
+                positions = positions[:limit]
+            rows = [self.records[i] for i in positions]
+            self.cache[key] = rows
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return rows
+
+    def info(self) -> dict:
+        with self.lock:
+            self.refresh()
+            return {
+                "source": self.source,
+                "rows": len(self.records),
+                "indexes": {name: len(index) for name, index in self.indexes.items()},
+                "cached_queries": len(self.cache),
+            }
+
+
+def parse_query(query: str) -> dict:
+    """Returns the keyword arguments of PerfQuery.query() for a URL query string."""
+    params = dict(parse_qsl(query))
+    if "limit" in params:
+        params["limit"] = int(params["limit"])
+    if "upgraded" in params:
+        params["upgraded"] = params["upgraded"].lower() in ("1", "true", "yes")
+    return params
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    perf_query = None
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/")
+        try:
+            if path == "/query":
+                rows = self.perf_query.query(**parse_query(url.query))
+                self._send_json(200, {"count": len(rows), "rows": rows})
+            elif path in ("", "/status"):
+                self._send_json(200, self.perf_query.info())
+            else:
+                self._send_json(404, {"error": f"Unknown path {url.path}; use /query or /status"})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except FileNotFoundError as e:
+            self._send_json(503, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        logging.debug(f"Query server: {format % args}")
+
+
+def start_server(perf_query: PerfQuery, port: int = QUERY_PORT) -> ThreadingHTTPServer:
+    """Serves perf_query on localhost from a background thread (port 0 for any free port); the base URL is at .base_url."""
+    handler = type("BoundQueryHandler", (QueryHandler,), {"perf_query": perf_query})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(port: int = QUERY_PORT):
+    """Loads the output and serves queries on port until interrupted."""
+    perf_query = PerfQuery()
+    perf_query.refresh()
+    server = start_server(perf_query, port)
+    logging.info(f"Serving queries from {server.base_url}/query, e.g. ?driver_number=1 or ?race_location=Monaco&sort=-weighted_score&limit=3")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Serve indexed, cached queries over the performance and upgrades output.")
+    parser.add_argument("--port", type=int, default=QUERY_PORT, help="local port to serve JSON queries on")
+    args = parser.parse_args()
+    main(args.port)
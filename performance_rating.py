@@ -4,10 +4,17 @@ file, I prompted each function one at a time until it worked as expected, then m
 next function.  Smarter prompting could undoubtedly have got it to write more functionality in one go.
 """
 
+import numpy as np
 import pandas as pd
+import json
 import logging
+import os
+import warnings
 
-from common import setup_logging, CACHE_FILE_DRIVER_STATS, CACHE_FILE_DRIVER_PERF
+import instrumentation
+from common import setup_logging, CACHE_FILE_DRIVER_PERF, CACHE_FILE_DRIVER_PERF_PARAMS
+from schema import apply_schema, read_csv_typed, write_csv_typed
+from stats_store import load_driver_stats
 
 
 def filter_by_session_key(df: pd.DataFrame, session_key) -> pd.DataFrame:
@@ -81,6 +88,19 @@ def add_normalized_score_column(
     return df_copy
 
 
+# Direction of each metric that can be normalized; True means a higher raw value is better.
+# Any of these can be used as a score input by giving it a weight in SCORE_WEIGHTS.
+SCORE_DIRECTIONS = {
+    "best_lap_time": False,
+    "avg_lap_time": False,
+    "position_change": True,
+    "final_position": False,
+    # Lap pace columns from lap_analytics
+    "median_lap_time": False,
+    "percentile_lap_time": False,
+    "deg_slope": False,
+}
+
 # Configuration dictionary for score weights
 SCORE_WEIGHTS = {
     "best_lap_time": 1.0,
@@ -89,6 +109,108 @@ SCORE_WEIGHTS = {
     "final_position": 2.0,
 }
 
+
+def add_normalized_score_columns(df: pd.DataFrame, directions: dict = None) -> pd.DataFrame:
+    """
+    Returns a new DataFrame with a 'score_{column_name}' column added for every column in directions,
+    mapping each column name to its higher_is_better flag.  Defaults to every metric in SCORE_WEIGHTS,
+    with its direction from SCORE_DIRECTIONS.
+    Produces the same values as add_normalized_score_column, but computes the per-session min/max of
+    all columns in one grouped pass instead of re-filtering the DataFrame for every row.
+    The original DataFrame is not modified.
+    """
+    if directions is None:
+        directions = {col: SCORE_DIRECTIONS[col] for col in SCORE_WEIGHTS}
+    duplicated = df.duplicated(subset=["session_key", "driver_number"], keep=False)
+    if duplicated.any():
+        # Only the key columns, so that the row is not upcast to float by the others
+        first = df.loc[duplicated, ["session_key", "driver_number"]].iloc[0]
+        raise ValueError(f"Expected exactly one row for session_key={first['session_key']}, driver_number={first['driver_number']}, found {int(duplicated.sum())} duplicate rows")
+
+    df_copy = df.copy()
+    columns = list(directions.keys())
+    # Grouped as float64, whatever the compact dtypes of the columns
+    values = df[columns].to_numpy(dtype=float, na_value=np.nan)
+    grouped = pd.DataFrame(values).groupby(df["session_key"].to_numpy(), sort=False)
+    min_vals = grouped.transform("min").to_numpy()
+    max_vals = grouped.transform("max").to_numpy()
+    higher_is_better = np.array([directions[col] for col in columns])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        span = max_vals - min_vals
+        normalized = np.where(higher_is_better, values - min_vals, max_vals - values) / span
+    # Avoid division by zero; all values in the session are the same
+    normalized = np.where(max_vals == min_vals, higher_is_better.astype(float), normalized)
+
+    for i, col in enumerate(columns):
+        df_copy[f"score_{col}"] = normalized[:, i]
+    return df_copy
+
+
+def score_weight_matrix(df: pd.DataFrame, weight_matrix, metrics: list = None) -> np.ndarray:
+    """
+    Returns an array of shape (rows, configurations) holding the weighted score of every row under
+    every candidate weighting, computed as one matrix multiply against the 'score_' columns.
+    weight_matrix has shape (configurations, metrics), with columns in the order of metrics
+    (defaults to the keys of SCORE_WEIGHTS). A DataFrame of weights is reordered by its column names.
+    """
+    if metrics is None:
+        metrics = list(SCORE_WEIGHTS.keys())
+    if isinstance(weight_matrix, pd.DataFrame):
+        weight_matrix = weight_matrix[metrics]
+    weights = np.atleast_2d(np.asarray(weight_matrix, dtype=float))
+    if weights.shape[1] != len(metrics):
+        raise ValueError(f"Expected {len(metrics)} weights per configuration ({metrics}), got {weights.shape[1]}")
+    scores = df[[f"score_{col}" for col in metrics]].to_numpy(dtype=float)
+    return scores @ weights.T
+
+
+def rank_weighted_scores(df: pd.DataFrame, weighted_scores: np.ndarray) -> np.ndarray:
+    """
+    Returns an array with the same shape as weighted_scores giving each row's rank within its
+    session_key for every configuration, where 1 is the highest weighted score.
+    Ties share the lowest rank, and rows with a missing score get NaN.
+    """
+    df_scores = pd.DataFrame(weighted_scores, index=df.index)
+    ranks = df_scores.groupby(df["session_key"], sort=False).rank(method="min", ascending=False)
+    return ranks.to_numpy()
+
+
+def summarize_rank_stability(df: pd.DataFrame, ranks: np.ndarray, baseline: int = 0) -> pd.DataFrame:
+    """
+    Returns a DataFrame with one row per input row summarizing how its session rank varies across
+    configurations: mean, standard deviation, best and worst rank, and the share of configurations
+    that keep the rank given by the baseline configuration (column index of ranks).
+    """
+    # Rows with no score at all (e.g. missing lap times) have all-NaN ranks and stay NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        stability = pd.DataFrame({
+            "session_key": df["session_key"].to_numpy(),
+            "driver_number": df["driver_number"].to_numpy(),
+            "baseline_rank": ranks[:, baseline],
+            "rank_mean": np.nanmean(ranks, axis=1),
+            "rank_std": np.nanstd(ranks, axis=1),
+            "rank_best": np.nanmin(ranks, axis=1),
+            "rank_worst": np.nanmax(ranks, axis=1),
+            "baseline_rank_share": (ranks == ranks[:, [baseline]]).mean(axis=1),
+        }, index=df.index)
+    stability.loc[stability["baseline_rank"].isna(), "baseline_rank_share"] = np.nan
+    return stability
+
+
+def weight_sensitivity(df: pd.DataFrame, weight_matrix, metrics: list = None):
+    """
+    Scores df under every candidate weighting in weight_matrix at once (see score_weight_matrix).
+    Returns a tuple of (weighted scores, session ranks, rank stability DataFrame), where the
+    first configuration is used as the baseline for the stability statistics.
+    """
+    weighted_scores = score_weight_matrix(df, weight_matrix, metrics)
+    ranks = rank_weighted_scores(df, weighted_scores)
+    stability = summarize_rank_stability(df, ranks)
+    return weighted_scores, ranks, stability
+
+
 def add_weighted_score_column(df: pd.DataFrame) -> pd.DataFrame:
     """
     Returns a new DataFrame with a new column 'weighted_score' which is the sum of each
@@ -96,40 +218,168 @@ def add_weighted_score_column(df: pd.DataFrame) -> pd.DataFrame:
     The input DataFrame is not modified.
     """
     df_copy = df.copy()
-    weighted_scores = []
-    score_columns = [f"score_{col}" for col in SCORE_WEIGHTS.keys()]
+    weights = [list(SCORE_WEIGHTS.values())]
+    df_copy["weighted_score"] = score_weight_matrix(df_copy, weights)[:, 0]
+    return df_copy
 
-    # Calculate weighted score for each row
-    for _, row in df_copy.iterrows():
-        weighted_sum = sum(row[score_col] * SCORE_WEIGHTS[col]
-                           for col, score_col in zip(SCORE_WEIGHTS.keys(), score_columns))
-        weighted_scores.append(weighted_sum)
 
-    df_copy["weighted_score"] = weighted_scores
-    return df_copy
+def rate_driver_performance(df_driver_stats: pd.DataFrame) -> pd.DataFrame:
+    """Returns a new DataFrame with the normalized score columns and 'weighted_score' added."""
+    df_driver_stats = add_normalized_score_columns(df_driver_stats)
+    logging.info(f"After normalizing {list(SCORE_WEIGHTS.keys())}: {df_driver_stats.shape}")
 
+    df_driver_stats = add_weighted_score_column(df_driver_stats)
+    logging.info(f"After adding weighted scores: {df_driver_stats.shape}")
+    return df_driver_stats
 
-def main():
-    df_driver_stats = pd.read_csv(CACHE_FILE_DRIVER_STATS)
-    logging.info(f"Loaded driver stats: {df_driver_stats.shape}")
 
-    df_driver_stats = add_normalized_score_column(df_driver_stats, "best_lap_time", higher_is_better=False)
-    logging.info(f"After best_lap_time normalization: {df_driver_stats.shape}")
+def session_fingerprints(df: pd.DataFrame, columns: list) -> pd.Series:
+    """
+    Returns a Series indexed by session_key with an order-independent fingerprint of the given columns
+    across all of the session's rows.
+    """
+    row_hashes = pd.util.hash_pandas_object(df[columns], index=False)
+    grouped = row_hashes.groupby(df["session_key"].to_numpy())
+    # Sum of row hashes (wrapping on overflow) plus the row count, so reordered rows do not count as changes
+    return grouped.sum().astype(str) + ":" + grouped.size().astype(str)
 
-    df_driver_stats = add_normalized_score_column(df_driver_stats, "avg_lap_time", higher_is_better=False)
-    logging.info(f"After avg_lap_time normalization: {df_driver_stats.shape}")
 
-    df_driver_stats = add_normalized_score_column(df_driver_stats, "position_change", higher_is_better=True)
-    logging.info(f"After position_change normalization: {df_driver_stats.shape}")
+def find_changed_sessions(df_stats: pd.DataFrame, df_perf_prev: pd.DataFrame) -> set:
+    """
+    Returns the session_keys in df_stats whose rows differ from the previously scored df_perf_prev,
+    comparing every df_stats column.  Sessions missing from df_perf_prev count as changed.
+    """
+    columns = list(df_stats.columns)
+    df_prev = df_perf_prev[columns].copy()
+    for col in columns:
+        # Categories differ between runs over different seasons, and categoricals hash by value anyway
+        if isinstance(df_prev[col].dtype, pd.CategoricalDtype) or isinstance(df_stats[col].dtype, pd.CategoricalDtype):
+            continue
+        if df_prev[col].dtype != df_stats[col].dtype:
+            try:
+                df_prev[col] = df_prev[col].astype(df_stats[col].dtype)
+            except (TypeError, ValueError):
+                pass
+    current = session_fingerprints(df_stats, columns)
+    previous = session_fingerprints(df_prev, columns).reindex(current.index)
+    return set(current.index[current != previous])
 
-    df_driver_stats = add_normalized_score_column(df_driver_stats, "final_position", higher_is_better=False)
-    logging.info(f"After final_position normalization: {df_driver_stats.shape}")
 
-    df_driver_stats = add_weighted_score_column(df_driver_stats)
-    logging.info(f"After adding weighted scores: {df_driver_stats.shape}")
+def score_params() -> dict:
+    """Returns the parameters the score columns depend on; scores computed with other parameters cannot be reused."""
+    return {
+        "normalization": "session_min_max",
+        "directions": {col: SCORE_DIRECTIONS[col] for col in SCORE_WEIGHTS},
+    }
+
+
+def load_previous_scores(path: str = CACHE_FILE_DRIVER_PERF, params_path: str = CACHE_FILE_DRIVER_PERF_PARAMS):
+    """
+    Returns (df_perf_prev, params) from a previous save_scores, or (None, None) if there is none.
+    params is None if the scores were saved without their parameters.
+    """
+    if not os.path.exists(path):
+        return None, None
+    df_perf_prev = read_csv_typed(path, float_precision="round_trip")
+    params = None
+    if os.path.exists(params_path):
+        with open(params_path) as f:
+            params = json.load(f)
+    return df_perf_prev, params
+
+
+def save_scores(df_perf: pd.DataFrame, path: str = CACHE_FILE_DRIVER_PERF, params_path: str = CACHE_FILE_DRIVER_PERF_PARAMS):
+    """Writes the scores to path, and the score_params() they were computed with to params_path."""
+    write_csv_typed(df_perf, path)
+    tmp_path = f"{params_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(score_params(), f, indent=2, sort_keys=True)
+    os.replace(tmp_path, params_path)
+    logging.info(f"Saved processed driver stats to {path}")
+
+
+def rescore_if_stale(df_perf_prev: pd.DataFrame, prev_params: dict) -> pd.DataFrame:
+    """
+    Returns df_perf_prev, or if it was scored with other parameters than score_params(), df_perf_prev
+    rescored from its own stats columns, so that rows kept from it match newly scored rows.
+    """
+    if prev_params == score_params():
+        return df_perf_prev
+    logging.info("Score parameters changed since the previous scores; rescoring the rows kept from them")
+    score_columns = [col for col in df_perf_prev.columns if col.startswith("score_")] + ["weighted_score"]
+    return rate_driver_performance(df_perf_prev.drop(columns=score_columns, errors="ignore"))
+
+
+def rate_driver_performance_incremental(df_driver_stats: pd.DataFrame, df_perf_prev: pd.DataFrame, prev_params: dict = None) -> pd.DataFrame:
+    """
+    Returns the same result as rate_driver_performance, but only re-normalizes the sessions that have
+    changed since df_perf_prev was scored, reusing the previous score columns for every other session.
+    Normalization is per session, so unchanged sessions keep the same scores.  The weighted score is
+    recomputed for every row, so a change to SCORE_WEIGHTS still applies everywhere.
+    Falls back to a full rescore if df_perf_prev lacks any stats or score column, or if prev_params,
+    the parameters df_perf_prev was scored with, differ from score_params() or are unknown.
+    """
+    if prev_params != score_params():
+        logging.info("Score parameters changed since the previous scores, or are unknown; rescoring all sessions")
+        return rate_driver_performance(df_driver_stats)
+    score_columns = [f"score_{col}" for col in SCORE_WEIGHTS]
+    missing = [col for col in list(df_driver_stats.columns) + score_columns if col not in df_perf_prev.columns]
+    if missing:
+        logging.info(f"Previous scores lack columns {missing}; rescoring all sessions")
+        return rate_driver_performance(df_driver_stats)
+
+    changed = find_changed_sessions(df_driver_stats, df_perf_prev)
+    logging.info(f"Rescoring {len(changed)} of {df_driver_stats['session_key'].nunique()} sessions")
+    is_changed = df_driver_stats["session_key"].isin(changed)
+
+    df_rescored = add_normalized_score_columns(df_driver_stats[is_changed])
+    df_unchanged = df_driver_stats[~is_changed].merge(
+        df_perf_prev[["session_key", "driver_number"] + score_columns],
+        on=["session_key", "driver_number"],
+        how="left",
+    )
+    df_unchanged.index = df_driver_stats.index[~is_changed]
+
+    df_scored = pd.concat([df_rescored, df_unchanged]).loc[df_driver_stats.index]
+    df_scored = add_weighted_score_column(df_scored)
+    logging.info(f"After incremental scoring: {df_scored.shape}")
+    return df_scored
+
+
+def replace_seasons(df_perf_prev: pd.DataFrame, df_perf_seasons: pd.DataFrame, season_years) -> pd.DataFrame:
+    """
+    Returns df_perf_prev with all of its rows for season_years replaced by the rows of df_perf_seasons,
+    sorted by season and otherwise in their original order.
+    """
+    keep = ~df_perf_prev["season_year"].isin([int(season) for season in season_years])
+    df = pd.concat([df_perf_prev[keep], df_perf_seasons], ignore_index=True)
+    # Categoricals with different categories are concatenated as strings
+    return apply_schema(df.sort_values("season_year", kind="stable", ignore_index=True))
+
+
+@instrumentation.timed("rating")
+def main(incremental=True, season_years=None):
+    """
+    Scores the driver stats and saves them to CACHE_FILE_DRIVER_PERF.  With incremental=True and an
+    existing CACHE_FILE_DRIVER_PERF, only sessions whose stats have changed are re-normalized.
+    With season_years, only those seasons are loaded and scored, and the scores of every other season
+    in CACHE_FILE_DRIVER_PERF are kept as they are, unless the score parameters have changed since.
+    """
+    df_driver_stats = load_driver_stats(season_years=season_years)
+    logging.info(f"Loaded driver stats: {df_driver_stats.shape}")
+
+    df_perf_prev = prev_params = None
+    if incremental or season_years is not None:
+        df_perf_prev, prev_params = load_previous_scores()
+    if incremental and df_perf_prev is not None:
+        df_driver_stats = rate_driver_performance_incremental(df_driver_stats, df_perf_prev, prev_params)
+    else:
+        df_driver_stats = rate_driver_performance(df_driver_stats)
+    if season_years is not None and df_perf_prev is not None:
+        df_driver_stats = replace_seasons(rescore_if_stale(df_perf_prev, prev_params), df_driver_stats, season_years)
 
-    df_driver_stats.to_csv(CACHE_FILE_DRIVER_PERF, index=False)
-    logging.info(f"Saved processed driver stats to {CACHE_FILE_DRIVER_PERF}")
+    save_scores(df_driver_stats)
+    instrumentation.set_rows(len(df_driver_stats))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+"""
+Runs the tidy -> rating -> upgrades -> form -> correlation stages in one process, passing DataFrames between them in
+memory.  Each stage is keyed on a hash of its inputs and parameters (the upstream stage's key, the mapping
+and weight dictionaries, and any input files), and is skipped when the key matches the last successful run
+and its output is still on disk.  The tidy and rating stages are keyed per season, so only the seasons
+whose stats changed are re-run, and a run can be restricted to some seasons so that the store shards of
+every other season are never read.  Ingestion from the OpenF1 API only runs when asked for with fetch=True.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+import pandas as pd
+
+import instrumentation
+from common import (
+    setup_logging,
+    CACHE_FILE_DRIVER_PERF,
+    CACHE_FILE_FIA_DOCS,
+    DATA_FILE_UPGRADES,
+    OUTPUT_FILE_FORM,
+    OUTPUT_FILE_PERF_AND_UPGRADES,
+    OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET,
+    OUTPUT_FILE_UPGRADE_CORRELATION,
+    PIPELINE_STATE_FILE,
+)
+import form
+import query_race_stats
+import tidy_race_stats
+import performance_rating
+import process_upgrades
+import upgrade_correlation
+from schema import apply_schema, read_csv_typed
+from stats_store import DriverStatsStore
+
+STAGES = ["tidy", "rating", "upgrades", "form", "correlation"]
+# Stages keyed and run per season; the later stages are keyed on all seasons at once
+SEASON_STAGES = ["tidy", "rating"]
+
+def params_fingerprint(*values) -> str:
+    """Returns a SHA-256 of JSON-serializable values, independent of dictionary key order."""
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(path: str) -> str:
+    """Returns a SHA-256 of a file's contents, or 'missing' if it does not exist."""
+    if not os.path.exists(path):
+        return "missing"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Returns a SHA-256 of a DataFrame's column names and values."""
+    digest = hashlib.sha256(json.dumps(list(df.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_state(path: str = PIPELINE_STATE_FILE) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state: dict, path: str = PIPELINE_STATE_FILE):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def stage_keys(df_raw_stats: pd.DataFrame) -> dict:
+    """
+    Returns the input key of the tidy and rating stages for every season in df_raw_stats, as
+    {stage: {season_year: key}}, each chained on the key of the stage before it for the same season.
+    """
+    keys = {"tidy": {}, "rating": {}}
+    for season_year, df_season in df_raw_stats.groupby("season_year", sort=True):
+        season = str(season_year)
+        keys["tidy"][season] = params_fingerprint(frame_fingerprint(df_season), tidy_race_stats.TEAM_NAME_MAPPING)
+        keys["rating"][season] = params_fingerprint(
+            keys["tidy"][season],
+            performance_rating.SCORE_WEIGHTS,
+            {col: performance_rating.SCORE_DIRECTIONS[col] for col in performance_rating.SCORE_WEIGHTS},
+        )
+    return keys
+
+
+def upgrades_key(rating_keys: dict) -> str:
+    """Returns the input key of the upgrades stage, chained on the rating keys of every season."""
+    return params_fingerprint(
+        rating_keys,
+        file_fingerprint(DATA_FILE_UPGRADES),
+        file_fingerprint(CACHE_FILE_FIA_DOCS),
+        process_upgrades.TEAM_NAME_MAPPING,
+    )
+
+
+def _season_keys(state: dict, stage: str) -> dict:
+    # Runs from before the store was partitioned by season kept a single key per stage
+    keys = state.get(stage)
+    return keys if isinstance(keys, dict) else {}
+
+
+def run(fetch: bool = False, force: bool = False, season_years=None) -> dict:
+    """
+    Runs the pipeline, skipping every stage whose input key is unchanged since its last successful
+    run unless force is True, in which case the rating stage also rescores every session from scratch
+    instead of reusing the previous scores.  The tidy and rating stages are keyed per season and only run
+    for the seasons that changed; with season_years, only those seasons are loaded from the store at all,
+    and every other season is taken as unchanged.  Returns a dict of stage name to 'ran' or 'skipped'.
+    """
+    if fetch:
+        query_race_stats.main(season_years=season_years)
+
+    state = load_state()
+    store = DriverStatsStore()
+    seasons = [str(season) for season in (store.seasons() if season_years is None else sorted(season_years))]
+    df_stats = store.read(season_years=seasons)
+    # The tidy columns are written back to the store, so they must not count as input to the tidy stage
+    df_raw_stats = df_stats.drop(columns=tidy_race_stats.TIDY_COLUMNS, errors="ignore")
+    keys = stage_keys(df_raw_stats)
+    stats_seasons = df_stats["season_year"].astype(str)
+    perf_seasons = set()
+    if os.path.exists(CACHE_FILE_DRIVER_PERF):
+        perf_seasons = set(pd.read_csv(CACHE_FILE_DRIVER_PERF, usecols=["season_year"])["season_year"].astype(str))
+    outputs = {
+        "tidy": {
+            season: all(col in df_stats.columns and df_stats.loc[stats_seasons == season, col].notna().all()
+                        for col in tidy_race_stats.TIDY_COLUMNS)
+            for season in keys["tidy"]
+        },
+        "rating": {season: season in perf_seasons for season in keys["rating"]},
+    }
+
+    results = {}
+    df_tidy = df_stats
+    df_perf = df_perf_merged = None
+    for stage in SEASON_STAGES:
+        previous = _season_keys(state, stage)
+        to_run = [season for season, key in keys[stage].items()
+                  if force or previous.get(season) != key or not outputs[stage][season]]
+        # Seasons no longer in the store have no output to keep
+        removed = [season for season in previous if season not in keys[stage] and season_years is None]
+        if not to_run and not removed:
+            logging.info(f"Skipping stage '{stage}': inputs unchanged")
+            results[stage] = "skipped"
+            continue
+
+        logging.info(f"Running stage '{stage}' for seasons {to_run}")
+        is_run = stats_seasons.isin(to_run).to_numpy()
+        with instrumentation.stage(stage, rows=int(is_run.sum())):
+            if stage == "tidy" and to_run:
+                df_tidy_run = tidy_race_stats.tidy_driver_stats(df_raw_stats[is_run])
+                tidy_race_stats.save_tidy_columns(df_tidy_run, store)
+                # Seasons not re-run already have their tidy columns in the store
+                df_tidy = apply_schema(pd.concat([df_stats[~is_run], df_tidy_run]).loc[df_stats.index])
+            elif stage == "rating":
+                df_perf_prev, prev_params = performance_rating.load_previous_scores()
+                if df_perf_prev is not None:
+                    df_perf = df_tidy[is_run]
+                    # A forced run rescores every session of its seasons rather than reusing any previous scores
+                    if to_run and force:
+                        df_perf = performance_rating.rate_driver_performance(df_perf)
+                    elif to_run:
+                        df_perf = performance_rating.rate_driver_performance_incremental(df_perf, df_perf_prev, prev_params)
+                    df_perf_kept = performance_rating.rescore_if_stale(df_perf_prev, prev_params)
+                    df_perf = performance_rating.replace_seasons(df_perf_kept, df_perf, to_run + removed)
+                else:
+                    df_perf = performance_rating.rate_driver_performance(df_tidy[is_run])
+                performance_rating.save_scores(df_perf)
+
+        state[stage] = {season: key for season, key in {**previous, **keys[stage]}.items() if season not in removed}
+        save_state(state)
+        results[stage] = "ran"
+
+    stage = "upgrades"
+    key = upgrades_key(state.get("rating"))
+    has_output = os.path.exists(OUTPUT_FILE_PERF_AND_UPGRADES) and os.path.exists(OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET)
+    if not force and state.get(stage) == key and has_output:
+        logging.info(f"Skipping stage '{stage}': inputs unchanged")
+        results[stage] = "skipped"
+    else:
+        logging.info(f"Running stage '{stage}'")
+        if df_perf is None:
+            df_perf = read_csv_typed(CACHE_FILE_DRIVER_PERF)
+        with instrumentation.stage(stage, rows=len(df_perf)):
+            df_upgrades_merged = process_upgrades.merge_upgrades_with_fia_docs(
+                process_upgrades.load_and_map_upgrades(),
+                process_upgrades.load_fia_docs_with_filename(),
+            )
+            df_perf_merged, changed_rows = process_upgrades.update_perf_with_upgrades(
+                process_upgrades.load_perf_and_upgrades(), df_perf, df_upgrades_merged)
+            if changed_rows or not has_output:
+                process_upgrades.save_perf_and_upgrades(df_perf_merged)
+        state[stage] = key
+        save_state(state)
+        results[stage] = "ran"
+
+    stage = "form"
+    key = params_fingerprint(state.get("upgrades"), form.FORM_WINDOW, form.FORM_EWMA_ALPHA)
+    if not force and state.get(stage) == key and os.path.exists(OUTPUT_FILE_FORM):
+        logging.info(f"Skipping stage '{stage}': inputs unchanged")
+        results[stage] = "skipped"
+    else:
+        logging.info(f"Running stage '{stage}'")
+        if df_perf_merged is None:
+            df_perf_merged = process_upgrades.load_perf_and_upgrades()
+        with instrumentation.stage(stage, rows=len(df_perf_merged)):
+            # Only the races not yet in the saved form state are applied
+            form.refresh(df_perf_merged)
+        state[stage] = key
+        save_state(state)
+        results[stage] = "ran"
+
+    stage = "correlation"
+    key = params_fingerprint(state.get("upgrades"), upgrade_correlation.RESAMPLES, upgrade_correlation.SEED,
+                             upgrade_correlation.CONFIDENCE)
+    if not force and state.get(stage) == key and os.path.exists(OUTPUT_FILE_UPGRADE_CORRELATION):
+        logging.info(f"Skipping stage '{stage}': inputs unchanged")
+        results[stage] = "skipped"
+    else:
+        logging.info(f"Running stage '{stage}'")
+        if df_perf_merged is None:
+            df_perf_merged = process_upgrades.load_perf_and_upgrades()
+        with instrumentation.stage(stage, rows=len(df_perf_merged)):
+            df_correlation = upgrade_correlation.analyze_upgrades(df_perf_merged)
+            df_correlation.to_csv(OUTPUT_FILE_UPGRADE_CORRELATION, index=False)
+        state[stage] = key
+        save_state(state)
+        results[stage] = "ran"
+
+    state["last_run"] = {"finished_at": time.time(), "seasons": season_years, "results": results}
+    save_state(state)
+    store.close()
+    return results
+
+def main():
+    results = run()
+    logging.info(f"Pipeline finished: {results}")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,141 @@
+"""
+Single-pass processing of OpenF1 /position entries.  scan_positions() keeps only the earliest and latest
+entry per driver while iterating, so grid and finishing positions are found in O(n) time and constant
+memory per driver, and can optionally collect the whole position-over-time series as compact arrays for
+the position change helpers below.
+"""
+
+from array import array
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from lap_store import INT_MISSING
+
+
+def _parse_date(value) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+def scan_positions(entries, keep_series: bool = False):
+    """
+    Returns (df_positions, series) from an iterable of /position entries, consumed in a single pass.
+    df_positions is indexed by driver_number with 'grid_position' (earliest entry) and
+    'final_position' (latest entry), matching query_race_stats.summarize_positions.
+    If keep_series is True, series is a dict of 'date' (datetime64[ms]), 'driver_number' (int16) and
+    'position' (int8) arrays holding every entry in input order; otherwise it is None.
+    """
+    first = {}
+    last = {}
+    dates, drivers, positions = array("q"), array("h"), array("b")
+    for entry in entries:
+        driver_number = entry.get("driver_number")
+        date = _parse_date(entry.get("date"))
+        if driver_number is None or date is None:
+            continue
+        position = entry.get("position")
+        # Strict comparison keeps the first of tied earliest entries, >= keeps the last of tied latest entries
+        if driver_number not in first or date < first[driver_number][0]:
+            first[driver_number] = (date, position)
+        if driver_number not in last or date >= last[driver_number][0]:
+            last[driver_number] = (date, position)
+        if keep_series:
+            dates.append(int(date.timestamp() * 1000))
+            drivers.append(driver_number)
+            positions.append(position if position is not None else INT_MISSING)
+
+    driver_numbers = sorted(first.keys())
+    df_positions = pd.DataFrame({
+        "grid_position": [first[d][1] for d in driver_numbers],
+        "final_position": [last[d][1] for d in driver_numbers],
+    }, index=pd.Index(driver_numbers, name="driver_number"))
+
+    series = None
+    if keep_series:
+        series = {
+            "date": np.frombuffer(dates, dtype=np.int64).astype("datetime64[ms]"),
+            "driver_number": np.frombuffer(drivers, dtype=np.int16).copy(),
+            "position": np.frombuffer(positions, dtype=np.int8).copy(),
+        }
+    return df_positions, series
+
+
+def _sorted_by_driver(series: dict):
+    order = np.lexsort((series["date"], series["driver_number"]))
+    drivers = series["driver_number"][order].astype(np.int64)
+    dates = series["date"][order]
+    positions = series["position"][order].astype(np.int64)
+    same_driver = np.concatenate((drivers[1:] == drivers[:-1], [False]))
+    return drivers, dates, positions, same_driver
+
+
+def position_changes(series: dict) -> pd.DataFrame:
+    """
+    Returns a DataFrame indexed by driver_number with the total places gained and lost over a
+    position series from scan_positions, counting every change between consecutive entries.
+    """
+    drivers, _, positions, same_driver = _sorted_by_driver(series)
+    change = np.where(same_driver, positions - np.roll(positions, -1), 0)
+    df = pd.DataFrame({
+        "driver_number": drivers,
+        "places_gained": np.clip(change, 0, None),
+        "places_lost": np.clip(-change, 0, None),
+    })
+    return df.groupby("driver_number").sum()
+
+
+def time_in_position(series: dict, end_date=None) -> pd.DataFrame:
+    """
+    Returns a DataFrame with the seconds each driver spent in each position, from each entry until
+    the driver's next entry.  A driver's last entry lasts until end_date, which defaults to the
+    latest date in the series.
+    """
+    drivers, dates, positions, same_driver = _sorted_by_driver(series)
+    if len(dates) == 0:
+        return pd.DataFrame(columns=["driver_number", "position", "seconds"])
+    end_date = np.datetime64(end_date, "ms") if end_date is not None else dates.max()
+    next_dates = np.where(same_driver, np.roll(dates, -1), end_date)
+    seconds = (next_dates - dates).astype("timedelta64[ms]").astype(np.int64) / 1000.0
+    df = pd.DataFrame({"driver_number": drivers, "position": positions, "seconds": seconds})
+    return df.groupby(["driver_number", "position"], as_index=False)["seconds"].sum()
+
+
+def position_changes_per_lap(series: dict, laps: dict) -> pd.DataFrame:
+    """
+    Returns places gained and lost per (driver_number, lap_number), assigning each position change to
+    the lap in progress when it happened.  laps is a dict of 'driver_number', 'lap_number' and
+    'date_start' arrays, as returned by lap_store.read_session_laps.  Changes before a driver's first
+    recorded lap start are assigned to lap 0.
+    """
+    drivers, dates, positions, same_driver = _sorted_by_driver(series)
+    change = np.where(same_driver, positions - np.roll(positions, -1), 0)
+    change_dates = np.roll(dates, -1)
+
+    # Encode (driver, time) as one sortable integer so a single searchsorted finds each change's lap
+    scale = np.int64(10 ** 14)
+    lap_drivers = np.asarray(laps["driver_number"], dtype=np.int64)
+    lap_starts = np.asarray(laps["date_start"], dtype="datetime64[ms]")
+    valid = ~np.isnat(lap_starts)
+    lap_keys = lap_drivers[valid] * scale + lap_starts[valid].astype(np.int64)
+    lap_order = np.argsort(lap_keys)
+    lap_keys = lap_keys[lap_order]
+    lap_numbers = np.asarray(laps["lap_number"], dtype=np.int64)[valid][lap_order]
+    lap_owner = lap_drivers[valid][lap_order]
+
+    moved = same_driver & (change != 0)
+    lap_of_change = np.zeros(int(moved.sum()), dtype=np.int64)
+    if len(lap_keys):
+        change_keys = drivers[moved] * scale + change_dates[moved].astype(np.int64)
+        idx = np.searchsorted(lap_keys, change_keys, side="right") - 1
+        safe_idx = np.clip(idx, 0, None)
+        in_lap = (idx >= 0) & (lap_owner[safe_idx] == drivers[moved])
+        lap_of_change = np.where(in_lap, lap_numbers[safe_idx], 0)
+
+    df = pd.DataFrame({
+        "driver_number": drivers[moved],
+        "lap_number": lap_of_change,
+        "places_gained": np.clip(change[moved], 0, None),
+        "places_lost": np.clip(-change[moved], 0, None),
+    })
+    return df.groupby(["driver_number", "lap_number"], as_index=False).sum()
@@ -12,8 +12,12 @@ from common import (
     CACHE_FILE_FIA_DOCS,
     CACHE_FILE_DRIVER_PERF,
     setup_logging,
-    OUTPUT_FILE_PERF_AND_UPGRADES
+    OUTPUT_FILE_PERF_AND_UPGRADES,
+    OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET,
 )
+from schema import apply_schema, read_csv_typed
+from xlsx_cache import read_excel_cached
+import instrumentation
 
 TEAM_NAME_MAPPING = {
     "Aston Martin Aramco F1 Team": "Aston Martin",
@@ -27,6 +31,9 @@ TEAM_NAME_MAPPING = {
     "Visa Cash App Racing Bulls": "Racing Bulls"
 }
 
+UPGRADE_JOIN_KEYS = ["season_year", "race_number", "team_name_mapped"]
+PERF_ROW_KEYS = ["session_key", "driver_number"]
+
 def load_fia_docs_with_filename():
     """
     Loads the FIA docs dataframe from CACHE_FILE_FIA_DOCS (CSV), adds a 'Filename' column
@@ -43,10 +50,10 @@ def load_fia_docs_with_filename():
     logging.info(f"DataFrame shape after adding 'Filename': {df.shape}")
     return df
 
-def load_and_map_upgrades():
-    df = pd.read_excel(DATA_FILE_UPGRADES)
+def load_and_map_upgrades(path: str = DATA_FILE_UPGRADES):
+    df = read_excel_cached(path)
     df["team_name_mapped"] = df["Team Name"].map(TEAM_NAME_MAPPING).fillna(df["Team Name"])
-    logging.info(f"Loaded file: {DATA_FILE_UPGRADES}")
+    logging.info(f"Loaded file: {path}")
     logging.info(f"DataFrame shape: {df.shape}")
     return df
 
@@ -57,34 +64,133 @@ def group_upgrades(df):
     ).reset_index()
     return grouped
 
-def main():
-    setup_logging()
-    df_upgrades = load_and_map_upgrades()
+def set_unique_index(df: pd.DataFrame, keys, drop: bool = True) -> pd.DataFrame:
+    """
+    Returns df.set_index(keys, drop=drop), raising ValueError naming the duplicate keys if the index is
+    not unique, as set_index(verify_integrity=True) did before pandas deprecated it.
+    """
+    df_indexed = df.set_index(keys, drop=drop)
+    if not df_indexed.index.is_unique:
+        duplicates = df_indexed.index[df_indexed.index.duplicated()].unique()
+        raise ValueError(f"Index has duplicate keys: {list(duplicates)}")
+    return df_indexed
+
+
+def index_fia_docs(df_fia_docs: pd.DataFrame) -> pd.DataFrame:
+    """Returns the FIA docs indexed on Filename, raising an exception if any Filename appears twice."""
+    return set_unique_index(df_fia_docs.dropna(subset=["Filename"]), "Filename")
+
+
+def index_upgrades(df_upgrades_merged: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the grouped upgrades indexed on UPGRADE_JOIN_KEYS, raising an exception if any team has
+    more than one row for a race.  Upgrades from documents missing from the FIA docs cache have no
+    season or race, so can never join to a driver and are left out.
+    """
+    unmatched = df_upgrades_merged[UPGRADE_JOIN_KEYS].isna().any(axis=1)
+    if unmatched.any():
+        logging.warning(f"Ignoring {unmatched.sum()} upgrade rows from documents missing from {CACHE_FILE_FIA_DOCS}")
+    return set_unique_index(df_upgrades_merged[~unmatched], UPGRADE_JOIN_KEYS)
+
+
+def merge_upgrades_with_fia_docs(df_upgrades: pd.DataFrame, df_fia_docs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Groups the raw upgrade rows from load_and_map_upgrades and adds the season and race number of each
+    FIA document, raising an exception if a document could match more than one upgrade row.
+    """
     df_upgrades = group_upgrades(df_upgrades)
     logging.info(f"Grouped DataFrame shape: {df_upgrades.shape}")
 
-    df_fia_docs = load_fia_docs_with_filename()
-
-    df_upgrades_merged = pd.merge(df_upgrades, df_fia_docs, on="Filename", how="left")
-    if len(df_upgrades_merged) != len(df_upgrades):
-        raise Exception(f"Row count changed after merge: {len(df_upgrades)} -> {len(df_upgrades_merged)}")
+    df_upgrades_merged = df_upgrades.join(index_fia_docs(df_fia_docs), on="Filename", validate="many_to_one")
     logging.info(f"Merged DataFrame shape: {df_upgrades_merged.shape}")
+    return df_upgrades_merged
 
-    df_perf = pd.read_csv(CACHE_FILE_DRIVER_PERF)
 
-    # Merge df_perf (left) with df_upgrades_merged (right) on season, race_number, team_name_mapped
-    df_perf_merged = df_perf.merge(
-        df_upgrades_merged,
-        on=["season_year", "race_number", "team_name_mapped"],
-        how="left"
-    )
+def merge_perf_with_upgrades(df_perf: pd.DataFrame, df_upgrades_merged: pd.DataFrame) -> pd.DataFrame:
+    """
+    Left-joins the driver performance with the upgrades on UPGRADE_JOIN_KEYS, raising an exception if
+    a driver's race could match more than one upgrade row.
+    """
+    df_perf_merged = df_perf.join(index_upgrades(df_upgrades_merged), on=UPGRADE_JOIN_KEYS, validate="many_to_one")
     logging.info(f"Final merged DataFrame shape: {df_perf_merged.shape}")
-    if len(df_perf_merged) != len(df_perf):
-        raise Exception(f"Row count changed after merge: {len(df_perf)} -> {len(df_perf_merged)}")
+    return df_perf_merged
+
+
+def _rows_equal(df_a: pd.DataFrame, df_b: pd.DataFrame):
+    """Returns a boolean array that is True where two aligned DataFrames have equal rows, treating missing values as equal."""
+    df_b = df_b[df_a.columns]
+    equal = df_a.astype(object).eq(df_b.astype(object)) | (df_a.isna() & df_b.isna())
+    return equal.all(axis=1).to_numpy()
+
+
+def update_perf_with_upgrades(df_prev: pd.DataFrame, df_perf: pd.DataFrame, df_upgrades_merged: pd.DataFrame):
+    """
+    Returns (df_perf_merged, changed_rows): the same result as merge_perf_with_upgrades, computed by
+    upserting into df_prev, a previous result, only the rows that changed.  A row is re-joined if it is
+    new in df_perf or its performance values changed, or if the upgrades for its team and race were
+    added, changed or removed.  Rows no longer in df_perf are dropped.  Falls back to a full join when
+    there is no previous result or its columns differ.
+    """
+    upgrades = index_upgrades(df_upgrades_merged)
+    columns = list(df_perf.columns) + list(upgrades.columns)
+    if df_prev is None or list(df_prev.columns) != columns:
+        df_perf_merged = merge_perf_with_upgrades(df_perf, df_upgrades_merged)
+        return df_perf_merged, len(df_perf_merged)
+
+    perf = set_unique_index(df_perf, PERF_ROW_KEYS, drop=False)
+    prev = set_unique_index(df_prev, PERF_ROW_KEYS, drop=False)
+
+    # Rows that are new or whose performance values changed
+    common = perf.index.intersection(prev.index, sort=False)
+    changed_perf = perf.index.difference(prev.index, sort=False).append(
+        common[~_rows_equal(perf.loc[common], prev.loc[common, list(perf.columns)])])
+    # Team races whose upgrades differ from the ones previously joined
+    prev_upgrades = prev[columns].drop_duplicates(UPGRADE_JOIN_KEYS).set_index(UPGRADE_JOIN_KEYS)[list(upgrades.columns)]
+    changed_keys = prev_upgrades.index[~_rows_equal(upgrades.reindex(prev_upgrades.index), prev_upgrades)]
+
+    stale = perf.index.isin(changed_perf) | pd.MultiIndex.from_frame(perf[UPGRADE_JOIN_KEYS]).isin(changed_keys)
+    removed = len(prev.index.difference(perf.index))
+    df_fresh = perf[stale].join(upgrades, on=UPGRADE_JOIN_KEYS, validate="many_to_one")
+    df_perf_merged = pd.concat([prev.loc[perf.index[~stale], columns], df_fresh]).reindex(perf.index).set_axis(df_perf.index)
+    logging.info(f"Upserted {stale.sum()} and removed {removed} of {len(df_perf_merged)} performance and upgrade rows")
+    return df_perf_merged, int(stale.sum()) + removed
+
+
+def load_perf_and_upgrades() -> pd.DataFrame:
+    """Returns the previous output from OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET, or None if there is none."""
+    if not os.path.exists(OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET):
+        return None
+    return apply_schema(pd.read_parquet(OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET))
+
+
+def save_perf_and_upgrades(df_perf_merged: pd.DataFrame, excel: bool = True, parquet: bool = True):
+    """
+    Writes the output to OUTPUT_FILE_PERF_AND_UPGRADES (Excel) and/or OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET,
+    which loads far faster in Tableau and notebooks.
+    """
+    if parquet:
+        # circuit_specific_any is True/False for races with upgrades and missing otherwise
+        apply_schema(df_perf_merged).astype({"circuit_specific_any": "boolean"}).to_parquet(OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET, index=False)
+        logging.info(f"Output written to {OUTPUT_FILE_PERF_AND_UPGRADES_PARQUET}")
+    if excel:
+        df_perf_merged.to_excel(OUTPUT_FILE_PERF_AND_UPGRADES, index=False)
+        logging.info(f"Output written to {OUTPUT_FILE_PERF_AND_UPGRADES}")
+
+
+def main():
+    setup_logging()
+    with instrumentation.stage("upgrades") as stage:
+        df_upgrades = load_and_map_upgrades()
+        df_fia_docs = load_fia_docs_with_filename()
+        df_upgrades_merged = merge_upgrades_with_fia_docs(df_upgrades, df_fia_docs)
 
-    # Write ouput to OUTPUT_FILE_PERF_AND_UPGRADES
-    df_perf_merged.to_excel(OUTPUT_FILE_PERF_AND_UPGRADES, index=False)
-    logging.info(f"Output written to {OUTPUT_FILE_PERF_AND_UPGRADES}")
+        df_perf = read_csv_typed(CACHE_FILE_DRIVER_PERF)
+        df_perf_merged, changed_rows = update_perf_with_upgrades(load_perf_and_upgrades(), df_perf, df_upgrades_merged)
+        if changed_rows or not os.path.exists(OUTPUT_FILE_PERF_AND_UPGRADES):
+            save_perf_and_upgrades(df_perf_merged)
+        else:
+            logging.info("Performance and upgrades unchanged; output not rewritten")
+        stage.rows = len(df_perf_merged)
 
 
 if __name__ == "__main__":
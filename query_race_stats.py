@@ -6,75 +6,51 @@ of a web endpoint that did not exist.  Coercing fixes into this method became mo
 I re-prompted from scratch a couple of times.
 """
 
-import requests
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import logging
-from time import sleep
-import os
-from common import setup_logging, CACHE_FILE_DRIVER_STATS
+import instrumentation
+from common import setup_logging, CACHE_FILE_DRIVER_STATS, INGEST_SEASON_WORKERS, OPENF1_BASE_URL
+from openf1_client import get_client
+from stats_store import DriverStatsStore
+from lap_store import write_session_laps
+from lap_analytics import session_lap_pace, PACE_COLUMNS
+from position_stream import scan_positions
 
 
-BASE_URL = "https://api.openf1.org/v1"
+BASE_URL = OPENF1_BASE_URL
 
-def get_races(start_year=2020):
+def get_races(start_year=2020, client=None):
     """
     Fetch all race sessions (session_type 'Race') from start_year to current year.
     Uses the /sessions endpoint, as /races does not exist in the OpenF1 API.
+    Years are fetched concurrently through the shared rate-limited client.
     """
+    client = client or get_client()
     current_year = datetime.now().year
+    calls = [("sessions", {"year": year, "session_type": "Race"}) for year in range(start_year, current_year + 1)]
     races = []
-    for year in range(start_year, current_year + 1):
-        url = f"{BASE_URL}/sessions"
-        params = {"year": year, "session_type": "Race"}
-        logging.info(f"API call: {url} | params: {params}")
-        sleep(1)  # To avoid hitting API rate limits
-        resp = requests.get(url, params=params)
-        resp.raise_for_status()
-        data = resp.json()
-        logging.info(f"Entries returned: {len(data)}")
+    for data in client.fetch_many(calls):
         races.extend(data)
     return races
 
-def get_drivers_for_race(session_key):
+def get_drivers_for_race(session_key, client=None):
     """Fetch all drivers for a given race session."""
-    url = f"{BASE_URL}/drivers"
-    params = {"session_key": session_key}
-    logging.info(f"API call: {url} | params: {params}")
-    sleep(1)  # To avoid hitting API rate limits
-    resp = requests.get(url, params=params)
-    resp.raise_for_status()
-    data = resp.json()
-    logging.info(f"Entries returned: {len(data)}")
-    return data
-
-def get_laps_for_race(session_key, driver_number):
+    client = client or get_client()
+    return client.get_json("drivers", {"session_key": session_key})
+
+def get_laps_for_race(session_key, driver_number, client=None):
     """Fetch all laps for a given driver in a race session."""
-    url = f"{BASE_URL}/laps"
-    params = {"session_key": session_key, "driver_number": driver_number}
-    logging.info(f"API call: {url} | params: {params}")
-    sleep(1)
-    resp = requests.get(url, params=params)
-    resp.raise_for_status()
-    data = resp.json()
-    logging.info(f"Entries returned: {len(data)}")
-    return data
-
-def get_grid_and_finish_positions(session_key, driver_number):
-    """
-    Fetch grid and finish positions for a driver in a race session.
-    Uses the /position endpoint. The entry with the earliest 'date' is the grid position,
-    and the entry with the latest 'date' is the finishing position.
-    """
-    url = f"{BASE_URL}/position"
-    params = {"session_key": session_key, "driver_number": driver_number}
-    logging.info(f"API call: {url} | params: {params}")
-    sleep(1)
-    resp = requests.get(url, params=params)
-    resp.raise_for_status()
-    data = resp.json()
-    logging.info(f"Entries returned: {len(data)}")
+    client = client or get_client()
+    return client.get_json("laps", {"session_key": session_key, "driver_number": driver_number})
 
+def grid_and_finish_from_positions(data):
+    """
+    Returns (grid_position, final_position) from a list of /position entries for one driver.
+    The entry with the earliest 'date' is the grid position, and the entry with the latest 'date'
+    is the finishing position.
+    """
     if not data:
         return None, None
 
@@ -85,18 +61,97 @@ def get_grid_and_finish_positions(session_key, driver_number):
 
     return grid_position, final_position
 
-def main():
-    cache_file = CACHE_FILE_DRIVER_STATS
-    # Try to load cached DataFrame
-    if os.path.exists(cache_file):
-        df = pd.read_csv(cache_file)
-        logging.info(f"Loaded cache with {len(df)} rows.")
-    else:
-        df = pd.DataFrame()
-        logging.info("No cache found, starting with empty DataFrame.")
+def get_grid_and_finish_positions(session_key, driver_number, client=None):
+    """
+    Fetch grid and finish positions for a driver in a race session.
+    Uses the /position endpoint, see grid_and_finish_from_positions.
+    """
+    client = client or get_client()
+    data = client.get_json("position", {"session_key": session_key, "driver_number": driver_number})
+    return grid_and_finish_from_positions(data)
+
+def get_laps_for_session(session_key, client=None):
+    """Fetch all laps for every driver in a race session with a single /laps call."""
+    client = client or get_client()
+    return client.get_json("laps", {"session_key": session_key})
+
+def summarize_laps(laps) -> pd.DataFrame:
+    """
+    Returns a DataFrame indexed by driver_number with 'best_lap_time' and 'avg_lap_time' for every
+    driver in a list of /laps entries for one session.  Laps without a lap_duration are ignored.
+    """
+    df_laps = pd.DataFrame(laps, columns=["driver_number", "lap_duration"])
+    return df_laps.groupby("driver_number")["lap_duration"].agg(best_lap_time="min", avg_lap_time="mean")
+
+def summarize_positions(positions) -> pd.DataFrame:
+    """
+    Returns a DataFrame indexed by driver_number with 'grid_position' and 'final_position' for every
+    driver in a list of /position entries for one session.  As in grid_and_finish_from_positions, the
+    earliest entry per driver is the grid position and the latest is the finishing position.
+    """
+    df_positions = pd.DataFrame(positions, columns=["driver_number", "date", "position"])
+    df_positions = df_positions.dropna(subset=["driver_number", "date"]).reset_index(drop=True)
+    dates = pd.to_datetime(df_positions["date"], utc=True, format="ISO8601")
+    drivers = df_positions["driver_number"]
+    first_idx = dates.groupby(drivers).idxmin()
+    # Reverse before idxmax so ties on the latest date resolve to the last entry, matching a stable sort
+    last_idx = dates[::-1].groupby(drivers[::-1]).idxmax().reindex(first_idx.index)
+    return pd.DataFrame({
+        "grid_position": df_positions["position"].loc[first_idx].to_numpy(),
+        "final_position": df_positions["position"].loc[last_idx].to_numpy(),
+    }, index=first_idx.index)
+
+def summarize_session(session_key, laps, df_positions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns a DataFrame indexed by driver_number combining summarize_laps, the grid/finish positions
+    in df_positions (see summarize_positions) and the lap pace columns from lap_analytics.
+    """
+    df = summarize_laps(laps).join(df_positions, how="outer")
+    df = df.join(session_lap_pace(session_key, laps), how="left")
+    # Keep positions as integers even when a driver is missing from one of the endpoints
+    return df.astype({"grid_position": "Int64", "final_position": "Int64"})
+
+def get_session_driver_stats(session_key, client=None, season_year=None) -> pd.DataFrame:
+    """
+    Fetches /laps and /position once for the whole session and returns a DataFrame indexed by
+    driver_number with best/avg lap time and grid/finish positions for every driver.
+    The /position response is streamed through scan_positions while /laps is fetched alongside it.
+    If season_year is given, the raw laps are also written to the lap store.
+    """
+    client = client or get_client()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        laps_future = executor.submit(get_laps_for_session, session_key, client)
+        df_positions, _ = scan_positions(client.stream_json("position", {"session_key": session_key}))
+        laps = laps_future.result()
+    if season_year is not None:
+        write_session_laps(season_year, session_key, laps)
+    return summarize_session(session_key, laps, df_positions)
+
+def get_per_driver_stats(session_key, driver_numbers, client=None) -> pd.DataFrame:
+    """
+    Fetches /laps and /position separately for each driver, returning the same DataFrame as
+    get_session_driver_stats.  Only needed if the bulk session-level calls are unavailable.
+    """
+    client = client or get_client()
+    calls = []
+    for driver_number in driver_numbers:
+        params = {"session_key": session_key, "driver_number": driver_number}
+        calls.append(("laps", params))
+        calls.append(("position", params))
+    responses = client.fetch_many(calls)
+    laps = [lap for data in responses[0::2] for lap in data]
+    positions = [position for data in responses[1::2] for position in data]
+    return summarize_session(session_key, laps, summarize_positions(positions))
 
-    races = get_races(start_year=2023)
+def _value_or_none(stats: dict, column):
+    value = stats.get(column)
+    return None if pd.isna(value) else value
 
+def latest_race_per_country(races) -> dict:
+    """
+    Returns {year: races} from a list of /sessions entries, keeping only the most recent race per
+    country per year, with each year's races sorted by date.
+    """
     # Group races by year and country, keep only the most recent race per country per year
     races_by_year_country = {}
     for race in races:
@@ -117,79 +172,132 @@ def main():
         races_by_year.setdefault(year, []).append(race)
     for year in races_by_year:
         races_by_year[year] = sorted(races_by_year[year], key=lambda r: r.get("date_start"))
+    return races_by_year
+
+def ingest_season(year, year_races, store: DriverStatsStore, cached_keys: set, client, bulk=True) -> int:
+    """
+    Fetches and stores the stats of every driver in year_races (one season, in race order) that is not
+    in cached_keys, committing each race to the season's shard as one transaction.  Seasons are
+    independent of each other, so several can be ingested at once.  Returns the number of rows added.
+    """
+    new_rows = 0
+    race_number = 0  # Increment on first usage
+    for race in year_races:
+        session_key = race.get("session_key")
+        country = race.get("country_name")
+        location = race.get("location")
+        date = race.get("date_start")
+        race_number = race_number + 1
+
+        drivers = get_drivers_for_race(session_key, client=client)
+
+        new_drivers = []
+        for driver in drivers:
+            driver_number = driver.get("driver_number")
+            if (session_key, driver_number) in cached_keys:
+                logging.info(f"Skipping cached driver {driver_number} for session {session_key}")
+            else:
+                new_drivers.append(driver)
+
+        if not new_drivers:
+            continue
+
+        # Fetch laps and positions once for the whole session, rather than once per driver
+        with instrumentation.stage("fetch_session", rows=len(new_drivers)):
+            if bulk:
+                df_session = get_session_driver_stats(session_key, client=client, season_year=year)
+            else:
+                df_session = get_per_driver_stats(session_key, [d.get("driver_number") for d in new_drivers], client=client)
+        session_stats = df_session.to_dict("index")
+
+        rows = []
+        for driver in new_drivers:
+            driver_number = driver.get("driver_number")
+            cache_key = (session_key, driver_number)
+
+            driver_name = driver.get("full_name")
+            broadcast_name = driver.get("broadcast_name")
+            team_name = driver.get("team_name")
+            country_code = driver.get("country_code")
+
+            # Lap times, grid and finish positions
+            stats = session_stats.get(driver_number, {})
+            best_lap_time = _value_or_none(stats, "best_lap_time")
+            avg_lap_time = _value_or_none(stats, "avg_lap_time")
+            grid_position = _value_or_none(stats, "grid_position")
+            final_position = _value_or_none(stats, "final_position")
+            if grid_position is not None and final_position is not None:
+                position_change = (grid_position - final_position)
+            else:
+                position_change = None
+
+            row = {
+                "season_year": year,
+                "race_number": race_number,
+                "session_key": session_key,
+                "race_location": location,
+                "country": country,
+                "date": date,
+                "driver_number": driver_number,
+                "driver_name": driver_name,
+                "broadcast_name": broadcast_name,
+                "team_name": team_name,
+                "country_code": country_code,
+                "best_lap_time": best_lap_time,
+                "avg_lap_time": avg_lap_time,
+                "position_change": position_change,
+                "grid_position": grid_position,
+                "final_position": final_position
+            }
+            for col in PACE_COLUMNS:
+                row[col] = _value_or_none(stats, col)
+
+            rows.append(row)
+            cached_keys.add(cache_key)
+
+        store.upsert(rows)
+        new_rows += len(rows)
+        logging.info(f"Added and stored {len(rows)} drivers for session {session_key}")
+    return new_rows
+
+@instrumentation.timed("ingest")
+def main(bulk=True, offline=False, season_years=None, max_workers=INGEST_SEASON_WORKERS):
+    """
+    Fetches stats for every race since 2023 (or only in season_years) that are not already in the
+    driver stats store, then exports the store to CACHE_FILE_DRIVER_STATS.  Seasons are ingested in
+    parallel, up to max_workers at a time, each into its own shard of the store; every request still
+    goes through the shared rate-limited client.  Each race is committed as one transaction, so an
+    interrupted run resumes from the last completed race of every season.
+    With offline=True, only responses already in the on-disk response cache are used.
+    """
+    client = get_client(offline=offline)
+    store = DriverStatsStore()
+    # For quick lookup of rows that are already stored
+    cached_keys = store.cached_keys(season_years=season_years)
+    logging.info(f"Loaded store with {len(cached_keys)} rows.")
+
+    start_year = min(season_years) if season_years else 2023
+    races_by_year = latest_race_per_country(get_races(start_year=start_year, client=client))
+    if season_years is not None:
+        wanted = set(season_years)
+        races_by_year = {year: races for year, races in races_by_year.items() if year in wanted}
 
-    # For quick lookup if cache exists
-    cached_keys = set()
-    if not df.empty:
-        cached_keys = set(zip(df["session_key"], df["driver_number"]))
-
-    for year, year_races in races_by_year.items():
-        # Find the lowest session_key for this year
-        session_keys = [race.get("session_key") for race in year_races]
-
-        race_number = 0  # Increment on first usage
-        for race in year_races:
-            session_key = race.get("session_key")
-            country = race.get("country_name")
-            location = race.get("location")
-            date = race.get("date_start")
-            race_number = race_number + 1
-
-            drivers = get_drivers_for_race(session_key)
-
-            for driver in drivers:
-                driver_number = driver.get("driver_number")
-                cache_key = (session_key, driver_number)
-                if cache_key in cached_keys:
-                    logging.info(f"Skipping cached driver {driver_number} for session {session_key}")
-                    continue
-
-                driver_name = driver.get("full_name")
-                broadcast_name = driver.get("broadcast_name")
-                team_name = driver.get("team_name")
-                country_code = driver.get("country_code")
-
-                # Lap times
-                laps = get_laps_for_race(session_key, driver_number)
-                lap_times = [lap.get("lap_duration") for lap in laps if lap.get("lap_duration") is not None]
-                best_lap_time = min(lap_times) if lap_times else None
-                avg_lap_time = sum(lap_times) / len(lap_times) if lap_times else None
-
-                # Grid and finish positions
-                grid_position, final_position = get_grid_and_finish_positions(session_key, driver_number)
-                if grid_position is not None and final_position is not None:
-                    position_change = (grid_position - final_position)
-                else:
-                    position_change = None
-
-                row = {
-                    "season_year": year,
-                    "race_number": race_number,
-                    "session_key": session_key,
-                    "race_location": location,
-                    "country": country,
-                    "date": date,
-                    "driver_number": driver_number,
-                    "driver_name": driver_name,
-                    "broadcast_name": broadcast_name,
-                    "team_name": team_name,
-                    "country_code": country_code,
-                    "best_lap_time": best_lap_time,
-                    "avg_lap_time": avg_lap_time,
-                    "position_change": position_change,
-                    "grid_position": grid_position,
-                    "final_position": final_position
-                }
-
-                # Append new row and update cache
-                df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
-                df.to_csv(cache_file, index=False)
-                cached_keys.add(cache_key)
-                logging.info(f"Added and cached driver {driver_number} for session {session_key}")
-
-    logging.info(df.head())
-    logging.info(f"Final cache file had {len(df)} rows.")
+    new_rows = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(ingest_season, year, year_races, store, cached_keys, client, bulk): year
+            for year, year_races in races_by_year.items()
+        }
+        for future in as_completed(futures):
+            rows = future.result()
+            new_rows += rows
+            logging.info(f"Finished season {futures[future]}: {rows} new rows")
 
+    store.export_csv(CACHE_FILE_DRIVER_STATS, season_years=season_years)
+    scope = "" if season_years is None else f" in seasons {sorted(season_years)}"
+    logging.info(f"Final store had {len(store.cached_keys(season_years=season_years))} rows{scope}.")
+    store.close()
+    instrumentation.set_rows(new_rows)
 
 if __name__ == "__main__":
     setup_logging()
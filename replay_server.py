@@ -0,0 +1,202 @@
+"""
+Local stand-in for the OpenF1 API that replays a recorded race as if it were live, to test live_race.py
+when no race is running.  The replay clock starts at the session's first record and runs `speed` times
+faster than real time.  /drivers, /laps and /position only return the records published by then, and a
+lap's duration only appears once the lap is complete.  Query filters follow the OpenF1 syntax
+(field=value, field>value, field>=value, field<value, field<=value).  Recordings are read from and written to
+CACHE_FOLDER_REPLAYS, and record_session() takes them from the response cache or the API once a race is over.
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote_plus, urlsplit
+
+from common import setup_logging, CACHE_FOLDER_REPLAYS
+from live_race import LIVE_POLL_INTERVAL, parse_date, run
+from openf1_client import OpenF1Client, get_client
+
+REPLAY_ENDPOINTS = ["drivers", "laps", "position"]
+FILTER_PATTERN = re.compile(r"^(\w+)(>=|<=|>|<|=)(.*)$")
+COMPARISONS = {
+    "=": lambda a, b: a == b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+}
+
+
+def recording_path(session_key, folder: str = CACHE_FOLDER_REPLAYS) -> str:
+    return os.path.join(folder, f"session_{int(session_key)}.json.gz")
+
+
+def record_session(session_key, path: str = None, client: OpenF1Client = None) -> str:
+    """Writes the /drivers, /laps and /position records of a finished session to a recording, and returns its path."""
+    client = client or get_client()
+    path = path or recording_path(session_key)
+    recording = {"session_key": int(session_key)}
+    for endpoint in REPLAY_ENDPOINTS:
+        recording[endpoint] = client.get_json(endpoint, {"session_key": int(session_key)})
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(recording, f)
+    logging.info(f"Recorded session {session_key} to {path}: {len(recording['laps'])} laps, {len(recording['position'])} positions")
+    return path
+
+
+def load_recording(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_filters(query: str) -> list:
+    """Returns (field, operator, value) for every filter in a URL query string."""
+    filters = []
+    for part in query.split("&"):
+        match = FILTER_PATTERN.match(unquote_plus(part))
+        if match:
+            filters.append(match.groups())
+    return filters
+
+
+def _matches(record: dict, filters: list) -> bool:
+    for field, operator, value in filters:
+        actual = record.get(field)
+        if actual is None:
+            return False
+        if field.startswith("date"):
+            actual, value = parse_date(actual), parse_date(value)
+        elif isinstance(actual, (int, float)) and not isinstance(actual, bool):
+            value = float(value)
+        if not COMPARISONS[operator](actual, value):
+            return False
+    return True
+
+
+class SessionReplay:
+    """Serves the records of a recording that have been published by the replay clock's current time."""
+
+    def __init__(self, recording: dict, speed: float = 1.0):
+        self.session_key = recording["session_key"]
+        self.speed = speed
+        self.drivers = recording["drivers"]
+        self.laps = sorted((lap for lap in recording["laps"] if lap.get("date_start")), key=lambda lap: parse_date(lap["date_start"]))
+        self.lap_starts = [parse_date(lap["date_start"]) for lap in self.laps]
+        self.lap_ends = [start + timedelta(seconds=lap.get("lap_duration") or 0) for start, lap in zip(self.lap_starts, self.laps)]
+        self.positions = sorted((entry for entry in recording["position"] if entry.get("date")), key=lambda entry: parse_date(entry["date"]))
+        self.position_dates = [parse_date(entry["date"]) for entry in self.positions]
+        self.start_date = min(self.lap_starts[:1] + self.position_dates[:1])
+        self.end_date = max(self.lap_ends + self.position_dates)
+        self.started_at = time.monotonic()
+
+    def now(self):
+        return self.start_date + timedelta(seconds=(time.monotonic() - self.started_at) * self.speed)
+
+    def finished(self) -> bool:
+        return self.now() >= self.end_date
+
+    def records(self, endpoint: str, filters: list) -> list:
+        """Returns the records of an endpoint published so far that match filters, or None for an unknown endpoint."""
+        now = self.now()
+        if endpoint == "drivers":
+            published = self.drivers
+        elif endpoint == "laps":
+            published = self.laps[:bisect.bisect_right(self.lap_starts, now)]
+            # A lap in progress has no duration yet
+            published = [lap if end <= now else {**lap, "lap_duration": None}
+                         for lap, end in zip(published, self.lap_ends)]
+        elif endpoint == "position":
+            published = self.positions[:bisect.bisect_right(self.position_dates, now)]
+        else:
+            return None
+        return [record for record in published if _matches(record, filters)]
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    replay = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        records = self.replay.records(url.path.rstrip("/").rsplit("/", 1)[-1], parse_filters(url.query))
+        if records is None:
+            self.send_error(404)
+            return
+        body = json.dumps(records).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Replay server: {format % args}")
+
+
+def start_server(replay: SessionReplay, port: int = 0) -> ThreadingHTTPServer:
+    """Serves replay on localhost from a background thread, on any free port by default; the base URL is at .base_url."""
+    handler = type("BoundReplayHandler", (ReplayHandler,), {"replay": replay})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def replay_live(recording: dict, speed: float = 10.0, interval: float = LIVE_POLL_INTERVAL, output_path: str = None):
+    """Replays a recording through a stand-in server and follows it with live_race.run until the replay ends."""
+    replay = SessionReplay(recording, speed)
+    server = start_server(replay)
+    logging.info(f"Replaying session {replay.session_key} at {speed}x from {server.base_url}")
+    try:
+        client = OpenF1Client(base_url=server.base_url, rate_limits=[], cache=None)
+        return run(replay.session_key, client, interval=interval, output_path=output_path, until=replay.finished)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main(session_key=None, speed: float = 10.0, record: bool = False, serve_port: int = None, synthetic: bool = False):
+    """
+    Records session_key, serves a recording on serve_port until interrupted, or else replays it and
+    follows it live.  With synthetic=True, a synthetic race is replayed instead of a recording.
+    """
+    if record:
+        record_session(session_key)
+        return
+    if synthetic:
+        from synthetic_data import generate_session_recording
+        recording = generate_session_recording()
+    else:
+        recording = load_recording(recording_path(session_key))
+    if serve_port is None:
+        replay_live(recording, speed)
+        return
+    server = start_server(SessionReplay(recording, speed), serve_port)
+    logging.info(f"Serving session {recording['session_key']} at {speed}x from {server.base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Replay a recorded race through a local stand-in for the OpenF1 API.")
+    parser.add_argument("session_key", type=int, nargs="?", help="session to record or replay")
+    parser.add_argument("--record", action="store_true", help="record a finished session instead of replaying it")
+    parser.add_argument("--synthetic", action="store_true", help="replay a synthetic race instead of a recording")
+    parser.add_argument("--speed", type=float, default=10.0, help="replay speed relative to real time")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="only serve the replay on PORT, for live_race.py --base-url")
+    args = parser.parse_args()
+    if args.session_key is None and not args.synthetic:
+        parser.error("a session_key is needed unless --synthetic is given")
+    main(args.session_key, args.speed, args.record, args.serve, args.synthetic)
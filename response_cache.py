@@ -0,0 +1,259 @@
+"""
+Persistent on-disk cache of OpenF1 API responses.  Each response is stored gzip-compressed under a file
+named by the SHA-256 of its endpoint and params, so any derived column can be re-computed from the raw
+responses without calling the API again.  Entries can be given a per-endpoint TTL, or a TTL of their own
+when stored, and the least recently used entries are evicted once the cache grows beyond its byte budget.
+Expired entries are kept until overwritten or evicted, so they can still be served when offline.
+"""
+
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import instrumentation
+from common import CACHE_FOLDER_OPENF1, OPENF1_CACHE_MAX_BYTES, OPENF1_CACHE_TTLS
+from json_stream import iter_json_array, READ_CHUNK_SIZE
+
+DATA_MARKER = '"data": '
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of decoded JSON responses, keyed on (endpoint, params).
+    File modification times double as last-access times for LRU eviction.
+    """
+
+    def __init__(self, folder: str = CACHE_FOLDER_OPENF1, max_bytes: int = OPENF1_CACHE_MAX_BYTES, ttls: dict = OPENF1_CACHE_TTLS):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(endpoint: str, params: dict = None) -> str:
+        """Returns the content address for an endpoint and its params, independent of param order."""
+        payload = json.dumps({"endpoint": endpoint.strip("/"), "params": params or {}}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], f"{key}.json.gz")
+
+    def ttl_for(self, endpoint: str, params: dict = None):
+        """
+        Returns the TTL in seconds for an endpoint, or None if its responses never expire.
+        Responses for a past season are final, so a TTL only applies when the params are not
+        restricted to an earlier year.
+        """
+        ttl = self.ttls.get(endpoint.strip("/"))
+        if ttl is None:
+            return None
+        year = (params or {}).get("year")
+        if year is not None and int(year) < datetime.now().year:
+            return None
+        return ttl
+
+    def _expired(self, entry: dict, endpoint: str, params: dict, allow_stale: bool) -> bool:
+        # A TTL stored with the entry takes precedence over the endpoint's
+        ttl = entry.get("ttl", self.ttl_for(endpoint, params))
+        if ttl is None or time.time() - entry["fetched_at"] <= ttl:
+            return False
+        if allow_stale:
+            logging.info(f"Serving expired cache entry for {endpoint} | params: {params}")
+            return False
+        return True
+
+    def get(self, endpoint: str, params: dict = None, allow_stale: bool = False):
+        """Returns the cached response data, or None if it is missing or has expired (unless allow_stale)."""
+        path = self.path(self.key(endpoint, params))
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+        except (OSError, EOFError, ValueError) as e:
+            logging.warning(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            self._count(hit=False)
+            return None
+
+        if self._expired(entry, endpoint, params, allow_stale):
+            self._count(hit=False)
+            return None
+
+        # Touch the entry so that eviction treats it as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self._count(hit=True)
+        return entry["data"]
+
+    def iter_data(self, endpoint: str, params: dict = None, allow_stale: bool = False):
+        """
+        Returns an iterator over the elements of a cached JSON array response, parsed incrementally
+        from the compressed file, or None if the entry is missing or has expired (unless allow_stale).
+        """
+        path = self.path(self.key(endpoint, params))
+        try:
+            f = gzip.open(path, "rt", encoding="utf-8")
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+        try:
+            # Entries are written with 'data' as the last key, so the header can be read on its own
+            prefix = ""
+            while DATA_MARKER not in prefix:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    raise ValueError("no data in cache entry")
+                prefix += chunk
+            header, rest = prefix.split(DATA_MARKER, 1)
+            entry = json.loads(header.rstrip().rstrip(",") + "}")
+        except (OSError, EOFError, ValueError) as e:
+            f.close()
+            logging.warning(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            self._count(hit=False)
+            return None
+
+        if self._expired(entry, endpoint, params, allow_stale):
+            f.close()
+            self._count(hit=False)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self._count(hit=True)
+
+        def elements():
+            with f:
+                yield from iter_json_array(itertools.chain([rest], iter(lambda: f.read(READ_CHUNK_SIZE), "")))
+        return elements()
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        instrumentation.record_cache("openf1_responses", hit)
+
+    def _tmp_path(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def put(self, endpoint: str, params: dict, data, ttl: float = None):
+        """
+        Stores response data, expiring after ttl seconds if given and otherwise after the endpoint's TTL,
+        then evicts least recently used entries if over the byte budget.
+        """
+        path = self.path(self.key(endpoint, params))
+        entry = {"endpoint": endpoint, "params": params or {}, "fetched_at": time.time(), "data": data}
+        if ttl is not None:
+            entry = {"ttl": ttl, **entry}
+        tmp_path = self._tmp_path(path)
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(entry, f)
+        self._commit(tmp_path, path)
+
+    def open_writer(self, endpoint: str, params: dict = None, ttl: float = None) -> "StreamingEntryWriter":
+        """
+        Returns a writer that stores a raw JSON response body as it is received, for responses that
+        are streamed rather than decoded in one go.  The entry only becomes visible once committed.
+        """
+        path = self.path(self.key(endpoint, params))
+        return StreamingEntryWriter(self, endpoint, params, path, self._tmp_path(path), ttl)
+
+    def _commit(self, tmp_path: str, path: str):
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += os.path.getsize(path) - old_size
+        if self.total_bytes() > self.max_bytes:
+            self.evict()
+
+    def _entries(self) -> list:
+        entries = []
+        if not os.path.exists(self.folder):
+            return entries
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith(".json.gz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def total_bytes(self) -> int:
+        """Returns the total compressed size of the cache, scanning the folder on first use."""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            return self._total_bytes
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                removed += 1
+            self._total_bytes = total
+        if removed:
+            logging.info(f"Evicted {removed} cached responses; cache is now {total} bytes")
+
+
+class StreamingEntryWriter:
+    """
+    Writes a cache entry from raw response body chunks, in the same format as ResponseCache.put.
+    Call commit() once the whole body has been written, or abort() to discard it.
+    """
+
+    def __init__(self, cache: ResponseCache, endpoint: str, params: dict, path: str, tmp_path: str, ttl: float = None):
+        self.cache = cache
+        self.path = path
+        self.tmp_path = tmp_path
+        self._file = gzip.open(tmp_path, "wb")
+        header = {"endpoint": endpoint, "params": params or {}, "fetched_at": time.time()}
+        if ttl is not None:
+            header["ttl"] = ttl
+        header = json.dumps(header)
+        self._file.write(f"{header[:-1]}, {DATA_MARKER}".encode("utf-8"))
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+
+    def commit(self):
+        self._file.write(b"}")
+        self._file.close()
+        self.cache._commit(self.tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        self.cache._remove(self.tmp_path)
@@ -0,0 +1,128 @@
+"""
+The in-memory schema of the driver stats and performance tables, used by every loader so that all stages
+see the same compact dtypes whatever the source (the SQLite store, a CSV or Parquet file).  Repeated
+strings are categoricals, and numbers and positions use the narrowest integer type that holds them, with
+the nullable types where a value can be missing.  Lap times and scores stay float64 so that scores are
+reproduced exactly; the lap pace columns are float32 as they are computed from the float32 lap store.
+The CSVs are written with a typed Parquet copy next to them, which is read instead while the CSV is
+unchanged, as parsing a CSV into these dtypes is slower than inferring them.
+"""
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+DRIVER_STATS_DTYPES = {
+    "season_year": "int16",
+    "race_number": "int8",
+    "session_key": "int32",
+    "race_location": "category",
+    "country": "category",
+    "date": "category",
+    "driver_number": "int8",
+    "driver_name": "category",
+    "broadcast_name": "category",
+    "team_name": "category",
+    "country_code": "category",
+    "best_lap_time": "float64",
+    "avg_lap_time": "float64",
+    "position_change": "Int8",
+    "grid_position": "Int8",
+    "final_position": "Int8",
+    "driver_surname": "category",
+    "team_name_mapped": "category",
+    # Lap pace columns from lap_analytics
+    "clean_laps": "Int16",
+    "median_lap_time": "float32",
+    "percentile_lap_time": "float32",
+    "stint_count": "Int8",
+    "deg_slope": "float32",
+}
+
+
+def _nullable(dtype: str) -> str:
+    # Missing values need the nullable version of a NumPy integer type
+    return dtype.capitalize() if dtype.startswith("int") else dtype
+
+
+def apply_schema(df: pd.DataFrame, dtypes: dict = DRIVER_STATS_DTYPES) -> pd.DataFrame:
+    """
+    Returns df with every column named in dtypes cast to its declared dtype, and every other column
+    unchanged.  Integer columns with missing values get the nullable integer type.  Columns that
+    already have their dtype are not copied.
+    """
+    casts = {}
+    for col, dtype in dtypes.items():
+        if col not in df.columns:
+            continue
+        if dtype.startswith("int") and df[col].isna().any():
+            dtype = _nullable(dtype)
+        if df[col].dtype != dtype:
+            casts[col] = dtype
+    return df.astype(casts) if casts else df
+
+
+def parquet_copy_path(path: str) -> str:
+    """Returns the path of the Parquet copy that write_csv_typed writes next to the CSV at path."""
+    return f"{os.path.splitext(path)[0]}.parquet"
+
+
+def _csv_stamp(path: str) -> dict:
+    stat = os.stat(path)
+    return {"csv_size": stat.st_size, "csv_mtime_ns": stat.st_mtime_ns}
+
+
+def write_csv_typed(df: pd.DataFrame, path: str):
+    """
+    Writes df to the CSV at path, and a Parquet copy of it to parquet_copy_path(path) stamped with the
+    CSV's size and modification time.  The CSV is written to a temporary file and renamed into place.
+    """
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    parquet_path = parquet_copy_path(path)
+    df_copy = df.copy(deep=False)
+    df_copy.attrs = _csv_stamp(path)
+    try:
+        df_copy.to_parquet(f"{parquet_path}.tmp", index=False)
+    except (TypeError, ValueError) as e:
+        # pyarrow's ArrowInvalid and ArrowTypeError are subclasses of these
+        logging.warning(f"Not writing a Parquet copy of {path}: {e}")
+        for stale in [f"{parquet_path}.tmp", parquet_path]:
+            if os.path.exists(stale):
+                os.remove(stale)
+        return
+    os.replace(f"{parquet_path}.tmp", parquet_path)
+
+
+def read_csv_typed(path: str, dtypes: dict = DRIVER_STATS_DTYPES, **kwargs) -> pd.DataFrame:
+    """
+    Returns pd.read_csv(path, **kwargs) with the columns in dtypes parsed straight into their declared
+    dtypes.  If the CSV is unchanged since write_csv_typed wrote it, its Parquet copy is read instead,
+    which holds the exact values written (kwargs only apply to the CSV).
+    """
+    parquet_path = parquet_copy_path(path)
+    if os.path.exists(parquet_path):
+        df = pd.read_parquet(parquet_path)
+        if df.attrs == _csv_stamp(path):
+            df.attrs = {}
+            return apply_schema(df, dtypes)
+    # Integers are parsed as nullable, as a CSV may have missing values; apply_schema narrows them back
+    parse_dtypes = {col: _nullable(dtype) for col, dtype in dtypes.items()}
+    return apply_schema(pd.read_csv(path, dtype=parse_dtypes, **kwargs), dtypes)
+
+
+def map_categories(values: pd.Series, func) -> pd.Series:
+    """
+    Returns func applied to every value of values as a categorical Series, calling func once per
+    distinct value rather than once per row.  Missing values, and values func maps to None, are missing.
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype("category")
+    mapped_codes, mapped_categories = pd.factorize(pd.Series(values.cat.categories).map(func).to_numpy(dtype=object))
+    # Code -1 (missing) indexes the appended -1
+    codes = np.append(mapped_codes, -1)[values.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=pd.Index(mapped_categories)),
+                     index=values.index, name=values.name)
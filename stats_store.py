@@ -0,0 +1,287 @@
+"""
+SQLite-backed store for the per-driver race stats, partitioned by season: each season is kept in its own
+shard, CACHE_FOLDER_DRIVER_STATS/season_year=YYYY.sqlite, indexed by race.  Reads for some seasons only
+open those seasons' shards, and seasons can be written concurrently without contending for a lock, so
+updating one season never touches the others.  Rows are upserted on (session_key, driver_number) inside a
+transaction per shard, so an interrupted ingestion run never leaves a half-written race behind and can
+simply be resumed.  The CSV at CACHE_FILE_DRIVER_STATS is kept as an export of the store, refreshed only
+for the seasons written, and a new store is imported from the single-file store at CACHE_DB_DRIVER_STATS,
+or failing that from the CSV.
+"""
+
+import glob
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+from common import CACHE_DB_DRIVER_STATS, CACHE_FILE_DRIVER_STATS, CACHE_FOLDER_DRIVER_STATS, DRIVER_STATS_TABLE
+from schema import apply_schema, read_csv_typed, write_csv_typed
+
+TABLE_NAME = DRIVER_STATS_TABLE
+KEY_COLUMNS = ["session_key", "driver_number"]
+
+# Columns written by query_race_stats and tidy_race_stats, with their SQLite types
+STATS_COLUMNS = {
+    "season_year": "INTEGER",
+    "race_number": "INTEGER",
+    "session_key": "INTEGER NOT NULL",
+    "race_location": "TEXT",
+    "country": "TEXT",
+    "date": "TEXT",
+    "driver_number": "INTEGER NOT NULL",
+    "driver_name": "TEXT",
+    "broadcast_name": "TEXT",
+    "team_name": "TEXT",
+    "country_code": "TEXT",
+    "best_lap_time": "REAL",
+    "avg_lap_time": "REAL",
+    "position_change": "INTEGER",
+    "grid_position": "INTEGER",
+    "final_position": "INTEGER",
+    "driver_surname": "TEXT",
+    "team_name_mapped": "TEXT",
+}
+
+
+def shard_path(season_year, folder: str = CACHE_FOLDER_DRIVER_STATS) -> str:
+    return os.path.join(folder, f"season_year={int(season_year)}.sqlite")
+
+
+class SeasonShard:
+    """
+    One season of the driver stats table, keyed on (session_key, driver_number) and indexed by race.
+    Columns not in STATS_COLUMNS are added to the table the first time they are upserted.  A shard can
+    be used from any thread; its operations are serialized by a lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_table()
+
+    def _create_table(self):
+        column_defs = ", ".join(f'"{col}" {col_type}' for col, col_type in STATS_COLUMNS.items())
+        keys = ", ".join(KEY_COLUMNS)
+        with self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE_NAME} ({column_defs}, PRIMARY KEY ({keys}))")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_season_race ON {TABLE_NAME} (season_year, race_number)")
+
+    def columns(self) -> list:
+        """Returns the table's columns in definition order."""
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({TABLE_NAME})")]
+
+    def _table_types(self) -> dict:
+        return {row[1]: row[2] for row in self.conn.execute(f"PRAGMA table_info({TABLE_NAME})")}
+
+    def upsert(self, df: pd.DataFrame) -> int:
+        """
+        Inserts or updates the rows of df keyed on (session_key, driver_number) in a single transaction.
+        Only the columns present in df are updated on existing rows.  Returns the number of rows written.
+        """
+        columns = list(df.columns)
+        quoted = ", ".join(f'"{col}"' for col in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(f'"{col}" = excluded."{col}"' for col in columns if col not in KEY_COLUMNS)
+        conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        sql = (f"INSERT INTO {TABLE_NAME} ({quoted}) VALUES ({placeholders}) "
+               f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) {conflict}")
+        values = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+        with self.lock, self.conn:
+            existing = set(self.columns())
+            for col in columns:
+                if col not in existing:
+                    self.conn.execute(f'ALTER TABLE {TABLE_NAME} ADD COLUMN "{col}"')
+            self.conn.executemany(sql, (tuple(_to_sql_value(v) for v in row) for row in values))
+        return len(df)
+
+    def read(self, session_keys=None, columns=None) -> pd.DataFrame:
+        """
+        Returns the shard's rows in insertion order, optionally restricted to some session keys and to
+        the subset of columns that the shard has.  Integer columns without missing values are returned
+        as int64, as pd.read_csv would.
+        """
+        with self.lock:
+            table_types = self._table_types()
+            if columns:
+                columns = [col for col in columns if col in table_types]
+            selected = ", ".join(f'"{col}"' for col in columns) if columns else "*"
+            where, params = "", []
+            if session_keys is not None:
+                params = [int(v) for v in session_keys]
+                where = f" WHERE session_key IN ({', '.join('?' for _ in params)})"
+            df = pd.read_sql_query(f"SELECT {selected} FROM {TABLE_NAME}{where} ORDER BY rowid", self.conn, params=params)
+
+        for col, col_type in table_types.items():
+            if col in df.columns and col_type.startswith("INTEGER") and df[col].notna().all():
+                df[col] = df[col].astype("int64")
+        return df
+
+    def cached_keys(self) -> set:
+        with self.lock:
+            return set(self.conn.execute(f"SELECT session_key, driver_number FROM {TABLE_NAME}"))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class DriverStatsStore:
+    """
+    Driver stats table keyed on (session_key, driver_number), stored as one SeasonShard per season in
+    folder.  Shards are opened when first used, and a season's shard is created by the first upsert of
+    one of its rows.
+    """
+
+    def __init__(self, folder: str = CACHE_FOLDER_DRIVER_STATS, csv_path: str = CACHE_FILE_DRIVER_STATS,
+                 legacy_path: str = CACHE_DB_DRIVER_STATS):
+        self.path = folder
+        self.csv_path = csv_path
+        self._shards = {}
+        self._lock = threading.Lock()
+        is_new = not self.seasons()
+        os.makedirs(folder, exist_ok=True)
+        if not is_new:
+            return
+        if legacy_path and os.path.exists(legacy_path):
+            conn = sqlite3.connect(legacy_path)
+            try:
+                df = pd.read_sql_query(f"SELECT * FROM {TABLE_NAME} ORDER BY rowid", conn)
+            finally:
+                conn.close()
+            source = legacy_path
+        elif csv_path and os.path.exists(csv_path):
+            df = read_csv_typed(csv_path)
+            source = csv_path
+        else:
+            return
+        self.upsert(df)
+        logging.info(f"Imported {len(df)} rows from {source} into {folder}")
+
+    def seasons(self) -> list:
+        """Returns the seasons with a shard on disk, in ascending order."""
+        pattern = re.compile(r"season_year=(\d+)\.sqlite$")
+        matches = (pattern.search(path) for path in glob.glob(os.path.join(self.path, "season_year=*.sqlite")))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def shard(self, season_year, create: bool = True) -> SeasonShard:
+        """Returns the shard of a season, or None if it does not exist and create is False."""
+        season_year = int(season_year)
+        with self._lock:
+            if season_year not in self._shards:
+                path = shard_path(season_year, self.path)
+                if not create and not os.path.exists(path):
+                    return None
+                self._shards[season_year] = SeasonShard(path)
+            return self._shards[season_year]
+
+    def _selected_seasons(self, season_years) -> list:
+        seasons = self.seasons()
+        if season_years is None:
+            return seasons
+        wanted = {int(season) for season in season_years}
+        return [season for season in seasons if season in wanted]
+
+    def columns(self) -> list:
+        """Returns the columns of every shard, in definition order."""
+        columns = list(STATS_COLUMNS)
+        for season in self.seasons():
+            columns.extend(col for col in self.shard(season).columns() if col not in columns)
+        return columns
+
+    def session_seasons(self) -> dict:
+        """Returns the season of every stored session_key."""
+        return {session_key: season for season in self.seasons() for session_key, _ in self.shard(season).cached_keys()}
+
+    def upsert(self, rows) -> int:
+        """
+        Inserts or updates rows (a DataFrame or a list of dicts) keyed on (session_key, driver_number),
+        in one transaction per season.  Only the columns present in rows are updated on existing rows.
+        Rows without a season_year are written to the shard already holding their session, so that
+        columns can be updated from the keys alone.  Returns the number of rows written.
+        """
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if df.empty:
+            return 0
+        missing_keys = [col for col in KEY_COLUMNS if col not in df.columns]
+        if missing_keys:
+            raise ValueError(f"Rows are missing key columns: {missing_keys}")
+
+        seasons = df["season_year"] if "season_year" in df.columns else pd.Series(pd.NA, index=df.index)
+        if seasons.isna().any():
+            session_seasons = self.session_seasons()
+            seasons = seasons.fillna(df["session_key"].map(lambda key: session_seasons.get(int(key))))
+            if seasons.isna().any():
+                unknown = sorted(int(key) for key in df.loc[seasons.isna(), "session_key"].unique())
+                raise ValueError(f"Rows have no season_year and their sessions are not stored: {unknown}")
+
+        for season_year, df_season in df.groupby(seasons.astype("int64").to_numpy(), sort=True):
+            self.shard(season_year).upsert(df_season)
+        return len(df)
+
+    def read(self, season_years=None, session_keys=None, columns=None) -> pd.DataFrame:
+        """
+        Returns the stored rows in season order, and in insertion order within each season, as a
+        DataFrame with the dtypes in schema.DRIVER_STATS_DTYPES.  Restricting it to some season years
+        only reads their shards; it can also be restricted to some session keys (served from each
+        shard's key index) and to a subset of columns.
+        """
+        frames = [self.shard(season).read(session_keys=session_keys, columns=columns)
+                  for season in self._selected_seasons(season_years)]
+        frames = [df for df in frames if not df.empty]
+        if not frames:
+            return apply_schema(pd.DataFrame({col: pd.Series(dtype=object) for col in (columns or list(STATS_COLUMNS))}))
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if columns:
+            df = df.reindex(columns=columns)
+        return apply_schema(df)
+
+    def cached_keys(self, season_years=None) -> set:
+        """Returns the set of (session_key, driver_number) pairs already stored, optionally for some seasons only."""
+        return set().union(*(self.shard(season).cached_keys() for season in self._selected_seasons(season_years)))
+
+    def export_csv(self, path: str = None, season_years=None) -> int:
+        """
+        Writes every stored row to path (defaults to the CSV the store was created with), and its
+        Parquet copy, with write_csv_typed.  With season_years, only those seasons' shards are
+        read, and their rows are spliced into the existing export in place of its rows for them, so the
+        shards of other seasons are never opened.  Returns the number of rows written.
+        """
+        path = path or self.csv_path
+        df = self.read(season_years=season_years)
+        if season_years is not None and os.path.exists(path):
+            df_prev = read_csv_typed(path, float_precision="round_trip")
+            df_prev = df_prev[~df_prev["season_year"].isin([int(season) for season in season_years])]
+            # Seasons in order, and the rows of each in the order they were exported or stored
+            df = pd.concat([df_prev, df], ignore_index=True).sort_values("season_year", kind="stable", ignore_index=True)
+            df = apply_schema(df)
+        write_csv_typed(df, path)
+        logging.info(f"Exported {len(df)} rows to {path}")
+        return len(df)
+
+    def close(self):
+        with self._lock:
+            for shard in self._shards.values():
+                shard.close()
+            self._shards.clear()
+
+
+def _to_sql_value(value):
+    # NumPy scalars are not understood by sqlite3
+    return value.item() if hasattr(value, "item") else value
+
+
+def load_driver_stats(season_years=None, session_keys=None, columns=None) -> pd.DataFrame:
+    """Opens the default store and returns its rows, see DriverStatsStore.read."""
+    store = DriverStatsStore()
+    try:
+        return store.read(season_years=season_years, session_keys=session_keys, columns=columns)
+    finally:
+        store.close()
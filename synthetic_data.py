@@ -0,0 +1,232 @@
+"""
+Deterministic synthetic F1 data at any scale, for measuring how the pipeline scales without calling the
+OpenF1 API.  The same seed and sizes always give the same data.  Laps are generated first and the driver
+stats are derived from them, so that both agree; the position streams and upgrade tables follow the
+formats of the OpenF1 /position endpoint and DATA_FILE_UPGRADES.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from lap_store import LAP_COLUMNS, PARTITION_COLUMNS
+
+# (OpenF1 team name, team name used in the FIA documents), two drivers each
+TEAMS = [
+    ("McLaren", "McLaren Formula 1 Team"),
+    ("Ferrari", "SCUDERIA FERRARI HP"),
+    ("Red Bull Racing", "Red Bull Racing"),
+    ("Mercedes", "Mercedes-AMG PETRONAS F1 Team"),
+    ("Aston Martin", "Aston Martin Aramco F1 Team"),
+    ("Alpine", "BWT Alpine F1 Team"),
+    ("Haas F1 Team", "MONEYGRAM HAAS F1 TEAM"),
+    ("RB", "Visa Cash App Racing Bulls"),
+    ("Williams", "ATLASSIAN WILLIAMS RACING"),
+    ("Kick Sauber", "Stake F1 Team KICK Sauber"),
+    ("Cadillac", "Cadillac"),
+]
+COMPONENTS = ["Front Wing", "Rear Wing", "Beam Wing", "Floor Body", "Floor Edge", "Floor Fences", "Diffuser",
+              "Coke/Engine Cover", "Front Suspension", "Rear Corner", "Front Corner", "Sidepod Inlet"]
+REASONS = ["Performance - Local Load", "Performance - Flow Conditioning", "Circuit specific - Drag Range",
+           "Circuit specific - Cooling Range", "Reliability"]
+FIRST_START_YEAR = 2000
+SESSION_KEY_BASE = 10000
+
+
+def _rng(seed: int, stream: int) -> np.random.Generator:
+    # A separate stream per kind of data, so that changing one generator does not change the others
+    return np.random.default_rng([seed, stream])
+
+
+def generate_sessions(seasons: int = 1, races: int = 24, seed: int = 0) -> pd.DataFrame:
+    """Returns one row per race with season_year, race_number, session_key, race_location, country and date."""
+    rng = _rng(seed, 0)
+    season_year = np.repeat(np.arange(FIRST_START_YEAR, FIRST_START_YEAR + seasons), races)
+    race_number = np.tile(np.arange(1, races + 1), seasons)
+    starts = [datetime(int(year), 3, 1, 15) + timedelta(days=int(14 * (race - 1) + rng.integers(0, 3)))
+              for year, race in zip(season_year, race_number)]
+    return pd.DataFrame({
+        "season_year": season_year,
+        "race_number": race_number,
+        "session_key": SESSION_KEY_BASE + np.arange(seasons * races),
+        "race_location": [f"Circuit {race}" for race in race_number],
+        "country": [f"Country {race}" for race in race_number],
+        "date": [start.strftime("%Y-%m-%dT%H:%M:%S+00:00") for start in starts],
+    })
+
+
+def generate_laps(df_sessions: pd.DataFrame, drivers: int = 20, laps: int = 60, seed: int = 0) -> dict:
+    """
+    Returns every lap of every session as a dict of arrays with the columns and dtypes of
+    lap_store.read_laps.  Lap times follow a base pace per race, a pace offset per driver, fuel burn,
+    tyre degradation within each of two or three stints, pit in- and out-laps, a slow first lap and
+    occasional safety car laps.
+    """
+    rng = _rng(seed, 1)
+    n_sessions = len(df_sessions)
+    shape = (n_sessions, drivers, laps)
+
+    lap_number = np.broadcast_to(np.arange(1, laps + 1), shape)
+    base_pace = rng.uniform(75.0, 100.0, n_sessions)[:, None, None]
+    driver_offset = rng.normal(0.0, 0.6, drivers)[None, :, None] + rng.normal(0.0, 0.2, (n_sessions, drivers, 1))
+
+    # Pit stops at two or three random laps; the lap after each stop is a pit out-lap
+    stops = np.sort(rng.integers(5, max(laps - 5, 6), (n_sessions, drivers, 3)), axis=2)
+    stops[..., 2] = np.where(rng.random((n_sessions, drivers)) < 0.5, stops[..., 2], laps + 1)
+    is_pit_out_lap = (lap_number[..., None] == stops[:, :, None, :] + 1).any(axis=3)
+    is_in_lap = (lap_number[..., None] == stops[:, :, None, :]).any(axis=3)
+    tyre_age = lap_number - np.max(np.where(lap_number[..., None] > stops[:, :, None, :], stops[:, :, None, :], 0), axis=3)
+
+    lap_duration = (base_pace + driver_offset - 0.06 * lap_number + 0.04 * tyre_age
+                    + rng.normal(0.0, 0.3, shape) + 6.0 * (lap_number == 1) + 20.0 * is_pit_out_lap + 4.0 * is_in_lap)
+    safety_car = rng.random((n_sessions, 1, laps)) < 0.03
+    lap_duration = np.where(safety_car, lap_duration * 1.35, lap_duration)
+
+    race_start = pd.to_datetime(df_sessions["date"], utc=True).dt.tz_localize(None).to_numpy(dtype="datetime64[ms]")
+    elapsed = np.cumsum(lap_duration, axis=2) - lap_duration
+    date_start = race_start[:, None, None] + (elapsed * 1000).astype("timedelta64[ms]")
+
+    sector_split = rng.dirichlet([30, 40, 30], shape)
+    arrays = {
+        "season_year": np.repeat(df_sessions["season_year"].to_numpy(), drivers * laps),
+        "session_key": np.repeat(df_sessions["session_key"].to_numpy(), drivers * laps),
+        "driver_number": np.broadcast_to(np.arange(1, drivers + 1)[None, :, None], shape).ravel(),
+        "lap_number": lap_number.ravel(),
+        "lap_duration": lap_duration.ravel(),
+        "duration_sector_1": (lap_duration * sector_split[..., 0]).ravel(),
+        "duration_sector_2": (lap_duration * sector_split[..., 1]).ravel(),
+        "duration_sector_3": (lap_duration * sector_split[..., 2]).ravel(),
+        "i1_speed": rng.normal(280, 10, shape).ravel(),
+        "i2_speed": rng.normal(260, 10, shape).ravel(),
+        "st_speed": rng.normal(310, 10, shape).ravel(),
+        "is_pit_out_lap": is_pit_out_lap.ravel(),
+        "date_start": date_start.ravel(),
+    }
+    dtypes = {**PARTITION_COLUMNS, **LAP_COLUMNS}
+    return {col: np.ascontiguousarray(values).astype(dtypes[col]) for col, values in arrays.items()}
+
+
+def generate_driver_stats(df_sessions: pd.DataFrame, laps: dict, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns one row per driver per session with the columns written by query_race_stats, before the
+    tidy columns are added.  Lap times are derived from laps, and grid and finishing positions are
+    random permutations biased towards each driver's pace.
+    """
+    rng = _rng(seed, 2)
+    df_laps = pd.DataFrame({col: laps[col] for col in ["session_key", "driver_number", "lap_duration"]})
+    df = df_laps.groupby(["session_key", "driver_number"], as_index=False).agg(
+        best_lap_time=("lap_duration", "min"),
+        avg_lap_time=("lap_duration", "mean"),
+    )
+    df = df_sessions.merge(df.astype({"driver_number": np.int64, "best_lap_time": float, "avg_lap_time": float}), on="session_key")
+
+    drivers = df["driver_number"].to_numpy()
+    team_index = (drivers - 1) // 2 % len(TEAMS)
+    df["driver_name"] = [f"Driver{n} SURNAME{n}" for n in drivers]
+    df["broadcast_name"] = [f"D SURNAME{n}" for n in drivers]
+    df["team_name"] = [TEAMS[i][0] for i in team_index]
+    df["country_code"] = [f"C{n % 30:02d}" for n in drivers]
+
+    # Rank a noisy copy of average pace within each session for the grid, and another for the finish
+    for col, noise in [("grid_position", 0.5), ("final_position", 1.0)]:
+        df[col] = (df["avg_lap_time"] + rng.normal(0.0, noise, len(df))).groupby(df["session_key"]).rank(method="first").astype(int)
+    df["position_change"] = df["grid_position"] - df["final_position"]
+
+    columns = ["season_year", "race_number", "session_key", "race_location", "country", "date", "driver_number",
+               "driver_name", "broadcast_name", "team_name", "country_code", "best_lap_time", "avg_lap_time",
+               "position_change", "grid_position", "final_position"]
+    return df[columns]
+
+
+def generate_position_entries(df_stats: pd.DataFrame, changes_per_driver: int = 20, seed: int = 0) -> list:
+    """
+    Returns /position entries for every session in df_stats: each driver's grid position at the start,
+    random positions during the race and their final position at the end, in date order per session.
+    """
+    rng = _rng(seed, 3)
+    entries = []
+    for session_key, df_session in df_stats.groupby("session_key", sort=False):
+        start = datetime.fromisoformat(df_session["date"].iloc[0])
+        n_drivers = len(df_session)
+        n = n_drivers * (changes_per_driver + 2)
+        drivers = np.tile(df_session["driver_number"].to_numpy(), changes_per_driver + 2)
+        positions = rng.integers(1, n_drivers + 1, n)
+        positions[:n_drivers] = df_session["grid_position"].to_numpy()
+        positions[-n_drivers:] = df_session["final_position"].to_numpy()
+        seconds = np.sort(rng.uniform(60, 5400, n))
+        seconds[:n_drivers], seconds[-n_drivers:] = 0, 5500
+        for driver_number, position, offset in zip(drivers.tolist(), positions.tolist(), seconds.tolist()):
+            entries.append({
+                "date": (start + timedelta(seconds=offset)).isoformat(),
+                "session_key": int(session_key),
+                "driver_number": driver_number,
+                "position": position,
+            })
+    return entries
+
+
+def generate_upgrades(df_sessions: pd.DataFrame, mean_upgrades: float = 0.6, seed: int = 0):
+    """
+    Returns (df_upgrades, df_fia_docs): upgrade rows with the columns of DATA_FILE_UPGRADES, and the
+    matching FIA document list with the columns of CACHE_FILE_FIA_DOCS.  Each team brings a Poisson
+    number of upgraded components to each race.
+    """
+    rng = _rng(seed, 4)
+    df_fia_docs = df_sessions[["season_year", "race_number"]].copy()
+    filenames = [f"{year}_race_{race:02d}_-_car_presentation_submissions.pdf"
+                 for year, race in zip(df_sessions["season_year"], df_sessions["race_number"])]
+    df_fia_docs["pdf_url"] = [f"https://www.fia.com/sites/default/files/decision-document/{name}" for name in filenames]
+
+    counts = rng.poisson(mean_upgrades, (len(df_sessions), len(TEAMS)))
+    doc_index, team_index = np.nonzero(counts)
+    doc_index = np.repeat(doc_index, counts[doc_index, team_index])
+    team_index = np.repeat(team_index, counts[counts > 0])
+    n = len(doc_index)
+    components = np.array(COMPONENTS)[rng.integers(0, len(COMPONENTS), n)]
+    df_upgrades = pd.DataFrame({
+        "Filename": np.array(filenames)[doc_index],
+        "Team Name": np.array([fia_name for _, fia_name in TEAMS])[team_index],
+        "Updated component": components,
+        "Primary reason for update": np.array(REASONS)[rng.integers(0, len(REASONS), n)],
+        "Geometric differences compared to previous version": [f"Revised {c.lower()} geometry" for c in components],
+        "Brief description on how the update works": [f"Improves the flow around the {c.lower()}" for c in components],
+    })
+    return df_upgrades, df_fia_docs
+
+
+def generate_session_recording(drivers: int = 20, laps: int = 60, seed: int = 0) -> dict:
+    """
+    Returns one synthetic race as recorded by replay_server.record_session: its session_key and lists of
+    /drivers, /laps and /position records.
+    """
+    df_sessions = generate_sessions(1, 1, seed)
+    lap_arrays = generate_laps(df_sessions, drivers, laps, seed)
+    df_stats = generate_driver_stats(df_sessions, lap_arrays, seed)
+    session_key = int(df_sessions["session_key"].iloc[0])
+    df_laps = pd.DataFrame({col: lap_arrays[col] for col in ["driver_number", "lap_number", "lap_duration", "date_start"]})
+    df_laps["date_start"] = df_laps["date_start"].dt.tz_localize("UTC").map(lambda date: date.isoformat())
+    return {
+        "session_key": session_key,
+        "drivers": [{"session_key": session_key, "driver_number": int(row.driver_number), "full_name": row.driver_name,
+                     "broadcast_name": row.broadcast_name, "team_name": row.team_name, "country_code": row.country_code}
+                    for row in df_stats.itertuples()],
+        "laps": [{"session_key": session_key, "driver_number": int(driver_number), "lap_number": int(lap_number),
+                  "lap_duration": round(float(duration), 3), "date_start": date_start}
+                 for driver_number, lap_number, duration, date_start in df_laps.itertuples(index=False, name=None)],
+        "position": generate_position_entries(df_stats, seed=seed),
+    }
+
+
+def generate_dataset(seasons: int = 1, races: int = 24, drivers: int = 20, laps: int = 60, seed: int = 0) -> dict:
+    """Returns a dict of 'sessions', 'laps', 'stats', 'upgrades' and 'fia_docs' from the generators above."""
+    df_sessions = generate_sessions(seasons, races, seed)
+    lap_arrays = generate_laps(df_sessions, drivers, laps, seed)
+    df_upgrades, df_fia_docs = generate_upgrades(df_sessions, seed=seed)
+    return {
+        "sessions": df_sessions,
+        "laps": lap_arrays,
+        "stats": generate_driver_stats(df_sessions, lap_arrays, seed),
+        "upgrades": df_upgrades,
+        "fia_docs": df_fia_docs,
+    }
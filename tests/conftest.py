@@ -0,0 +1,56 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class StubServer:
+    """
+    Local HTTP server answering every GET with respond(request), which returns (status, headers, body),
+    and recording each request as a dict of its arrival time, path and headers.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                request = {"time": time.monotonic(), "path": self.path, "headers": dict(self.headers)}
+                with stub.lock:
+                    stub.requests.append(request)
+                status, headers, body = stub.respond(request)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    """Returns a function starting a StubServer for a respond function; every server is closed afterwards."""
+    servers = []
+
+    def start(respond) -> StubServer:
+        servers.append(StubServer(respond))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
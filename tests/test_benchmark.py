@@ -0,0 +1,23 @@
+import json
+
+import benchmark
+
+
+def test_first_run_records_baselines_and_later_runs_compare(tmp_path, monkeypatch):
+    path = str(tmp_path / "baselines.json")
+    timings = {"stage@small": 0.002, "other@small": 0.5}
+    monkeypatch.setattr(benchmark, "run", lambda sizes, stages: dict(timings))
+
+    assert benchmark.main(path=path) == 0
+    with open(path) as f:
+        assert json.load(f) == timings
+    # Within the wider tolerance of a stage under SHORT_STAGE_SECONDS, and the usual one of a longer stage
+    timings.update({"stage@small": 0.0055, "other@small": 0.95})
+    assert benchmark.main(path=path) == 0
+    timings["other@small"] = 1.1
+    assert benchmark.main(path=path) == 1
+    # A new stage gets its baseline recorded without failing the run
+    timings = {"new@small": 0.3}
+    assert benchmark.main(path=path) == 0
+    with open(path) as f:
+        assert json.load(f)["new@small"] == 0.3
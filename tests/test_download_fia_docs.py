@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from download_fia_docs import download_pdf, make_download_session
+
+PDF = b"%PDF-1.7\n" + bytes(range(256)) * 40 + b"\n%%EOF\n"
+PDF_V2 = b"%PDF-1.7\n" + bytes(reversed(range(256))) * 50 + b"\n%%EOF\n"
+
+
+class PdfStandIn:
+    """Serves one document with an ETag, honouring If-None-Match, Range and If-Range like the FIA site."""
+
+    def __init__(self, stub_server, body: bytes = PDF, etag: str = '"v1"'):
+        self.body = body
+        self.etag = etag
+        self.server = stub_server(self.respond)
+        self.url = f"{self.server.url}/docs/car_presentation.pdf"
+
+    def respond(self, request):
+        headers = request["headers"]
+        validators = {"ETag": self.etag, "Content-Type": "application/pdf"}
+        if headers.get("If-None-Match") == self.etag:
+            return 304, validators, b""
+        requested = headers.get("Range")
+        if requested and headers.get("If-Range", self.etag) == self.etag:
+            start = int(requested.split("=")[1].rstrip("-"))
+            if start >= len(self.body):
+                return 416, {"Content-Range": f"bytes */{len(self.body)}"}, b""
+            content_range = f"bytes {start}-{len(self.body) - 1}/{len(self.body)}"
+            return 206, {**validators, "Content-Range": content_range}, self.body[start:]
+        return 200, validators, self.body
+
+    @property
+    def requests(self) -> list:
+        return self.server.requests
+
+
+@pytest.fixture
+def session():
+    with make_download_session(1) as session:
+        yield session
+
+
+def read_meta(path: str) -> dict:
+    with open(f"{path}.meta.json") as f:
+        return json.load(f)
+
+
+def interrupted(path: str, body: bytes, etag: str = '"v1"'):
+    """Leaves a '.part' file and metadata as an interrupted download of body would."""
+    with open(f"{path}.part", "wb") as f:
+        f.write(body)
+    with open(f"{path}.meta.json", "w") as f:
+        json.dump({"partial": {"etag": etag, "last_modified": None}}, f)
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_then_unchanged(stub_server, session, tmp_path):
+    server = PdfStandIn(stub_server)
+    path = str(tmp_path / "doc.pdf")
+    assert download_pdf(session, server.url, path) == "downloaded"
+    assert read(path) == PDF
+    assert read_meta(path)["sha256"] == hashlib.sha256(PDF).hexdigest()
+    assert download_pdf(session, server.url, path) == "unchanged"
+    assert server.requests[-1]["headers"]["If-None-Match"] == '"v1"'
+    assert download_pdf(session, server.url, path, revalidate=False) == "skipped"
+    assert len(server.requests) == 2
+
+
+def test_etag_change_downloads_new_version(stub_server, session, tmp_path):
+    server = PdfStandIn(stub_server)
+    path = str(tmp_path / "doc.pdf")
+    download_pdf(session, server.url, path)
+    server.body, server.etag = PDF_V2, '"v2"'
+    assert download_pdf(session, server.url, path) == "downloaded"
+    assert read(path) == PDF_V2
+    assert read_meta(path)["etag"] == '"v2"'
+
+
+def test_resume_from_part_file(stub_server, session, tmp_path):
+    server = PdfStandIn(stub_server)
+    path = str(tmp_path / "doc.pdf")
+    interrupted(path, PDF[:1000])
+    assert download_pdf(session, server.url, path) == "resumed"
+    assert server.requests[0]["headers"]["Range"] == "bytes=1000-"
+    assert read(path) == PDF
+    assert read_meta(path)["sha256"] == hashlib.sha256(PDF).hexdigest()
+    assert not os.path.exists(f"{path}.part")
+
+
+def test_resume_of_changed_document_starts_again(stub_server, session, tmp_path):
+    server = PdfStandIn(stub_server, PDF_V2, '"v2"')
+    path = str(tmp_path / "doc.pdf")
+    interrupted(path, PDF[:1000])
+    assert download_pdf(session, server.url, path) == "downloaded"
+    assert read(path) == PDF_V2
+
+
+def test_complete_part_file_answered_with_416(stub_server, session, tmp_path):
+    server = PdfStandIn(stub_server)
+    path = str(tmp_path / "doc.pdf")
+    interrupted(path, PDF)
+    assert download_pdf(session, server.url, path) == "resumed"
+    assert read(path) == PDF
+    assert read_meta(path)["sha256"] == hashlib.sha256(PDF).hexdigest()
+    # Later runs revalidate the finished file rather than asking for a range again
+    assert download_pdf(session, server.url, path) == "unchanged"
+    assert "Range" not in server.requests[-1]["headers"]
+
+
+def test_oversized_part_file_is_discarded(stub_server, session, tmp_path):
+    server = PdfStandIn(stub_server)
+    path = str(tmp_path / "doc.pdf")
+    interrupted(path, PDF + b"garbage")
+    assert download_pdf(session, server.url, path) == "downloaded"
+    assert read(path) == PDF
+    assert [r["headers"].get("Range") for r in server.requests] == [f"bytes={len(PDF) + 7}-", None]
+
+
+def test_checksum_mismatch_downloads_again(stub_server, session, tmp_path):
+    server = PdfStandIn(stub_server)
+    path = str(tmp_path / "doc.pdf")
+    download_pdf(session, server.url, path)
+    with open(path, "r+b") as f:
+        f.seek(100)
+        f.write(b"corrupt")
+    assert download_pdf(session, server.url, path) == "downloaded"
+    assert "If-None-Match" not in server.requests[-1]["headers"]
+    assert read(path) == PDF
+
+
+def test_non_pdf_is_rejected(stub_server, session, tmp_path):
+    server = PdfStandIn(stub_server, b"<html>Not found</html>")
+    path = str(tmp_path / "doc.pdf")
+    with pytest.raises(Exception, match="not a PDF"):
+        download_pdf(session, server.url, path)
+    assert not os.path.exists(path)
+    assert not os.path.exists(f"{path}.part")
@@ -0,0 +1,122 @@
+from extract_fia_upgrades import (
+    UPGRADE_COLUMNS,
+    assemble_upgrades,
+    extract_page,
+    extract_upgrades,
+    file_sha256,
+    save_cached_pages,
+)
+
+HEADER = ["Updated Component", "Primary reason for update", "Geometric differences compared to previous version",
+          "Brief description on how the update works"]
+
+
+def page(teams=(), tables=()) -> dict:
+    """A page as returned by extract_page, from (top, team) and (top, rows) pairs."""
+    return {"teams": [[top, team] for top, team in teams], "tables": [[top, rows] for top, rows in tables]}
+
+
+def upgrades(rows: list) -> list:
+    return [(row["Team Name"], *(row[col] for col in UPGRADE_COLUMNS)) for row in rows]
+
+
+def test_cells_merged_down_are_shared_by_every_component():
+    # The Haas layout at Silverstone: one reason and description for four components
+    pages = [page(teams=[(40.0, "MONEYGRAM HAAS F1 TEAM")], tables=[(90.0, [
+        HEADER,
+        ["Front Wing", "Performance - Local Load", "Revised flap", "Adds load at the front"],
+        ["Front Corner", None, "Revised duct", None],
+        ["Floor Body", None, None, None],
+        ["Rear Wing", None, "Lower downforce", None],
+    ])])]
+    assert upgrades(assemble_upgrades("haas.pdf", pages)) == [
+        ("MONEYGRAM HAAS F1 TEAM", "Front Wing", "Performance - Local Load", "Revised flap", "Adds load at the front"),
+        ("MONEYGRAM HAAS F1 TEAM", "Front Corner", "Performance - Local Load", "Revised duct", "Adds load at the front"),
+        ("MONEYGRAM HAAS F1 TEAM", "Floor Body", "Performance - Local Load", "Revised duct", "Adds load at the front"),
+        ("MONEYGRAM HAAS F1 TEAM", "Rear Wing", "Performance - Local Load", "Lower downforce", "Adds load at the front"),
+    ]
+
+
+def test_table_continues_onto_the_next_page():
+    pages = [
+        page(teams=[(40.0, "McLaren Formula 1 Team")], tables=[(90.0, [
+            HEADER,
+            ["Floor Edge", "Performance", "Revised edge", "Adds load"],
+            ["Beam Wing", "Circuit specific", "Less camber", "Less drag, as"],
+        ])]),
+        page(teams=[(400.0, "SCUDERIA FERRARI HP")], tables=[
+            # Header-less at the top of the page: the rest of McLaren's table, whose first row is the rest of the last
+            (30.0, [["", None, None, "needed at Monza"], ["Rear Wing", "Circuit specific", "Lower angle", "Less drag"]]),
+            (450.0, [HEADER, ["Sidepod", "Cooling", "Larger inlet", "More cooling"]]),
+        ]),
+        # A header-less table below a heading is not a continuation, and is left out
+        page(teams=[(40.0, "Red Bull Racing")], tables=[(90.0, [["Floor", "Performance", "New", "More load"]])]),
+    ]
+    assert upgrades(assemble_upgrades("monza.pdf", pages)) == [
+        ("McLaren Formula 1 Team", "Floor Edge", "Performance", "Revised edge", "Adds load"),
+        ("McLaren Formula 1 Team", "Beam Wing", "Circuit specific", "Less camber", "Less drag, as needed at Monza"),
+        ("McLaren Formula 1 Team", "Rear Wing", "Circuit specific", "Lower angle", "Less drag"),
+        ("SCUDERIA FERRARI HP", "Sidepod", "Cooling", "Larger inlet", "More cooling"),
+    ]
+
+
+def test_team_cells_merged_across_the_table():
+    pages = [page(tables=[(60.0, [
+        ["MONEYGRAM HAAS F1 TEAM", None, None, None],
+        HEADER,
+        # Merged across the row, so the reason is also the geometric difference
+        ["Engine Cover", "Cooling", None, "Larger exit"],
+        ["Visa Cash App Racing Bulls", None, None, None],
+        ["Front Wing", "Performance", "New endplate", "Outwash"],
+        ["No updates", "-", "-", "-"],
+    ])])]
+    assert upgrades(assemble_upgrades("doc.pdf", pages)) == [
+        ("MONEYGRAM HAAS F1 TEAM", "Engine Cover", "Cooling", "Cooling", "Larger exit"),
+        ("Visa Cash App Racing Bulls", "Front Wing", "Performance", "New endplate", "Outwash"),
+    ]
+
+
+class FakeTable:
+    def __init__(self, bbox, rows):
+        self.bbox = bbox
+        self.rows = rows
+
+    def extract(self):
+        return self.rows
+
+
+class FakePage:
+    def __init__(self, lines, tables):
+        self.lines = lines
+        self.tables = tables
+
+    def find_tables(self):
+        return self.tables
+
+    def extract_text_lines(self):
+        return self.lines
+
+
+def test_extract_page_finds_headings_outside_tables():
+    table = FakeTable((50, 100, 550, 300), [[" Updated\nComponent ", None], ["Floor", "Performance"]])
+    lines = [
+        {"text": "MoneyGram Haas  F1 Team", "x0": 50, "x1": 300, "top": 60, "bottom": 75},
+        # Inside the table, so not a heading
+        {"text": "Red Bull Racing", "x0": 60, "x1": 200, "top": 150, "bottom": 165},
+    ]
+    assert extract_page(FakePage(lines, [table])) == {
+        "teams": [[60, "MONEYGRAM HAAS F1 TEAM"]],
+        "tables": [[100, [["Updated Component", None], ["Floor", "Performance"]]]],
+    }
+
+
+def test_cached_documents_are_not_parsed(tmp_path):
+    folder, cache_folder = tmp_path / "docs", tmp_path / "extracts"
+    folder.mkdir()
+    # Not a PDF at all, so parsing it would fail
+    path = folder / "haas.pdf"
+    path.write_bytes(b"not a pdf")
+    pages = [page(teams=[(40.0, "MONEYGRAM HAAS F1 TEAM")], tables=[(90.0, [HEADER, ["Floor", "Performance", "New", "More load"]])])]
+    save_cached_pages(file_sha256(str(path)), "haas.pdf", pages, str(cache_folder))
+    df = extract_upgrades(str(folder), str(cache_folder), max_workers=1)
+    assert df.to_dict("records") == [{"Filename": "haas.pdf", "Team Name": "MONEYGRAM HAAS F1 TEAM", **dict(zip(UPGRADE_COLUMNS, ["Floor", "Performance", "New", "More load"]))}]
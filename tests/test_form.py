@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import form
+from form import FORM_EWMA_ALPHA, FORM_WINDOW, FormEngine, form_table, load_engine, save_engine, update_form
+from performance_rating import rate_driver_performance
+from schema import apply_schema
+from synthetic_data import generate_dataset
+from tidy_race_stats import add_team_name_mapped_column
+
+
+@pytest.fixture
+def perf_merged() -> pd.DataFrame:
+    """Two synthetic seasons of seven races, scored, with a random upgrade count per team and race."""
+    df = rate_driver_performance(add_team_name_mapped_column(apply_schema(generate_dataset(seasons=2, races=7, drivers=6, laps=5)["stats"])))
+    rng = np.random.default_rng(0)
+    teams = df[["session_key", "team_name_mapped"]].drop_duplicates()
+    teams["upgrade_count"] = rng.poisson(0.8, len(teams)).astype(float)
+    return df.merge(teams, on=["session_key", "team_name_mapped"], how="left")
+
+
+def races_in_order(df: pd.DataFrame) -> list:
+    return df.drop_duplicates("session_key").astype({"date": str}).sort_values(["date", "session_key"])["session_key"].tolist()
+
+
+def test_races_applied_one_at_a_time_match_a_full_recompute(perf_merged, tmp_path):
+    expected = form_table(update_form(FormEngine(), perf_merged))
+    engine = FormEngine()
+    races = races_in_order(perf_merged)
+    for i in range(1, len(races) + 1):
+        # Saved and loaded between races, as refresh() does
+        save_engine(engine, str(tmp_path / "state.json"))
+        engine = update_form(load_engine(str(tmp_path / "state.json")), perf_merged[perf_merged["session_key"].isin(races[:i])],
+                             changed_sessions=[])
+    pd.testing.assert_frame_equal(form_table(engine), expected)
+
+    # And both match the same aggregates computed directly over each driver's races
+    df = perf_merged.astype({"date": str}).sort_values(["date", "session_key"])
+    last_season = df["season_year"].max()
+    drivers = expected[expected["kind"] == "driver"].set_index("name")
+    for name, scores in df.groupby("driver_name", observed=True)["weighted_score"]:
+        row = drivers.loc[name]
+        assert row["rolling_mean"] == pytest.approx(scores.tail(FORM_WINDOW).mean())
+        assert row["ewma"] == pytest.approx(scores.ewm(alpha=FORM_EWMA_ALPHA, adjust=False).mean().iloc[-1])
+        assert row["season_mean"] == pytest.approx(scores[df.loc[scores.index, "season_year"] == last_season].mean())
+
+
+def test_only_new_and_changed_races_are_fingerprinted(perf_merged, monkeypatch):
+    races = races_in_order(perf_merged)
+    engine = update_form(FormEngine(), perf_merged[perf_merged["session_key"] != races[-1]])
+    fingerprinted = []
+
+    def session_fingerprints(df, columns):
+        fingerprinted.append(set(df["session_key"]))
+        return form_session_fingerprints(df, columns)
+
+    form_session_fingerprints = form.session_fingerprints
+    monkeypatch.setattr(form, "session_fingerprints", session_fingerprints)
+    update_form(engine, perf_merged, changed_sessions=[races[0]])
+    assert fingerprinted == [{races[0], races[-1]}]
+
+
+def test_changed_or_removed_races_rebuild_the_form(perf_merged):
+    races = races_in_order(perf_merged)
+    engine = update_form(FormEngine(), perf_merged)
+    edited = perf_merged.copy()
+    edited.loc[edited["session_key"] == races[2], "weighted_score"] += 1.0
+    expected = form_table(update_form(FormEngine(), edited))
+
+    # Not checked unless named, or when the caller cannot tell what changed
+    unchecked = update_form(FormEngine.from_dict(engine.to_dict()), edited, changed_sessions=[races[3]])
+    assert not form_table(unchecked).equals(expected)
+    for changed_sessions in [[races[2]], None]:
+        rebuilt = update_form(FormEngine.from_dict(engine.to_dict()), edited, changed_sessions=changed_sessions)
+        pd.testing.assert_frame_equal(form_table(rebuilt), expected)
+
+    without_race = perf_merged[perf_merged["session_key"] != races[2]]
+    rebuilt = update_form(FormEngine.from_dict(engine.to_dict()), without_race, changed_sessions=[])
+    assert races[2] not in [int(key) for key in rebuilt.races]
+    pd.testing.assert_frame_equal(form_table(rebuilt), form_table(update_form(FormEngine(), without_race)))
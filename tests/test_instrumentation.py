@@ -0,0 +1,32 @@
+import itertools
+
+import pytest
+
+import instrumentation
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    monkeypatch.setattr(instrumentation, "_enabled", True)
+    instrumentation.reset()
+    yield
+    instrumentation.reset()
+
+
+def test_stages_report_their_own_peak_rss_increase(metrics, monkeypatch):
+    # Process peaks in MB as the OS would report them at the start and end of each stage
+    peaks = itertools.chain([100, 400, 400, 420, 420], itertools.repeat(420))
+    monkeypatch.setattr(instrumentation, "peak_rss_bytes", lambda: next(peaks) * 2 ** 20)
+    with instrumentation.stage("load"):
+        pass
+    with instrumentation.stage("score"):
+        pass
+    # Stays below the peak the load stage reached
+    with instrumentation.stage("export"):
+        pass
+    stages = instrumentation.report()["stages"]
+    assert stages["load"]["peak_rss_increase_bytes"] == 300 * 2 ** 20
+    assert stages["score"]["peak_rss_increase_bytes"] == 20 * 2 ** 20
+    assert stages["export"]["peak_rss_increase_bytes"] == 0
+    assert stages["export"]["process_peak_rss_bytes"] == 420 * 2 ** 20
+    assert 'f1_stage_peak_rss_increase_bytes{stage="load"} 314572800' in instrumentation.prometheus_text()
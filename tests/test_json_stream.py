@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from json_stream import decode_chunks, iter_json_array
+from position_stream import scan_positions
+from query_race_stats import summarize_positions
+
+DOCUMENTS = [
+    "[]",
+    " \n[ ]\n",
+    '[{"driver_number": 1, "lap_duration": 91.234, "is_pit_out_lap": false, "segments": [[2049, 2051], [], [2064]]}]',
+    '[1, -2.5e-3, 10, true, false, null, "", [[[]]], {"a": {"b": [1, {"c": null}]}}]',
+    r'["quote \" inside", "backslash \\", "escaped \\\" then quote", "é中🏁", "tab\tnewline\n", "]", "[,{"]',
+    '[12345678901234567890, 3.141592653589793, 1e+300, 0, -0.0]',
+    '[{"team_name": "Red Bull Racing"},\n {"team_name": "Kick Sauber", "date": "2025-07-06T14:03:12.345000+00:00"}]',
+]
+
+
+def splits(text: str):
+    """Yields text as one chunk, in single characters, and in two chunks at every position."""
+    yield [text]
+    yield list(text)
+    for i in range(1, len(text)):
+        yield [text[:i], text[i:]]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_split_chunks_parse_like_json_loads(document):
+    expected = json.loads(document)
+    for chunks in splits(document):
+        assert list(iter_json_array(iter(chunks))) == expected, chunks
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_multibyte_characters_split_across_byte_chunks(document):
+    data = document.encode("utf-8")
+    for size in [1, 2, 3, 5]:
+        chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        assert list(iter_json_array(decode_chunks(chunks))) == json.loads(document)
+
+
+@pytest.mark.parametrize("document", ["", "  ", '{"a": 1}', "[1, 2", '[{"a": 1}', '["open', "[1, 2,", "[3x]"])
+def test_incomplete_or_non_array_input_raises(document):
+    for chunks in splits(document) if document else [[]]:
+        with pytest.raises(ValueError):
+            list(iter_json_array(iter(chunks)))
+
+
+def test_elements_are_yielded_before_the_body_ends():
+    def chunks():
+        yield '[{"a": 1}, {"b":'
+        yield ' 2}, 3'
+        raise AssertionError("read past what was needed")
+
+    elements = iter_json_array(chunks())
+    assert next(elements) == {"a": 1}
+    assert next(elements) == {"b": 2}
+
+
+def test_streamed_positions_match_the_batch_summary():
+    positions = [{"driver_number": driver_number, "date": f"2025-07-06T14:{minute:02d}:00+00:00", "position": position}
+                 for minute in range(0, 60, 5) for driver_number, position in [(1, 1 + minute % 3), (4, 3), (81, 2)]]
+    text = json.dumps(positions)
+    chunks = [text[i:i + 7] for i in range(0, len(text), 7)]
+    df_positions, _ = scan_positions(iter_json_array(iter(chunks)))
+    expected = summarize_positions(positions)
+    assert df_positions["grid_position"].tolist() == expected["grid_position"].tolist()
+    assert df_positions["final_position"].tolist() == expected["final_position"].tolist()
@@ -0,0 +1,35 @@
+import numpy as np
+
+import performance_rating
+from live_race import LiveSession
+from query_race_stats import summarize_laps, summarize_positions
+from replay_server import replay_live
+from synthetic_data import generate_session_recording
+
+
+def test_replayed_standings_match_the_batch_summaries():
+    recording = generate_session_recording(drivers=6, laps=8)
+    # The race's hour and a half of records, replayed in about half a second
+    session = replay_live(recording, speed=10000.0, interval=0.05)
+    standings = session.standings.set_index("driver_number").sort_index()
+    expected = summarize_laps(recording["laps"]).join(summarize_positions(recording["position"])).sort_index()
+    assert list(standings.index) == list(expected.index)
+    assert (standings["laps"] == 8).all()
+    for col in ["best_lap_time", "avg_lap_time", "grid_position", "final_position"]:
+        np.testing.assert_allclose(standings[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float))
+    # Scored like any other session
+    df_scored = performance_rating.rate_driver_performance(session.table())
+    np.testing.assert_allclose(standings["weighted_score"], df_scored.set_index("driver_number").sort_index()["weighted_score"])
+
+
+def test_score_ignores_weighted_metrics_the_live_table_lacks(monkeypatch):
+    session = LiveSession(1, client=None)
+    session.apply(
+        [{"driver_number": n, "lap_number": 1, "lap_duration": 90.0 + n, "date_start": "2025-01-01T12:00:00+00:00"} for n in [1, 4]],
+        [{"driver_number": n, "date": "2025-01-01T12:00:00+00:00", "position": p} for n, p in [(1, 1), (4, 2)]],
+    )
+    monkeypatch.setitem(performance_rating.SCORE_WEIGHTS, "median_lap_time", 1.0)
+    df = session.score()
+    assert "score_median_lap_time" not in df.columns
+    # Both drivers gained no places, and equal values all score 1
+    assert df["weighted_score"].tolist() == [5.0, 1.0]
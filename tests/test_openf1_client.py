@@ -0,0 +1,91 @@
+import json
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from openf1_client import OpenF1Client
+
+LATENCY = 0.2
+
+
+def echo(latency: float = 0.0):
+    """Responds to every request with [{"path": ..., **query}] after latency seconds."""
+    def respond(request):
+        time.sleep(latency)
+        url = urlsplit(request["path"])
+        return 200, {"Content-Type": "application/json"}, json.dumps([{"path": url.path, **dict(parse_qsl(url.query))}]).encode()
+    return respond
+
+
+def calls(n: int) -> list:
+    return [("laps", {"session_key": str(i)}) for i in range(n)]
+
+
+def test_fetch_many_is_concurrent_and_ordered(stub_server):
+    server = stub_server(echo(LATENCY))
+    client = OpenF1Client(base_url=server.url, rate_limits=[], max_workers=4)
+    start = time.monotonic()
+    results = client.fetch_many(calls(8))
+    elapsed = time.monotonic() - start
+    assert [r[0]["session_key"] for r in results] == [str(i) for i in range(8)]
+    # Sequential fetching takes 8 * LATENCY; four workers take about 2 * LATENCY
+    assert elapsed < 8 * LATENCY / 2
+    assert len(server.requests) == 8
+
+
+@pytest.mark.parametrize("rate, capacity", [(10.0, 2), (20.0, 5)])
+def test_requests_respect_token_bucket(stub_server, rate, capacity):
+    server = stub_server(echo())
+    client = OpenF1Client(base_url=server.url, rate_limits=[(rate, capacity)], max_workers=4)
+    n = 12
+    client.fetch_many(calls(n))
+    times = sorted(r["time"] for r in server.requests)
+    assert len(times) == n
+    # Any span of requests holds at most the burst plus what refills over the span
+    slack = 0.02
+    for i in range(n):
+        for j in range(i + 1, n):
+            assert j - i + 1 <= capacity + rate * (times[j] - times[i] + slack)
+    assert times[-1] - times[0] >= (n - capacity) / rate - slack
+
+
+def test_tightest_of_several_buckets_applies(stub_server):
+    server = stub_server(echo())
+    client = OpenF1Client(base_url=server.url, rate_limits=[(100.0, 10), (5.0, 1)], max_workers=4)
+    client.fetch_many(calls(4))
+    times = sorted(r["time"] for r in server.requests)
+    assert times[-1] - times[0] >= 3 / 5.0 - 0.02
+
+
+def test_429_is_retried_after_retry_after(stub_server):
+    ok = echo()
+
+    def respond(request):
+        if len(server.requests) == 1:
+            return 429, {"Retry-After": "0.3"}, b""
+        return ok(request)
+
+    server = stub_server(respond)
+    client = OpenF1Client(base_url=server.url, rate_limits=[], max_retries=2)
+    assert client.get_json("laps", {"session_key": 1}) == [{"path": "/laps", "session_key": "1"}]
+    assert len(server.requests) == 2
+    assert server.requests[1]["time"] - server.requests[0]["time"] >= 0.3
+
+
+def test_429_pauses_workers_already_waiting_for_a_token(stub_server):
+    ok = echo()
+
+    def respond(request):
+        if len(server.requests) == 1:
+            return 429, {"Retry-After": "1"}, b""
+        return ok(request)
+
+    server = stub_server(respond)
+    client = OpenF1Client(base_url=server.url, rate_limits=[(5.0, 1)], max_workers=4, max_retries=2)
+    results = client.fetch_many(calls(4))
+    assert [r[0]["session_key"] for r in results] == [str(i) for i in range(4)]
+    times = sorted(r["time"] for r in server.requests)
+    assert len(times) == 5
+    # The other three workers were queued on the bucket when the 429 came, and must wait it out too
+    assert all(t - times[0] >= 1.0 for t in times[1:])
@@ -0,0 +1,114 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+from perf_query import PerfQuery, start_server
+
+TEAMS = {1: "Red Bull Racing", 4: "McLaren", 16: "Ferrari"}
+
+
+def perf_rows(bonus: float = 0.0) -> pd.DataFrame:
+    # Two seasons of two races with three drivers; McLaren upgrades at the 2025 Monaco race only
+    rows = []
+    for season_year in [2024, 2025]:
+        for race_number, race_location in [(1, "Bahrain"), (2, "Monaco")]:
+            for final_position, driver_number in enumerate([4, 1, 16], start=1):
+                upgraded = (season_year, race_number, driver_number) == (2025, 2, 4)
+                rows.append({
+                    "session_key": season_year * 10 + race_number, "driver_number": driver_number,
+                    "season_year": season_year, "race_number": race_number, "race_location": race_location,
+                    "team_name_mapped": TEAMS[driver_number], "final_position": final_position,
+                    "weighted_score": 5.0 - final_position + race_number / 10 + (bonus if driver_number == 16 else 0.0),
+                    "upgrade_count": 2 if upgraded else 0,
+                })
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def source(tmp_path) -> str:
+    path = str(tmp_path / "perf.csv")
+    perf_rows().to_csv(path, index=False)
+    return path
+
+
+def keys(rows: list) -> list:
+    return [(row["session_key"], row["driver_number"]) for row in rows]
+
+
+def test_index_lookups(source):
+    perf_query = PerfQuery([source])
+    assert keys(perf_query.query(driver_number=4)) == [(20241, 4), (20242, 4), (20251, 4), (20252, 4)]
+    assert keys(perf_query.query(season_year=2025, race_number=2)) == [(20252, 4), (20252, 1), (20252, 16)]
+    assert len(perf_query.query(season_year=2024)) == 6
+    assert keys(perf_query.query(race_location="Monaco", team_name_mapped="Ferrari")) == [(20242, 16), (20252, 16)]
+    assert perf_query.query(driver_number=44) == []
+    assert len(perf_query.query()) == 12
+    with pytest.raises(ValueError, match="needs a season_year"):
+        perf_query.query(race_number=1)
+    with pytest.raises(ValueError, match="Unknown filters"):
+        perf_query.query(driver="4")
+
+
+def test_upgraded_sort_and_limit(source):
+    perf_query = PerfQuery([source])
+    assert keys(perf_query.query(upgraded=True)) == [(20252, 4)]
+    assert keys(perf_query.query(team_name_mapped="McLaren", upgraded=True, season_year=2024)) == []
+    assert keys(perf_query.query(season_year=2025, sort="-weighted_score", limit=2)) == [(20252, 4), (20251, 4)]
+    assert keys(perf_query.query(race_location="Bahrain", sort="weighted_score", limit=1)) == [(20241, 16)]
+    assert perf_query.query(limit=0) == []
+    with pytest.raises(ValueError, match="negative"):
+        perf_query.query(limit=-1)
+    with pytest.raises(ValueError, match="Cannot sort"):
+        perf_query.query(sort="driver_name")
+
+
+def test_reloads_when_a_source_changes(source):
+    perf_query = PerfQuery([source])
+    first = perf_query.query(race_location="Monaco", sort="-weighted_score", limit=1)
+    assert keys(first) == [(20242, 4)]
+    assert perf_query.query(race_location="Monaco", sort="-weighted_score", limit=1) is first
+    assert perf_query.info()["cached_queries"] == 1
+
+    perf_rows(bonus=10.0).to_csv(source, index=False)
+    # On a filesystem with coarse timestamps the rewrite could keep the old modification time
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert keys(perf_query.query(race_location="Monaco", sort="-weighted_score", limit=1)) == [(20242, 16)]
+    assert perf_query.info()["cached_queries"] == 1
+
+
+def get(url: str):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_server_answers_queries_and_errors(source, tmp_path):
+    server = start_server(PerfQuery([source]), port=0)
+    try:
+        status, body = get(f"{server.base_url}/query?team_name_mapped=McLaren&upgraded=true")
+        assert status == 200 and body["count"] == 1 and body["rows"][0]["upgrade_count"] == 2
+        status, body = get(f"{server.base_url}/status")
+        assert status == 200 and body["rows"] == 12 and body["source"] == source
+        for query in ["limit=-1", "driver=4", "sort=driver_name", "race_number=1"]:
+            status, body = get(f"{server.base_url}/query?{query}")
+            assert status == 400 and body["error"]
+        status, body = get(f"{server.base_url}/standings")
+        assert status == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    missing = start_server(PerfQuery([str(tmp_path / "missing.csv")]), port=0)
+    try:
+        status, body = get(f"{missing.base_url}/query")
+        assert status == 503 and "missing.csv" in body["error"]
+    finally:
+        missing.shutdown()
+        missing.server_close()
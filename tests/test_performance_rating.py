@@ -0,0 +1,103 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from performance_rating import (
+    SCORE_DIRECTIONS,
+    SCORE_WEIGHTS,
+    add_normalized_score_column,
+    add_normalized_score_columns,
+    find_changed_sessions,
+    load_previous_scores,
+    rate_driver_performance,
+    rate_driver_performance_incremental,
+    rescore_if_stale,
+    save_scores,
+)
+
+
+def driver_stats() -> pd.DataFrame:
+    # Session 2 has every driver on the same best lap time, and session 3 a single driver
+    return pd.DataFrame({
+        "session_key": [1, 1, 1, 2, 2, 2, 3],
+        "driver_number": [1, 4, 16, 1, 4, 16, 1],
+        "best_lap_time": [90.1, 90.4, 91.0, 80.0, 80.0, 80.0, 75.5],
+        "avg_lap_time": [92.0, 93.5, 92.7, 82.0, 81.5, 83.0, 77.0],
+        "position_change": [2, -1, 0, 0, 3, -3, 1],
+        "final_position": [1, 3, 2, 2, 1, 3, 1],
+    })
+
+
+def test_matches_per_column_scores():
+    df = driver_stats()
+    scored = add_normalized_score_columns(df)
+    for col in SCORE_WEIGHTS:
+        expected = add_normalized_score_column(df, col, SCORE_DIRECTIONS[col])[f"score_{col}"]
+        np.testing.assert_allclose(scored[f"score_{col}"].to_numpy(), expected.to_numpy(), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("higher_is_better", [True, False])
+def test_equal_values_fall_back_like_per_column(higher_is_better):
+    df = driver_stats()
+    scored = add_normalized_score_columns(df, {"best_lap_time": higher_is_better})
+    expected = add_normalized_score_column(df, "best_lap_time", higher_is_better)["score_best_lap_time"]
+    assert scored["score_best_lap_time"].tolist() == expected.tolist()
+    fallback = 1.0 if higher_is_better else 0.0
+    assert scored.loc[df["session_key"].isin([2, 3]), "score_best_lap_time"].eq(fallback).all()
+
+
+def test_compact_dtypes_and_input_unchanged():
+    df = driver_stats().astype({"driver_number": "int8", "position_change": "Int8", "final_position": "Int8"})
+    original = df.copy()
+    scored = add_normalized_score_columns(df)
+    pd.testing.assert_frame_equal(df, original)
+    expected = add_normalized_score_column(driver_stats(), "final_position", False)["score_final_position"]
+    np.testing.assert_allclose(scored["score_final_position"].to_numpy(), expected.to_numpy())
+
+
+def test_duplicate_rows_raise():
+    df = pd.concat([driver_stats(), driver_stats().iloc[[0]]], ignore_index=True)
+    with pytest.raises(ValueError, match="session_key=1, driver_number=1"):
+        add_normalized_score_columns(df)
+
+
+def test_incremental_rescores_after_direction_change(tmp_path, monkeypatch):
+    df = driver_stats()
+    path, params_path = str(tmp_path / "perf.csv"), str(tmp_path / "params.json")
+    save_scores(rate_driver_performance(df), path, params_path)
+    df_prev, prev_params = load_previous_scores(path, params_path)
+    unchanged = rate_driver_performance_incremental(df, df_prev, prev_params)
+    np.testing.assert_allclose(unchanged["weighted_score"], rate_driver_performance(df)["weighted_score"])
+
+    monkeypatch.setitem(SCORE_DIRECTIONS, "position_change", False)
+    rescored = rate_driver_performance_incremental(df, df_prev, prev_params)
+    np.testing.assert_allclose(rescored["score_position_change"], rate_driver_performance(df)["score_position_change"])
+    assert not np.allclose(rescored["score_position_change"], df_prev["score_position_change"])
+
+
+def test_previous_scores_without_params_are_rescored(tmp_path):
+    df = driver_stats()
+    path = str(tmp_path / "perf.csv")
+    stale = rate_driver_performance(df)
+    stale["score_final_position"] = 0.0
+    stale.to_csv(path, index=False)
+    df_prev, prev_params = load_previous_scores(path, str(tmp_path / "missing.json"))
+    assert prev_params is None
+    expected = rate_driver_performance(df)["score_final_position"]
+    np.testing.assert_allclose(rate_driver_performance_incremental(df, df_prev, prev_params)["score_final_position"], expected)
+    np.testing.assert_allclose(rescore_if_stale(df_prev, prev_params)["score_final_position"], expected)
+
+
+def test_changed_sessions_compare_categoricals_by_value():
+    df_stats = driver_stats().assign(team_name_mapped=pd.Categorical(["A", "B", "C", "A", "B", "C", "A"]))
+    # Scored in a run over more seasons, so with a team this run does not have
+    df_other = driver_stats().iloc[[0]].assign(session_key=4, team_name_mapped="D")
+    df_prev = rate_driver_performance(pd.concat([df_stats, df_other], ignore_index=True))
+    df_prev = df_prev.astype({"team_name_mapped": "category"})
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert find_changed_sessions(df_stats, df_prev) == set()
+        df_stats.loc[3, "team_name_mapped"] = "C"
+        assert find_changed_sessions(df_stats, df_prev) == {2}
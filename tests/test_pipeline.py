@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import performance_rating
+import pipeline
+import stats_store
+from common import CACHE_FILE_DRIVER_PERF, CACHE_FILE_FIA_DOCS, DATA_FILE_UPGRADES
+from stats_store import DriverStatsStore
+from synthetic_data import generate_dataset
+
+SCORE_COLUMNS = [f"score_{col}" for col in performance_rating.SCORE_WEIGHTS]
+
+
+@pytest.fixture
+def pipeline_dir(tmp_path, monkeypatch):
+    """A working directory holding a driver stats store and upgrade inputs for two synthetic seasons."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    data = generate_dataset(seasons=2, races=4, drivers=6, laps=10)
+    store = DriverStatsStore()
+    store.upsert(data["stats"].to_dict("records"))
+    store.close()
+    data["upgrades"].to_excel(DATA_FILE_UPGRADES, index=False)
+    data["fia_docs"].to_csv(CACHE_FILE_FIA_DOCS, index=False)
+    monkeypatch.setattr(pipeline.upgrade_correlation, "RESAMPLES", 50)
+    return data
+
+
+def read_scores() -> pd.DataFrame:
+    return pd.read_csv(CACHE_FILE_DRIVER_PERF).sort_values(["session_key", "driver_number"], ignore_index=True)
+
+
+def test_force_rescores_every_session(pipeline_dir):
+    pipeline.run()
+    expected = read_scores()
+    tampered = expected.copy()
+    tampered[SCORE_COLUMNS] = 0.0
+    tampered.to_csv(CACHE_FILE_DRIVER_PERF, index=False)
+
+    results = pipeline.run(force=True)
+    assert results["rating"] == "ran"
+    np.testing.assert_allclose(read_scores()[SCORE_COLUMNS].to_numpy(), expected[SCORE_COLUMNS].to_numpy())
+
+
+def test_forced_season_keeps_other_seasons(pipeline_dir):
+    pipeline.run()
+    seasons = sorted(int(season) for season in pipeline_dir["stats"]["season_year"].unique())
+    pipeline.run(force=True, season_years=seasons[-1:])
+    assert sorted(read_scores()["season_year"].unique()) == seasons
+
+
+def test_direction_change_rescores_every_session(pipeline_dir, monkeypatch):
+    pipeline.run()
+    before = read_scores()
+    monkeypatch.setitem(performance_rating.SCORE_DIRECTIONS, "position_change", False)
+    pipeline.run()
+    after = read_scores()
+    np.testing.assert_allclose(after["score_position_change"], 1.0 - before["score_position_change"])
+
+
+def test_direction_change_rescores_seasons_outside_the_run(pipeline_dir, monkeypatch):
+    pipeline.run()
+    before = read_scores()
+    last_season = int(pipeline_dir["stats"]["season_year"].max())
+    monkeypatch.setitem(performance_rating.SCORE_DIRECTIONS, "position_change", False)
+    pipeline.run(season_years=[last_season])
+    after = read_scores()
+    np.testing.assert_allclose(after["score_position_change"], 1.0 - before["score_position_change"])
+
+
+def test_restricted_run_only_opens_its_shard(pipeline_dir, monkeypatch):
+    pipeline.run()
+    last_season = int(pipeline_dir["stats"]["season_year"].max())
+    opened = []
+    connect = stats_store.sqlite3.connect
+    monkeypatch.setattr(stats_store.sqlite3, "connect", lambda path, *args, **kwargs: opened.append(path) or connect(path, *args, **kwargs))
+    # A new mapping re-runs the tidy stage, which writes to the store and refreshes the CSV export
+    monkeypatch.setitem(pipeline.tidy_race_stats.TEAM_NAME_MAPPING, "Another Team", "Another")
+    results = pipeline.run(season_years=[last_season])
+    assert results["tidy"] == "ran" and results["rating"] == "ran"
+    assert set(opened) == {stats_store.shard_path(last_season)}
@@ -0,0 +1,35 @@
+import warnings
+
+import pandas as pd
+import pytest
+
+from process_upgrades import index_fia_docs, index_upgrades, set_unique_index, update_perf_with_upgrades
+
+
+def test_set_unique_index_names_duplicates():
+    df = pd.DataFrame({"season_year": [2025, 2025, 2025], "race_number": [1, 1, 2], "team_name_mapped": ["A", "A", "A"]})
+    with pytest.raises(ValueError, match=r"duplicate keys: \[\(2025, 1, 'A'\)\]"):
+        set_unique_index(df, ["season_year", "race_number", "team_name_mapped"])
+    indexed = set_unique_index(df.iloc[1:], ["season_year", "race_number"], drop=False)
+    assert list(indexed.columns) == ["season_year", "race_number", "team_name_mapped"]
+
+
+def test_duplicate_fia_docs_and_upgrades_raise():
+    with pytest.raises(ValueError, match="duplicate keys: \\['a.pdf'\\]"):
+        index_fia_docs(pd.DataFrame({"Filename": ["a.pdf", "a.pdf", None], "season_year": [2025, 2025, 2025]}))
+    upgrades = pd.DataFrame({"season_year": [2025, 2025], "race_number": [3, 3], "team_name_mapped": ["McLaren"] * 2,
+                             "upgrade_count": [1, 2]})
+    with pytest.raises(ValueError, match="duplicate keys"):
+        index_upgrades(upgrades)
+
+
+def test_update_does_not_warn():
+    df_perf = pd.DataFrame({"session_key": [1, 1], "driver_number": [4, 81], "season_year": [2025, 2025],
+                            "race_number": [1, 1], "team_name_mapped": ["McLaren", "McLaren"], "weighted_score": [3.0, 2.5]})
+    upgrades = pd.DataFrame({"season_year": [2025], "race_number": [1], "team_name_mapped": ["McLaren"], "upgrade_count": [2]})
+    df_first, _ = update_perf_with_upgrades(None, df_perf, upgrades)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        df_merged, changed = update_perf_with_upgrades(df_first, df_perf, upgrades)
+    assert changed == 0
+    assert df_merged["upgrade_count"].tolist() == [2, 2]
@@ -0,0 +1,97 @@
+import gzip
+import json
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from common import OPENF1_CACHE_PROVISIONAL_TTL, OPENF1_SESSION_SETTLE_SECONDS
+from openf1_client import OpenF1Client
+from response_cache import ResponseCache
+
+SESSIONS_PARAMS = {"year": datetime.now().year, "session_type": "Race"}
+
+
+def iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def age_entry(cache: ResponseCache, endpoint: str, params: dict, seconds: float):
+    """Rewrites a cached entry as if it had been fetched seconds earlier."""
+    path = cache.path(cache.key(endpoint, params))
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        entry = json.load(f)
+    entry["fetched_at"] -= seconds
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(entry, f)
+
+
+def json_server(stub_server, routes: dict):
+    def respond(request):
+        endpoint = request["path"].split("?")[0].rsplit("/", 1)[-1]
+        return 200, {"Content-Type": "application/json"}, json.dumps(routes[endpoint]).encode()
+    return stub_server(respond)
+
+
+def test_expired_entries_only_served_when_stale_allowed(tmp_path):
+    cache = ResponseCache(folder=str(tmp_path))
+    cache.put("sessions", SESSIONS_PARAMS, [{"session_key": 1}])
+    age_entry(cache, "sessions", SESSIONS_PARAMS, 2 * 60 * 60)
+    assert cache.get("sessions", SESSIONS_PARAMS) is None
+    assert cache.get("sessions", SESSIONS_PARAMS, allow_stale=True) == [{"session_key": 1}]
+    assert list(cache.iter_data("sessions", SESSIONS_PARAMS, allow_stale=True)) == [{"session_key": 1}]
+    assert cache.iter_data("sessions", SESSIONS_PARAMS) is None
+
+
+def test_entry_ttl_overrides_endpoint_ttl(tmp_path):
+    cache = ResponseCache(folder=str(tmp_path))
+    cache.put("laps", {"session_key": 1}, [{"lap_number": 1}], ttl=60)
+    writer = cache.open_writer("position", {"session_key": 1}, ttl=60)
+    writer.write(b'[{"position": 1}]')
+    writer.commit()
+    assert cache.get("laps", {"session_key": 1}) == [{"lap_number": 1}]
+    assert list(cache.iter_data("position", {"session_key": 1})) == [{"position": 1}]
+    age_entry(cache, "laps", {"session_key": 1}, 120)
+    age_entry(cache, "position", {"session_key": 1}, 120)
+    assert cache.get("laps", {"session_key": 1}) is None
+    assert cache.iter_data("position", {"session_key": 1}) is None
+
+
+def test_offline_client_serves_expired_sessions(tmp_path, stub_server):
+    server = json_server(stub_server, {"sessions": [{"session_key": 1}]})
+    cache = ResponseCache(folder=str(tmp_path))
+    OpenF1Client(base_url=server.url, rate_limits=[], cache=cache).get_json("sessions", SESSIONS_PARAMS)
+    age_entry(cache, "sessions", SESSIONS_PARAMS, 2 * 60 * 60)
+    offline = OpenF1Client(base_url=server.url, rate_limits=[], cache=cache, offline=True)
+    assert offline.get_json("sessions", SESSIONS_PARAMS) == [{"session_key": 1}]
+    with pytest.raises(LookupError):
+        offline.get_json("laps", {"session_key": 1})
+    assert len(server.requests) == 1
+
+
+def test_unsettled_and_empty_responses_expire(tmp_path, stub_server):
+    now = time.time()
+    sessions = [
+        {"session_key": 1, "date_end": iso(now - 30 * 24 * 60 * 60)},
+        {"session_key": 2, "date_end": iso(now - OPENF1_SESSION_SETTLE_SECONDS / 2)},
+        {"session_key": 3, "date_end": iso(now + 24 * 60 * 60)},
+    ]
+    server = json_server(stub_server, {"sessions": sessions, "laps": [{"lap_number": 1}], "position": []})
+    cache = ResponseCache(folder=str(tmp_path))
+    client = OpenF1Client(base_url=server.url, rate_limits=[], cache=cache)
+    client.get_json("sessions", SESSIONS_PARAMS)
+    for session_key in (1, 2, 3):
+        client.get_json("laps", {"session_key": session_key})
+        client.get_json("position", {"session_key": session_key})
+        list(client.stream_json("position", {"session_key": session_key, "driver_number": 1}))
+    for session_key in (1, 2, 3):
+        age_entry(cache, "laps", {"session_key": session_key}, OPENF1_CACHE_PROVISIONAL_TTL + 1)
+        age_entry(cache, "position", {"session_key": session_key}, OPENF1_CACHE_PROVISIONAL_TTL + 1)
+        age_entry(cache, "position", {"session_key": session_key, "driver_number": 1}, OPENF1_CACHE_PROVISIONAL_TTL + 1)
+    # Only the laps of the session that ended long ago are final
+    assert cache.get("laps", {"session_key": 1}) == [{"lap_number": 1}]
+    assert cache.get("laps", {"session_key": 2}) is None
+    assert cache.get("laps", {"session_key": 3}) is None
+    for session_key in (1, 2, 3):
+        assert cache.get("position", {"session_key": session_key}) is None
+        assert cache.iter_data("position", {"session_key": session_key, "driver_number": 1}) is None
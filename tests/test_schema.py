@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+import schema
+from schema import apply_schema, parquet_copy_path, read_csv_typed, write_csv_typed
+from synthetic_data import generate_dataset
+
+
+@pytest.fixture
+def stats() -> pd.DataFrame:
+    return apply_schema(generate_dataset(seasons=1, races=3, drivers=4, laps=5)["stats"])
+
+
+def test_unchanged_csv_is_read_from_its_parquet_copy(tmp_path, monkeypatch, stats):
+    path = str(tmp_path / "stats.csv")
+    write_csv_typed(stats, path)
+    from_csv = read_csv_typed(path, float_precision="round_trip")
+    monkeypatch.setattr(schema.pd, "read_csv", lambda *args, **kwargs: pytest.fail("parsed the CSV"))
+    from_parquet = read_csv_typed(path)
+    pd.testing.assert_frame_equal(from_parquet, stats)
+    pd.testing.assert_frame_equal(from_parquet, from_csv)
+    assert from_parquet.attrs == {}
+
+
+def test_edited_csv_is_parsed_again(tmp_path, stats):
+    path = str(tmp_path / "stats.csv")
+    write_csv_typed(stats, path)
+    edited = stats.copy()
+    edited.loc[0, "final_position"] = 20
+    # Written by hand, without updating the Parquet copy
+    edited.to_csv(path, index=False)
+    assert read_csv_typed(path)["final_position"].iloc[0] == 20
+
+
+def test_unwritable_parquet_copy_is_removed(tmp_path, stats):
+    path = str(tmp_path / "stats.csv")
+    write_csv_typed(stats, path)
+    # A column mixing numbers and text cannot be stored as Parquet
+    write_csv_typed(stats.assign(note=[1, "a"] * (len(stats) // 2)), path)
+    assert not (tmp_path / "stats.parquet").exists()
+    assert parquet_copy_path(path) == str(tmp_path / "stats.parquet")
+    assert read_csv_typed(path)["note"].tolist()[:2] == ["1", "a"]
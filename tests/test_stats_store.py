@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+import stats_store
+import tidy_race_stats
+from stats_store import DriverStatsStore
+from synthetic_data import generate_dataset
+
+
+@pytest.fixture
+def store(tmp_path):
+    data = generate_dataset(seasons=3, races=3, drivers=4, laps=5)
+    store = DriverStatsStore(folder=str(tmp_path / "stats"), csv_path=str(tmp_path / "stats.csv"), legacy_path=None)
+    store.upsert(data["stats"])
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def opened_shards(monkeypatch):
+    """Records the path of every shard opened from now on."""
+    opened = []
+    connect = sqlite3.connect
+
+    def recording_connect(path, *args, **kwargs):
+        opened.append(str(path))
+        return connect(path, *args, **kwargs)
+
+    monkeypatch.setattr(stats_store.sqlite3, "connect", recording_connect)
+    return opened
+
+
+def read_text(path) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def test_season_export_matches_full_export(store, tmp_path, opened_shards):
+    full_path = str(tmp_path / "full.csv")
+    store.export_csv()
+    seasons = store.seasons()
+    # Change the last season, then refresh only it in the export
+    store.upsert([{"season_year": seasons[-1], "session_key": key, "driver_number": number, "driver_surname": "NEW"}
+                  for key, number in store.cached_keys(season_years=seasons[-1:])])
+    store.close()
+    reopened = DriverStatsStore(folder=store.path, csv_path=store.csv_path, legacy_path=None)
+    opened_shards.clear()
+    reopened.export_csv(season_years=seasons[-1:])
+    assert opened_shards == [stats_store.shard_path(seasons[-1], store.path)]
+    reopened.export_csv(full_path)
+    assert read_text(store.csv_path) == read_text(full_path)
+    reopened.close()
+
+
+def test_tidy_of_one_season_only_opens_its_shard(tmp_path, monkeypatch, opened_shards):
+    data = generate_dataset(seasons=3, races=3, drivers=4, laps=5)
+    folder, csv_path = str(tmp_path / "stats"), str(tmp_path / "stats.csv")
+    store = DriverStatsStore(folder=folder, csv_path=csv_path, legacy_path=None)
+    store.upsert(data["stats"])
+    store.export_csv()
+    store.close()
+    monkeypatch.setattr(tidy_race_stats, "CACHE_FILE_DRIVER_STATS", csv_path)
+    monkeypatch.setattr(tidy_race_stats, "DriverStatsStore",
+                        lambda: DriverStatsStore(folder=folder, csv_path=csv_path, legacy_path=None))
+    season = int(data["stats"]["season_year"].max())
+    opened_shards.clear()
+    tidy_race_stats.main(season_years=[season])
+    assert set(opened_shards) == {stats_store.shard_path(season, folder)}
+    reopened = DriverStatsStore(folder=folder, csv_path=csv_path, legacy_path=None)
+    assert reopened.read()["driver_surname"].notna().sum() == (data["stats"]["season_year"] == season).sum()
+    reopened.export_csv(str(tmp_path / "full.csv"))
+    assert read_text(csv_path) == read_text(tmp_path / "full.csv")
+    reopened.close()
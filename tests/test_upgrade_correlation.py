@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from upgrade_correlation import analyze_upgrades, team_race_deltas
+
+
+def perf_merged(upgrades_2024: bool) -> pd.DataFrame:
+    # Two teams over four races in each of two seasons, with upgrades only known for 2025 unless upgrades_2024
+    rows = []
+    for season_year in [2024, 2025]:
+        for race_number in range(1, 5):
+            for team, offset in [("McLaren", 0.5), ("Ferrari", 0.0)]:
+                upgraded = race_number % 2 == 0 and team == "McLaren"
+                known = season_year == 2025 or upgrades_2024
+                rows.append({
+                    "season_year": season_year, "race_number": race_number, "session_key": season_year * 10 + race_number,
+                    "date": f"{season_year}-0{race_number}-01", "team_name_mapped": team,
+                    "weighted_score": race_number * 0.1 + offset + (0.3 if upgraded else 0.0),
+                    "upgrade_count": (2 if upgraded else 0) if known and upgraded else np.nan,
+                    "circuit_specific_any": False if known and upgraded else np.nan,
+                })
+    return pd.DataFrame(rows)
+
+
+def test_seasons_without_upgrade_data_are_left_out():
+    df_deltas = team_race_deltas(perf_merged(upgrades_2024=False))
+    assert df_deltas["season_year"].unique().tolist() == [2025]
+    assert df_deltas["upgrade_count"].tolist() == [0, 0, 0, 0, 0, 2, 0, 2]
+
+    df = analyze_upgrades(perf_merged(upgrades_2024=False), resamples=50)
+    assert df.loc[df["scope"] == "season", "season_year"].unique().tolist() == [2025]
+    assert df.loc[df["scope"] == "all", "n"].unique().tolist() == [6]
+
+
+def test_seasons_with_upgrade_data_count_races_without_upgrades():
+    df_deltas = team_race_deltas(perf_merged(upgrades_2024=True))
+    assert df_deltas["season_year"].unique().tolist() == [2024, 2025]
+    assert (df_deltas.groupby("season_year")["upgrade_count"].sum() == 4).all()
@@ -6,7 +6,10 @@ next function.  Smarter prompting could undoubtedly have got it to write more fu
 
 import pandas as pd
 import logging
+import instrumentation
 from common import CACHE_FILE_DRIVER_STATS, setup_logging
+from schema import map_categories
+from stats_store import DriverStatsStore
 
 # Configuration dictionary for team name mapping
 TEAM_NAME_MAPPING = {
@@ -16,14 +19,19 @@ TEAM_NAME_MAPPING = {
 }
 
 
+def _surname(driver_name: str) -> str:
+    words = driver_name.split()
+    return words[-1] if words else None
+
+
 def add_driver_surname_column(df: pd.DataFrame) -> pd.DataFrame:
     """
     Returns a new DataFrame with an added 'driver_surname' column,
     containing the last word from the 'driver_name' column.
-    The input DataFrame is not modified.
+    The input DataFrame is not modified, and its columns are shared with the result rather than copied.
     """
-    df_copy = df.copy()
-    df_copy["driver_surname"] = df_copy["driver_name"].str.split().str[-1]
+    df_copy = df.copy(deep=False)
+    df_copy["driver_surname"] = map_categories(df["driver_name"], _surname)
     return df_copy
 
 
@@ -32,27 +40,49 @@ def add_team_name_mapped_column(df: pd.DataFrame) -> pd.DataFrame:
     Returns a new DataFrame with an added 'team_name_mapped' column,
     mapping values from 'team_name' using TEAM_NAME_MAPPING.
     If a team name is not in the mapping, the original value is used.
-    The input DataFrame is not modified.
+    The input DataFrame is not modified, and its columns are shared with the result rather than copied.
     """
-    df_copy = df.copy()
-    df_copy["team_name_mapped"] = df_copy["team_name"].map(TEAM_NAME_MAPPING).fillna(df_copy["team_name"])
+    df_copy = df.copy(deep=False)
+    df_copy["team_name_mapped"] = map_categories(df["team_name"], lambda team: TEAM_NAME_MAPPING.get(team, team))
     return df_copy
 
 
-def main():
-    setup_logging()
-    logging.info(f"Loading dataframe from {CACHE_FILE_DRIVER_STATS}")
-    df = pd.read_csv(CACHE_FILE_DRIVER_STATS)
-    logging.info(f"Loaded dataframe shape: {df.shape}")
+# Columns added by this stage
+TIDY_COLUMNS = ["driver_surname", "team_name_mapped"]
 
+
+def tidy_driver_stats(df: pd.DataFrame) -> pd.DataFrame:
+    """Returns a new DataFrame with all of the tidy columns in TIDY_COLUMNS added."""
     df = add_driver_surname_column(df)
     logging.info(f"After add_driver_surname_column: {df.shape}")
 
     df = add_team_name_mapped_column(df)
     logging.info(f"After add_team_name_mapped_column: {df.shape}")
+    return df
+
+
+def save_tidy_columns(df: pd.DataFrame, store: DriverStatsStore):
+    """
+    Writes the tidy columns back to the driver stats store and refreshes those seasons in the CSV
+    export, touching only the shards of the seasons in df.
+    """
+    store.upsert(df[["season_year", "session_key", "driver_number"] + TIDY_COLUMNS])
+    store.export_csv(CACHE_FILE_DRIVER_STATS, season_years=sorted(int(season) for season in df["season_year"].unique()))
+    logging.info(f"Saved dataframe to {store.path} and {CACHE_FILE_DRIVER_STATS} with shape: {df.shape}")
+
+
+def main(season_years=None):
+    """Tidies the driver stats of every season, or only of season_years, in the store."""
+    setup_logging()
+    store = DriverStatsStore()
+    logging.info(f"Loading dataframe from {store.path}")
+    df = store.read(season_years=season_years)
+    logging.info(f"Loaded dataframe shape: {df.shape}")
 
-    df.to_csv(CACHE_FILE_DRIVER_STATS, index=False)
-    logging.info(f"Saved dataframe to {CACHE_FILE_DRIVER_STATS} with shape: {df.shape}")
+    with instrumentation.stage("tidy", rows=len(df)):
+        df = tidy_driver_stats(df)
+        save_tidy_columns(df, store)
+    store.close()
 
 
 if __name__ == "__main__":
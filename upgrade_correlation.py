@@ -0,0 +1,240 @@
+"""
+Tests whether the upgrades a team brings to a race go with a change in its performance.  Each team's race
+score is the mean weighted_score of its drivers, and its delta is the change from the team's previous race
+of the same season.  Only seasons with upgrade data are analyzed, as a race missing from the upgrades of a
+season without any says nothing about whether the team brought one.  For each predictor (upgrade_count, and whether any upgrade was circuit specific) the
+Pearson and Spearman correlations and the least-squares slope are computed over all races, per season and
+per team.  Confidence intervals come from bootstrap resamples and p-values from permutations of the deltas,
+drawn RESAMPLES at a time as NumPy index matrices (in blocks of at most RESAMPLE_BLOCK_ELEMENTS), so no
+Python loop runs per resample; the bootstrap statistics of a whole block come from one matrix product of
+the resample counts.  Groups can be spread across processes, and give the same results however
+they are run, as each draws from its own seeded generator.
+"""
+
+import argparse
+import logging
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+from common import setup_logging, OUTPUT_FILE_UPGRADE_CORRELATION
+from process_upgrades import load_perf_and_upgrades
+
+RESAMPLES = 10000
+SEED = 0
+CONFIDENCE = 0.95
+# Index matrix elements drawn at once, bounding memory at large sample sizes
+RESAMPLE_BLOCK_ELEMENTS = 2 ** 22
+# Groups with fewer team races are reported without statistics
+MIN_SAMPLES = 5
+PREDICTORS = ["upgrade_count", "circuit_specific_any"]
+STAT_COLUMNS = ["r", "r_ci_low", "r_ci_high", "spearman_r", "slope", "slope_ci_low", "slope_ci_high",
+                "intercept", "r_squared", "p_value", "mean_delta_upgraded", "mean_delta_not_upgraded"]
+
+
+def team_race_deltas(df_perf_merged: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns one row per team per race with the team's mean weighted_score, its change from the team's
+    previous race in the same season (score_delta) and the team's upgrades at the race.  Races are
+    ordered by date, as race numbers can repeat within a season.  Each team's first race of a season,
+    and races without a score, have no delta.  Seasons without any upgrade rows are left out; in the
+    others, a team race without upgrades has an upgrade_count of 0.
+    """
+    df = df_perf_merged[["season_year", "race_number", "session_key", "date", "team_name_mapped",
+                         "weighted_score", "upgrade_count", "circuit_specific_any"]]
+    df_teams = df.groupby(["season_year", "session_key", "team_name_mapped"], observed=True, sort=False).agg(
+        race_number=("race_number", "first"),
+        date=("date", "first"),
+        score=("weighted_score", "mean"),
+        upgrade_count=("upgrade_count", "max"),
+        circuit_specific_any=("circuit_specific_any", "max"),
+    ).reset_index()
+    covered = df_teams.groupby("season_year", observed=True)["upgrade_count"].transform("count") > 0
+    if not covered.all():
+        uncovered = sorted(int(season) for season in df_teams.loc[~covered, "season_year"].unique())
+        logging.warning(f"Leaving out seasons {uncovered}, which have no upgrade data")
+        df_teams = df_teams[covered]
+    df_teams["date"] = df_teams["date"].astype(str)
+    df_teams = df_teams.sort_values(["season_year", "team_name_mapped", "date", "session_key"], ignore_index=True)
+    df_teams["upgrade_count"] = df_teams["upgrade_count"].fillna(0).astype("int64")
+    df_teams["circuit_specific_any"] = df_teams["circuit_specific_any"].fillna(False).astype(bool)
+    df_teams["score_delta"] = df_teams.groupby(["season_year", "team_name_mapped"], observed=True)["score"].diff()
+    return df_teams
+
+
+def _resample_blocks(resamples: int, n: int):
+    block = max(1, RESAMPLE_BLOCK_ELEMENTS // n)
+    for start in range(0, resamples, block):
+        yield start, min(block, resamples - start)
+
+
+def _pearson_rows(xs: np.ndarray, ys: np.ndarray):
+    # Row-wise Pearson r and slope of y on x, for matrices of resampled values
+    xs = xs - xs.mean(axis=1, keepdims=True)
+    ys = ys - ys.mean(axis=1, keepdims=True)
+    sxy = np.einsum("ij,ij->i", xs, ys)
+    sxx = np.einsum("ij,ij->i", xs, xs)
+    syy = np.einsum("ij,ij->i", ys, ys)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sxy / np.sqrt(sxx * syy), sxy / sxx
+
+
+def bootstrap(x: np.ndarray, y: np.ndarray, resamples: int, rng: np.random.Generator):
+    """
+    Returns (r, slope) arrays of the Pearson correlation and slope of y on every column of x (rows are
+    samples) in each of resamples bootstrap resamples, with shape (resamples, predictors).  Every
+    predictor is resampled with the same indices.  Resamples in which a predictor is constant give NaN.
+    """
+    n, predictors = x.shape
+    xc = x - x.mean(axis=0)
+    yc = y - y.mean()
+    # The sums behind r and the slope, which a resample's counts of each sample give as one matrix product
+    features = np.column_stack([xc, yc, xc * yc[:, None], xc * xc, yc * yc])
+    tiny = 1e-12 * (xc * xc).mean(axis=0)
+    r = np.empty((resamples, predictors))
+    slope = np.empty((resamples, predictors))
+    for start, count in _resample_blocks(resamples, n):
+        idx = rng.integers(0, n, size=(count, n))
+        counts = np.bincount((idx + n * np.arange(count)[:, None]).ravel(), minlength=count * n).reshape(count, n)
+        means = (counts @ features) / n
+        mx, my = means[:, :predictors], means[:, [predictors]]
+        sxy = means[:, predictors + 1:2 * predictors + 1] - mx * my
+        sxx = means[:, 2 * predictors + 1:3 * predictors + 1] - mx * mx
+        syy = means[:, [-1]] - my * my
+        sxx = np.where(sxx > tiny, sxx, np.nan)
+        r[start:start + count] = sxy / np.sqrt(sxx * syy)
+        slope[start:start + count] = sxy / sxx
+    return r, slope
+
+
+def permutation_r(x: np.ndarray, y: np.ndarray, resamples: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Returns the Pearson correlation of every column of x with y under each of resamples random
+    permutations of y, with shape (resamples, predictors).  Permuting y leaves its mean and variance
+    unchanged, so each permutation only costs one matrix product with the centred predictors.
+    """
+    n = len(y)
+    xc = x - x.mean(axis=0)
+    yc = y - y.mean()
+    r = np.empty((resamples, x.shape[1]))
+    # A constant predictor has no correlation, and gives NaN
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = 1 / np.sqrt((xc * xc).sum(axis=0) * (yc @ yc))
+        for start, count in _resample_blocks(resamples, n):
+            idx = rng.permuted(np.tile(np.arange(n), (count, 1)), axis=1)
+            r[start:start + count] = (yc[idx] @ xc) * scale
+    return r
+
+
+def correlation_stats(x: np.ndarray, y: np.ndarray, resamples: int = RESAMPLES, rng: np.random.Generator = None) -> list:
+    """
+    Returns a list with a dict of STAT_COLUMNS for each column of x (rows are samples) against y:
+    Pearson r with its bootstrap confidence interval, Spearman r, the least-squares slope with its
+    bootstrap interval, the intercept and r squared, the two-sided permutation p-value of r, and the
+    mean of y with and without a non-zero predictor.  Statistics that cannot be computed (a constant predictor, or fewer than
+    MIN_SAMPLES samples) are NaN.
+    """
+    n, predictors = x.shape
+    stats = [dict.fromkeys(STAT_COLUMNS, np.nan) for _ in range(predictors)]
+    for j, row in enumerate(stats):
+        upgraded = x[:, j] != 0
+        row["mean_delta_upgraded"] = y[upgraded].mean() if upgraded.any() else np.nan
+        row["mean_delta_not_upgraded"] = y[~upgraded].mean() if (~upgraded).any() else np.nan
+    if n < MIN_SAMPLES or np.ptp(y) == 0:
+        return stats
+
+    rng = rng or np.random.default_rng(SEED)
+    r, slope = _pearson_rows(x.T, np.broadcast_to(y, (predictors, n)))
+    boot_r, boot_slope = bootstrap(x, y, resamples, rng)
+    perm_r = permutation_r(x, y, resamples, rng)
+    x_ranks = pd.DataFrame(x).rank().to_numpy()
+    spearman, _ = _pearson_rows(x_ranks.T, np.broadcast_to(pd.Series(y).rank().to_numpy(), (predictors, n)))
+    tails = [50 * (1 - CONFIDENCE), 50 * (1 + CONFIDENCE)]
+
+    for j, row in enumerate(stats):
+        if np.ptp(x[:, j]) == 0:
+            continue
+        r_ci = np.nanpercentile(boot_r[:, j], tails)
+        slope_ci = np.nanpercentile(boot_slope[:, j], tails)
+        # Counting the observed statistic among the permutations keeps p above zero
+        exceed = np.count_nonzero(np.abs(perm_r[:, j]) >= abs(r[j]) * (1 - 1e-12))
+        row.update({
+            "r": r[j],
+            "r_ci_low": r_ci[0],
+            "r_ci_high": r_ci[1],
+            "spearman_r": spearman[j],
+            "slope": slope[j],
+            "slope_ci_low": slope_ci[0],
+            "slope_ci_high": slope_ci[1],
+            "intercept": y.mean() - slope[j] * x[:, j].mean(),
+            "r_squared": r[j] ** 2,
+            "p_value": (exceed + 1) / (resamples + 1),
+        })
+    return stats
+
+
+def _group_stats(task) -> list:
+    # Runs in a worker process, so takes and returns plain values only
+    group, x, y, resamples, seed = task
+    rng = np.random.default_rng([seed, zlib.crc32(repr(group).encode("utf-8"))])
+    stats = correlation_stats(x, y, resamples, rng)
+    scope, season_year, team = group
+    return [{"scope": scope, "season_year": season_year, "team_name_mapped": team, "predictor": predictor,
+             "n": len(y), **row} for predictor, row in zip(PREDICTORS, stats)]
+
+
+def analysis_groups(df_deltas: pd.DataFrame) -> list:
+    """Returns ((scope, season_year, team_name_mapped), row mask) for all races, each season and each team."""
+    groups = [(("all", None, None), np.ones(len(df_deltas), dtype=bool))]
+    seasons = df_deltas["season_year"].to_numpy()
+    teams = df_deltas["team_name_mapped"].astype(str).to_numpy()
+    groups += [(("season", int(season), None), seasons == season) for season in np.unique(seasons)]
+    groups += [(("team", None, team), teams == team) for team in np.unique(teams)]
+    return groups
+
+
+def analyze_upgrades(df_perf_merged: pd.DataFrame, resamples: int = RESAMPLES, seed: int = SEED, max_workers: int = 1) -> pd.DataFrame:
+    """
+    Returns one row per group (all races, each season, each team) and predictor, with the number of
+    team races with a score delta and the statistics of correlation_stats.  With max_workers above 1,
+    the groups are spread across that many processes.
+    """
+    df_deltas = team_race_deltas(df_perf_merged).dropna(subset=["score_delta"])
+    x = df_deltas[PREDICTORS].to_numpy(dtype=float)
+    y = df_deltas["score_delta"].to_numpy(dtype=float)
+    tasks = [(group, x[mask], y[mask], resamples, seed) for group, mask in analysis_groups(df_deltas)]
+    logging.info(f"Analyzing {len(df_deltas)} team races in {len(tasks)} groups with {resamples} resamples each")
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_group_stats, tasks))
+    else:
+        results = [_group_stats(task) for task in tasks]
+    df = pd.DataFrame([row for rows in results for row in rows])
+    return df.astype({"season_year": "Int16"})
+
+
+@instrumentation.timed("upgrade_correlation")
+def main(resamples: int = RESAMPLES, max_workers: int = 1):
+    df_perf_merged = load_perf_and_upgrades()
+    if df_perf_merged is None:
+        logging.error("No performance and upgrades output yet; run process_upgrades.py first")
+        return
+    df = analyze_upgrades(df_perf_merged, resamples, max_workers=max_workers)
+    df.to_csv(OUTPUT_FILE_UPGRADE_CORRELATION, index=False)
+    for row in df[df["scope"] == "all"].itertuples():
+        logging.info(f"{row.predictor} vs score delta over {row.n} team races: r = {row.r:.3f} "
+                     f"[{row.r_ci_low:.3f}, {row.r_ci_high:.3f}], slope = {row.slope:.3f}, p = {row.p_value:.4f}")
+    logging.info(f"Saved {len(df)} rows to {OUTPUT_FILE_UPGRADE_CORRELATION}")
+    instrumentation.set_rows(len(df))
+
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Correlate team upgrades with race-to-race changes in weighted score.")
+    parser.add_argument("--resamples", type=int, default=RESAMPLES, help="bootstrap resamples and permutations per group")
+    parser.add_argument("--workers", type=int, default=1, help="processes to spread the groups across")
+    args = parser.parse_args()
+    main(args.resamples, args.workers)
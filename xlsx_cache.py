@@ -0,0 +1,90 @@
+"""
+Transparent Parquet cache for spreadsheet inputs.  read_excel_cached() parses a workbook with openpyxl
+only when it has changed since the last read, and otherwise loads the DataFrame from a Parquet sidecar in
+CACHE_FOLDER_XLSX.  A workbook is unchanged if its size and modification time match the sidecar's, or,
+failing that, if its SHA-256 does (for example after a copy or checkout that only touched the mtime).
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import pandas as pd
+
+import instrumentation
+from common import CACHE_FOLDER_XLSX
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sidecar_paths(path: str, cache_folder: str = CACHE_FOLDER_XLSX):
+    """Returns the (Parquet, metadata JSON) sidecar paths for a workbook."""
+    name = os.path.basename(path)
+    return os.path.join(cache_folder, f"{name}.parquet"), os.path.join(cache_folder, f"{name}.json")
+
+
+def _load_meta(meta_path: str) -> dict:
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_meta(meta_path: str, meta: dict):
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def read_excel_cached(path: str, cache_folder: str = CACHE_FOLDER_XLSX) -> pd.DataFrame:
+    """
+    Returns pd.read_excel(path), from the Parquet sidecar when the workbook is unchanged.  The sidecar is
+    rebuilt whenever the workbook is parsed; if the DataFrame cannot be stored as Parquet (for example a
+    column mixing numbers and text), it is returned uncached.
+    """
+    parquet_path, meta_path = sidecar_paths(path, cache_folder)
+    stat = os.stat(path)
+    meta = _load_meta(meta_path)
+    sha256 = None
+    if meta and os.path.exists(parquet_path):
+        unchanged = meta.get("size") == stat.st_size and meta.get("mtime_ns") == stat.st_mtime_ns
+        if not unchanged:
+            sha256 = _file_sha256(path)
+            unchanged = meta.get("sha256") == sha256
+            if unchanged:
+                _save_meta(meta_path, {**meta, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+        if unchanged:
+            instrumentation.record_cache("xlsx", hit=True)
+            logging.info(f"Loaded {path} from cache {parquet_path}")
+            return pd.read_parquet(parquet_path)
+
+    instrumentation.record_cache("xlsx", hit=False)
+    df = pd.read_excel(path)
+    os.makedirs(cache_folder, exist_ok=True)
+    tmp_path = f"{parquet_path}.tmp"
+    try:
+        df.to_parquet(tmp_path, index=False)
+    except (TypeError, ValueError) as e:
+        # pyarrow's ArrowInvalid and ArrowTypeError are subclasses of these
+        logging.warning(f"Not caching {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return df
+    os.replace(tmp_path, parquet_path)
+    _save_meta(meta_path, {
+        "source": path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256 or _file_sha256(path),
+    })
+    logging.info(f"Cached {path} to {parquet_path}")
+    return df